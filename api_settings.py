@@ -25,3 +25,40 @@ MT_STUDY_DAILY_FLOWS_NEEDED_DE = 50
 
 MST_TIMEOUT_SECONDS = 3600
 # MST_TIMEOUT_SECONDS = 20 in working prototype
+MST_MAX_CONCURRENT_REQUESTS = 8  # concurrent status_context requests per mastodon instance
+MST_TEXT_CACHE_SIZE = 100000  # texts of statuses kept by id, statuses often show up in several contexts
+MST_TEXT_PROCESSES = None  # processes converting the html of large batches, None converts in the process
+
+RESPONSE_CACHE_TTL_SECONDS = 7 * 24 * 3600  # responses older than a week are downloaded again in record mode
+RESPONSE_CACHE_MAX_BYTES = 2 * 1024 ** 3
+RESPONSE_CACHE_ENDPOINT_TTL_SECONDS = {  # endpoints that change faster, 0 downloads them again in every recording
+    "listing": 0,  # reddit subreddit, search and user listings
+    "timeline_hashtag": 0,
+    "account_statuses": 0,
+    "search_v2": 0,
+    "search_recent": 0,
+    "search_all": 3600,
+    "comments": 24 * 3600,  # reddit submissions with their comments
+    "morechildren": 24 * 3600,
+    "status_context": 24 * 3600,
+}
+
+REDDIT_REQUESTS_PER_MINUTE = 100  # token bucket of the rate limit scheduler, shared by all threads sending to reddit
+REDDIT_EXPANSION_WORKERS = 4  # submissions whose comments are expanded in parallel
+REDDIT_TOO_MANY_REQUESTS_PAUSE = 600  # only used if reddit answers with too many requests without a reset header
+REDDIT_MAX_EXPANSION_REQUESTS = 20  # requests spent on the MoreComments of one submission in budgeted mode
+REDDIT_COMPACT_PAYLOAD = True  # rd_data holds a dict of scalar fields instead of the praw object
+
+DAILY_SAMPLER_FAN_OUT = 4  # subreddits or hashtags sampled at the same time in fan-out mode
+
+SAMPLER_STATE_PATH = "delab_sampler_state.sqlite"  # daily picks and yields of the sources, shared by processes
+SAMPLER_EXPLORATION_RATE = 0.2  # chance of picking a random source instead of the one with the best yield
+
+ID_INTERNER_PATH = "delab_ids.sqlite"  # dense reddit post and author ids, stable across runs and processes
+
+TREE_STORE_PATH = "delab_tree_store"  # directory of the parquet files written by tree_store.TreeStore
+
+JOB_CHECKPOINT_PATH = "delab_jobs.sqlite"  # finished units of resumable jobs (url lists, user crawls, daily samples)
+
+CONNECTOR_POOL_CONNECTIONS = 4  # hosts per connector whose connections are kept alive
+CONNECTOR_POOL_SIZE = 32  # connections kept alive per host, at least the number of threads sharing a connector
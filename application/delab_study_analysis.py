@@ -5,6 +5,9 @@ import pandas as pd
 from dotenv import load_dotenv
 from delab_trees.main import TreeManager
 
+from models.platform import PLATFORM
+from tree_store import TreeStore
+
 load_dotenv()
 
 # %%
@@ -15,7 +18,8 @@ print(reddit_user)
 # %%
 
 # df = pd.read_csv("delab_study2_reddit.csv", quoting=csv.QUOTE_ALL)
-df = pd.read_pickle("delab_study2_reddit.pkl")
+# df = pd.read_pickle("delab_study2_reddit.pkl")
+df = TreeStore().read_trees(platform=PLATFORM.REDDIT)
 
 df_calms = df[df["tw_author__name"] == reddit_user]
 print(df_calms.shape)
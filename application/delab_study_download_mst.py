@@ -5,6 +5,7 @@ import pandas as pd
 
 from models.platform import PLATFORM
 from socialmedia import get_conversations_by_user
+from tree_store import TreeStore
 
 load_dotenv()
 
@@ -27,4 +28,5 @@ df_mastodon["platform"] = PLATFORM.MASTODON
 # df_all = pd.concat([df_mastodon, df_reddit])
 
 # %%
-df_mastodon.to_csv("delab_study2_mst.csv")
+# df_mastodon.to_csv("delab_study2_mst.csv")
+TreeStore().write_trees(mst_conversations, PLATFORM.MASTODON)
@@ -1,25 +1,44 @@
 import pickle
 
-import prawcore
 from dotenv import load_dotenv
 
+from connection_util import get_connector
+from job_checkpoints import JobCheckpoint, run_units
 from models.platform import PLATFORM
 # Reading the list from the file
-from socialmedia import get_conversations_by_conversation_url
+from socialmedia import get_conversations_by_conversation_urls
+from tree_store import TreeStore
 
 load_dotenv()
 
 with open('reddit_urls.pkl', 'rb') as file:
-    reddit_urls = pickle.load(file)
+    reddit_urls = list(dict.fromkeys(pickle.load(file)))
 
-trees = []
+# one praw instance for all urls, its rate limit scheduler paces the requests
+connectors = {PLATFORM.REDDIT: get_connector(PLATFORM.REDDIT)}
+
+
+def download(url):
+    """
+    :return: the tree of the url, None if it cannot be downloaded (e.g. a forbidden subreddit)
+    """
+    result = get_conversations_by_conversation_urls([url], connectors)[url]
+    if not result.is_final():
+        # e.g. network errors or too many requests, the url is downloaded again by the next run
+        raise result.error
+    return result.tree
 
-for url in reddit_urls:
-    try:
-        tree = get_conversations_by_conversation_url(url, platform=PLATFORM.REDDIT)
+
+# a restarted script only downloads the urls that are not in the checkpoint yet, each url is recorded on its own
+checkpoint = JobCheckpoint("delab_study_download_reddit")
+trees = []
+n_downloaded = 0
+for url, tree in run_units(reddit_urls, download, checkpoint, retry_errors=(Exception,)):
+    n_downloaded += 1
+    if tree is not None:
         trees.append(tree)
-    except prawcore.exceptions.Forbidden as ex:
-        pass
+if n_downloaded < len(reddit_urls):
+    print("{} urls failed and are left for the next run".format(len(reddit_urls) - n_downloaded))
 
-with open('intervention_conversations.pkl', 'wb') as file:
-    pickle.dump(trees, file)
+# read them with TreeStore().read_forest(platform=PLATFORM.REDDIT)
+TreeStore().write_trees(trees, PLATFORM.REDDIT)
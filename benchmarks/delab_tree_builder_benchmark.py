@@ -0,0 +1,69 @@
+"""
+compares building the DelabTree table through a recursive TreeNode structure (as in from_recursive_tree)
+with collecting the posts column-wise in a DelabTreeBuilder, reports time and peak memory.
+The DelabTree constructor (reply graph) is the same for both and therefore not part of the measurement.
+
+usage: python -m benchmarks.delab_tree_builder_benchmark [n_posts ...]
+"""
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+from delab_trees.recursive_tree.recursive_tree import TreeNode
+
+from benchmarks.tree_assembly_benchmark import synthetic_posts
+from datasource.delab_tree_builder import DelabTreeBuilder
+from datasource.tree_assembly import assemble_recursive_tree
+
+
+def synthetic_record(post_id):
+    return {"tree_id": "0",
+            "post_id": post_id,
+            "text": "post number {}".format(post_id),
+            "author_id": int(post_id) % 17,
+            "created_at": int(post_id),
+            "tw_author__name": "author",
+            "lang": "en"}
+
+
+def recursive_tree_construction(posts):
+    root = TreeNode(synthetic_record("0"), "0", tree_id="0")
+    nodes = [TreeNode(synthetic_record(post_id), post_id, parent_id, tree_id="0") for post_id, parent_id in posts]
+    root, orphans = assemble_recursive_tree(root, nodes)
+    return pd.DataFrame(root.to_post_list())
+
+
+def builder_construction(posts):
+    builder = DelabTreeBuilder("0", "0", synthetic_record("0"))
+    for post_id, parent_id in posts:
+        builder.add_post(post_id, parent_id, synthetic_record(post_id))
+    return builder.to_dataframe()
+
+
+def measure(construction, posts):
+    start = time.perf_counter()
+    construction(posts)
+    duration = time.perf_counter() - start
+    # memory is traced in a second run because tracing slows down the allocations
+    tracemalloc.start()
+    construction(posts)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration, peak / 2 ** 20
+
+
+def run(sizes):
+    print("{:>8} {:>14} {:>14} {:>14} {:>14}".format("posts", "recursive[s]", "builder[s]",
+                                                     "recursive[MiB]", "builder[MiB]"))
+    for n_posts in sizes:
+        # the posts arrive in order here, deep recursive trees would exceed the recursion limit of to_post_list
+        posts = sorted(synthetic_posts(n_posts), key=lambda x: int(x[0]))
+        recursive_time, recursive_memory = measure(recursive_tree_construction, posts)
+        builder_time, builder_memory = measure(builder_construction, posts)
+        print("{:>8} {:>14.4f} {:>14.4f} {:>14.2f} {:>14.2f}".format(n_posts, recursive_time, builder_time,
+                                                                     recursive_memory, builder_memory))
+
+
+if __name__ == '__main__':
+    run([int(x) for x in sys.argv[1:]] or [10, 100, 1000, 10000, 50000])
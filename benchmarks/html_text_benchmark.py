@@ -0,0 +1,75 @@
+"""
+compares BeautifulSoup(content, 'html.parser').get_text() for every status (as content_to_text did before)
+with the fast path of datasource.mastodon.html_text, and with the HtmlTextConverter that also caches the texts
+by status id and converts large batches in a process pool.
+The synthetic statuses look like mastodon content (paragraphs, mentions, hashtags, links and entities),
+every status shows up twice as the contexts of a user often overlap.
+
+usage: python -m benchmarks.html_text_benchmark [n_posts ...]
+"""
+import os
+import random
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+from datasource.mastodon.html_text import HtmlTextConverter, html_to_text
+
+
+def synthetic_content(rng, status_id):
+    mention = '<span class="h-card"><a href="https://mastodon.social/@user{0}" class="u-url mention">' \
+              '@<span>user{0}</span></a></span>'.format(rng.randrange(100))
+    hashtag = '<a href="https://mastodon.social/tags/politik" class="mention hashtag" rel="tag">' \
+              '#<span>politik</span></a>'
+    link = '<a href="https://example.org/article?id={}&amp;ref=mastodon" rel="nofollow noopener" ' \
+           'target="_blank"><span class="invisible">https://</span><span class="ellipsis">example.org/article' \
+           '</span><span class="invisible">?id=1</span></a>'.format(status_id)
+    sentence = "Das ist &quot;ein&quot; Beispiel &amp; noch mehr Text f&#252;r Status {} &lt;3".format(status_id)
+    return "<p>{} {}</p><p>{}<br />{}</p>".format(mention, sentence, hashtag, link if rng.random() < 0.5 else "")
+
+
+def synthetic_statuses(n_posts, seed=42, first_id=0):
+    rng = random.Random(seed)
+    statuses = [{"id": status_id, "content": synthetic_content(rng, status_id)}
+                for status_id in range(first_id, first_id + n_posts // 2)]
+    return statuses + statuses
+
+
+def beautiful_soup(statuses):
+    return [BeautifulSoup(status["content"], 'html.parser').get_text() for status in statuses]
+
+
+def fast_path(statuses):
+    return [html_to_text(status["content"]) for status in statuses]
+
+
+def measure(conversion, statuses):
+    start = time.perf_counter()
+    texts = conversion(statuses)
+    return time.perf_counter() - start, texts
+
+
+def run(sizes):
+    processes = os.cpu_count()
+    print("{:>8} {:>8} {:>10} {:>10} {:>14} {:>8}".format("posts", "bs4[s]", "fast[s]", "cached[s]",
+                                                          "{} procs[s]".format(processes), "speedup"))
+    for n_posts in sizes:
+        statuses = synthetic_statuses(n_posts)
+        soup_time, expected = measure(beautiful_soup, statuses)
+        fast_time, texts = measure(fast_path, statuses)
+        assert texts == expected
+        cached_time, texts = measure(HtmlTextConverter(processes=None).convert_many, statuses)
+        assert texts == expected
+        converter = HtmlTextConverter(processes=processes)
+        # the pool is started outside of the measurement, a backfill reuses it
+        converter.convert_many(synthetic_statuses(4000, first_id=-4000))
+        pool_time, texts = measure(converter.convert_many, statuses)
+        converter.close()
+        assert texts == expected
+        print("{:>8} {:>8.3f} {:>10.3f} {:>10.3f} {:>14.3f} {:>8.1f}".format(
+            n_posts, soup_time, fast_time, cached_time, pool_time, soup_time / min(cached_time, pool_time)))
+
+
+if __name__ == '__main__':
+    run([int(x) for x in sys.argv[1:]] or [1000, 10000, 100000])
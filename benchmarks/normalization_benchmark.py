@@ -0,0 +1,55 @@
+"""
+compares the per-comment python path (convert_time_stamp_to_django and str() for every id, as the reddit records
+were built before) with normalizing the id and time columns of the whole batch in datasource.normalization
+
+usage: python -m benchmarks.normalization_benchmark [n_posts ...]
+"""
+import sys
+import time
+from types import SimpleNamespace
+
+from datasource.normalization import normalize_columns
+from datasource.reddit.download_conversations_reddit import convert_time_stamp_to_django
+
+
+def synthetic_columns(n_posts):
+    return {"tree_id": [1] * n_posts,
+            "post_id": list(range(n_posts)),
+            "parent_id": [None] + [i // 3 for i in range(1, n_posts)],
+            "author_id": [i % 97 for i in range(n_posts)],
+            "created_at": [1.6e9 + i for i in range(n_posts)]}
+
+
+def per_comment(columns):
+    result = {name: [] for name in columns}
+    for tree_id, post_id, parent_id, author_id, created_utc in zip(*columns.values()):
+        result["tree_id"].append(str(tree_id))
+        result["post_id"].append(str(post_id))
+        result["parent_id"].append(None if parent_id is None else str(parent_id))
+        result["author_id"].append(str(author_id))
+        result["created_at"].append(convert_time_stamp_to_django(SimpleNamespace(created_utc=created_utc)))
+    return result
+
+
+def measure(normalization, columns, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        normalization(columns)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def run(sizes):
+    print("{:>8} {:>16} {:>12} {:>10}".format("posts", "per comment[s]", "batch[s]", "speedup"))
+    for n_posts in sizes:
+        columns = synthetic_columns(n_posts)
+        per_comment_time = measure(per_comment, columns)
+        batch_time = measure(normalize_columns, columns)
+        print("{:>8} {:>16.4f} {:>12.4f} {:>10.1f}".format(n_posts, per_comment_time, batch_time,
+                                                            per_comment_time / batch_time))
+
+
+if __name__ == '__main__':
+    run([int(x) for x in sys.argv[1:]] or [100, 1000, 10000, 100000])
@@ -0,0 +1,91 @@
+"""
+compares the memory a reddit DelabTree holds with the praw objects in rd_data (compact=False)
+and with the compact records, per 1000 posts. The praw objects are built offline from listing data
+with the fields reddit returns for a comment, the rest of the comment forest is dropped after the tree
+is built as in compute_reddit_delab_tree. Also reports the size of the pickled tree table.
+
+usage: python -m benchmarks.reddit_payload_benchmark [n_posts ...]
+"""
+import gc
+import pickle
+import sys
+import tracemalloc
+
+import praw
+
+from datasource.delab_tree_builder import DelabTreeBuilder
+from datasource.reddit.download_conversations_reddit import submission_to_record, comment_to_record
+
+
+def listing_data(thing_id, kind, parent_name):
+    # a subset of the about 60 fields of a comment in a reddit listing
+    return {"id": thing_id, "name": "{}_{}".format(kind, thing_id), "author": "author{}".format(len(thing_id) % 7),
+            "author_fullname": "t2_author", "author_flair_text": None, "author_premium": False,
+            "body": "comment {} with some text that is typical for a reply on reddit".format(thing_id),
+            "body_html": "<div class=\"md\"><p>comment {}</p></div>".format(thing_id),
+            "title": "submission", "selftext": "", "created_utc": 1.6e9, "created": 1.6e9, "edited": False,
+            "parent_id": parent_name, "link_id": "t3_root", "subreddit": "politics", "subreddit_id": "t5_2cneq",
+            "subreddit_name_prefixed": "r/politics", "subreddit_type": "public", "score": 3, "ups": 3, "downs": 0,
+            "controversiality": 0, "distinguished": None, "stickied": False, "is_submitter": False,
+            "score_hidden": False, "collapsed": False, "collapsed_reason": None, "gilded": 0, "all_awardings": [],
+            "awarders": [], "gildings": {}, "treatment_tags": [], "mod_reports": [], "user_reports": [],
+            "permalink": "/r/politics/comments/root/submission/{}/".format(thing_id), "num_comments": 0,
+            "locked": False, "archived": False, "no_follow": True, "send_replies": True, "can_gild": True,
+            "total_awards_received": 0, "depth": 1, "unrepliable_reason": None}
+
+
+def synthetic_things(reddit, n_posts):
+    submission = praw.models.Submission(reddit, _data=listing_data("root", "t3", None))
+    # loaded from the listing, praw would fetch it otherwise
+    submission._fetched = True
+    comments = []
+    parent_name = "t3_root"
+    for i in range(1, n_posts):
+        comment = praw.models.Comment(reddit, _data=listing_data("c{}".format(i), "t1", parent_name))
+        comment._submission = submission
+        comments.append(comment)
+        parent_name = comment.fullname if i % 3 else "t3_root"
+    return submission, comments
+
+
+def build_table(submission, comments, compact):
+    tree_id, data = submission_to_record(submission, "en", compact)
+    builder = DelabTreeBuilder(tree_id, tree_id, data)
+    for comment in comments:
+        node_id, parent_id, comment_data = comment_to_record(comment, tree_id, "en", compact)
+        builder.add_post(node_id, parent_id, comment_data)
+    return builder.to_dataframe()
+
+
+def measure(reddit, n_posts, compact):
+    gc.collect()
+    tracemalloc.start()
+    submission, comments = synthetic_things(reddit, n_posts)
+    table = build_table(submission, comments, compact)
+    # the caller only keeps the tree, the forest is garbage unless rd_data references it
+    del submission, comments
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    try:
+        pickled = len(pickle.dumps(table))
+    except Exception as ex:
+        pickled = None
+    return retained, pickled
+
+
+def run(sizes):
+    reddit = praw.Reddit(client_id="benchmark", client_secret="benchmark", user_agent="benchmark")
+    print("{:>8} {:>16} {:>16} {:>22} {:>24}".format("posts", "praw[KiB/1k]", "compact[KiB/1k]",
+                                                     "praw pickle[KiB/1k]", "compact pickle[KiB/1k]"))
+    for n_posts in sizes:
+        full_memory, full_pickle = measure(reddit, n_posts, compact=False)
+        compact_memory, compact_pickle = measure(reddit, n_posts, compact=True)
+        per_1k = 1000 / n_posts / 1024
+        print("{:>8} {:>16.1f} {:>16.1f} {:>22} {:>24.1f}".format(
+            n_posts, full_memory * per_1k, compact_memory * per_1k,
+            "-" if full_pickle is None else "{:.1f}".format(full_pickle * per_1k), compact_pickle * per_1k))
+
+
+if __name__ == '__main__':
+    run([int(x) for x in sys.argv[1:]] or [100, 1000, 10000])
@@ -0,0 +1,62 @@
+"""
+compares the single pass ReplyTreeAssembler with the previous find_parent_of/solve_orphans construction
+on synthetic reply trees.
+
+usage: python -m benchmarks.tree_assembly_benchmark [n_posts ...]
+"""
+import random
+import sys
+import timeit
+
+from delab_trees.recursive_tree.recursive_tree import TreeNode
+from delab_trees.recursive_tree.recursive_tree_util import solve_orphans
+
+from datasource.tree_assembly import assemble_recursive_tree
+
+
+def synthetic_posts(n_posts, seed=42):
+    """
+    creates a random reply tree where each post answers one of the earlier posts,
+    the list is shuffled a little so that some posts arrive before their parents
+    """
+    rng = random.Random(seed)
+    posts = [(str(post_id), str(rng.randrange(post_id))) for post_id in range(1, n_posts)]
+    for i in range(0, len(posts) - 1, 50):
+        posts[i], posts[i + 1] = posts[i + 1], posts[i]
+    return posts
+
+
+def to_nodes(posts):
+    root = TreeNode({"text": ""}, "0", tree_id="0")
+    nodes = [TreeNode({"text": ""}, post_id, parent_id, tree_id="0") for post_id, parent_id in posts]
+    return root, nodes
+
+
+def legacy_construction(posts):
+    root, nodes = to_nodes(posts)
+    orphans = []
+    for node in nodes:
+        if not root.find_parent_of(node):
+            orphans.append(node)
+    orphan_added = True
+    while orphan_added:
+        orphan_added, orphans = solve_orphans(orphans, root)
+    return root, orphans
+
+
+def assembler_construction(posts):
+    root, nodes = to_nodes(posts)
+    return assemble_recursive_tree(root, nodes)
+
+
+def run(sizes):
+    print("{:>8} {:>12} {:>12} {:>8}".format("posts", "legacy[s]", "assembler[s]", "speedup"))
+    for n_posts in sizes:
+        posts = synthetic_posts(n_posts)
+        legacy = min(timeit.repeat(lambda: legacy_construction(posts), number=1, repeat=3))
+        assembler = min(timeit.repeat(lambda: assembler_construction(posts), number=1, repeat=3))
+        print("{:>8} {:>12.4f} {:>12.4f} {:>7.1f}x".format(n_posts, legacy, assembler, legacy / assembler))
+
+
+if __name__ == '__main__':
+    run([int(x) for x in sys.argv[1:]] or [100, 1000, 5000, 20000])
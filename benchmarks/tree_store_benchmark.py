@@ -0,0 +1,72 @@
+"""
+compares writing and reading the posts of synthetic trees as csv, as pickle of the tree objects
+and with the parquet TreeStore (also reading only two columns). Requires pyarrow.
+
+usage: python -m benchmarks.tree_store_benchmark [n_posts ...]
+"""
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from datasource.delab_tree_builder import DelabTreeBuilder
+from models.language import LANGUAGE
+from models.platform import PLATFORM
+from tree_store import TreeStore
+
+POSTS_PER_TREE = 50
+
+
+def synthetic_trees(n_posts):
+    start = pd.Timestamp("2023-01-01", tz="UTC")
+    trees = []
+    for tree_id in range(0, n_posts, POSTS_PER_TREE):
+        builder = DelabTreeBuilder(tree_id, tree_id, {"text": "root post " * 10, "author_id": 1, "created_at": start,
+                                                      "lang": "en", "url": "https://reddit.com/r/x/{}".format(tree_id)})
+        for post_id in range(tree_id + 1, tree_id + POSTS_PER_TREE):
+            builder.add_post(post_id, tree_id + (post_id - tree_id) // 3,
+                             {"text": "reply with some text " * 5, "author_id": post_id % 37, "lang": "en",
+                              "created_at": start + pd.Timedelta(seconds=post_id), "url": "https://reddit.com"})
+        trees.append(builder.to_delab_tree())
+    return trees
+
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def run(sizes):
+    print("{:>8} {:>10} {:>10} {:>12} {:>12} {:>14} {:>14} {:>16}".format(
+        "posts", "csv w[s]", "csv r[s]", "pickle w[s]", "pickle r[s]", "parquet w[s]", "parquet r[s]",
+        "2 columns r[s]"))
+    for n_posts in sizes:
+        trees = synthetic_trees(n_posts)
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = os.path.join(directory, "trees.csv")
+            pickle_path = os.path.join(directory, "trees.pkl")
+            store = TreeStore(os.path.join(directory, "store"))
+
+            def write_pickle():
+                with open(pickle_path, "wb") as file:
+                    pickle.dump(trees, file)
+
+            def read_pickle():
+                with open(pickle_path, "rb") as file:
+                    pickle.load(file)
+
+            times = [timed(lambda: pd.concat([tree.df for tree in trees]).to_csv(csv_path)),
+                     timed(lambda: pd.read_csv(csv_path)),
+                     timed(write_pickle), timed(read_pickle),
+                     timed(lambda: store.write_trees(trees, PLATFORM.REDDIT, LANGUAGE.ENGLISH)),
+                     timed(lambda: store.read_trees(platform=PLATFORM.REDDIT)),
+                     timed(lambda: store.read_trees(platform=PLATFORM.REDDIT, columns=["tree_id", "text"]))]
+        print("{:>8} {:>10.3f} {:>10.3f} {:>12.3f} {:>12.3f} {:>14.3f} {:>14.3f} {:>16.3f}".format(n_posts, *times))
+
+
+if __name__ == '__main__':
+    run([int(x) for x in sys.argv[1:]] or [10000, 100000])
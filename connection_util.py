@@ -1,11 +1,19 @@
 import logging
 import os
+import threading
+import weakref
 
 import praw
 import yaml
 from mastodon import Mastodon
+from requests.adapters import HTTPAdapter
 from twarc import Twarc2
 
+from api_settings import CONNECTOR_POOL_CONNECTIONS, CONNECTOR_POOL_SIZE
+from models.platform import PLATFORM
+from rate_limits import RATE_LIMITS, RateLimitedSession, endpoint_of
+from response_cache import CACHE_MODE, install_response_cache
+
 logger = logging.getLogger(__name__)
 
 
@@ -55,7 +63,8 @@ class ConnectionUtil:
 
 class DelabTwarc(Twarc2):
     def __init__(self, access_token=None, access_token_secret=None, bearer_token=None, consumer_key=None,
-                 consumer_secret=None, use_yaml=False, yaml_path=None):
+                 consumer_secret=None, use_yaml=False, yaml_path=None, cache=None, cache_mode=CACHE_MODE.RECORD,
+                 rate_limits=RATE_LIMITS):
         """
         create the Twitter connector
         :param access_token:
@@ -65,15 +74,51 @@ class DelabTwarc(Twarc2):
         :param consumer_secret:
         :param use_yaml:
         :param yaml_path:
+        :param cache: ResponseCache to record or replay the api responses
+        :param cache_mode: CACHE_MODE.RECORD or CACHE_MODE.REPLAY
+        :param rate_limits: RateLimitScheduler that delays the requests if a quota is spent
         """
+        self.rate_limits = rate_limits
         if use_yaml:
             access_token, access_token_secret, bearer_token, consumer_key, consumer_secret = ConnectionUtil.get_secret(
                 yaml_path)
+        # the arguments a copy for another thread is created with, see ConnectorPool
+        self.settings = dict(access_token=access_token, access_token_secret=access_token_secret,
+                             bearer_token=bearer_token, consumer_key=consumer_key, consumer_secret=consumer_secret,
+                             cache=cache, cache_mode=cache_mode, rate_limits=rate_limits)
         super().__init__(consumer_key, consumer_secret, access_token, access_token_secret, bearer_token)
+        if cache is not None:
+            install_response_cache(self, PLATFORM.TWITTER, cache, cache_mode)
+
+    def copy(self):
+        """
+        :return: a new client with the same credentials, cache and rate limits
+        """
+        return DelabTwarc(**self.settings)
+
+    @property
+    def http_session(self):
+        return self.client
+
+    def connect(self):
+        # twarc replaces its session when reconnecting, the new one gets the same pool
+        super().connect()
+        if self.client is not None:
+            mount_connection_pool(self.client)
+
+    def get(self, *args, **kwargs):
+        # twarc sends all api calls through get, its session is replaced when reconnecting
+        url = args[0] if len(args) > 0 else kwargs.get("url")
+        endpoint = endpoint_of(PLATFORM.TWITTER, url)
+        self.rate_limits.before_request(PLATFORM.TWITTER, endpoint)
+        response = super().get(*args, **kwargs)
+        if response is not None:
+            self.rate_limits.after_response(PLATFORM.TWITTER, endpoint, response)
+        return response
 
 
 def get_praw(reddit_secret=None, reddit_script_id=None, reddit_user=None, reddit_password=None, user_agent=None,
-             use_yaml=False, yaml_path=None):
+             use_yaml=False, yaml_path=None, cache=None, cache_mode=CACHE_MODE.RECORD, rate_limits=RATE_LIMITS):
     """
     create the Reddit connector
     :param reddit_secret:
@@ -83,18 +128,30 @@ def get_praw(reddit_secret=None, reddit_script_id=None, reddit_user=None, reddit
     :param user_agent:
     :param use_yaml:
     :param yaml_path:
+    :param cache: ResponseCache to record or replay the api responses
+    :param cache_mode: CACHE_MODE.RECORD or CACHE_MODE.REPLAY (works without credentials)
+    :param rate_limits: RateLimitScheduler that delays the requests if the quota is spent
     :return:
     """
 
     user_agent = "django_script:de.uni-goettingen.delab:v0.0.1 (by u/CalmAsTheSea)"
     reddit_secret, reddit_script_id, reddit_user, reddit_password = ConnectionUtil.get_reddit_secret(
         yaml_path=yaml_path, use_yaml=use_yaml)
+    if cache is not None and cache_mode == CACHE_MODE.REPLAY and reddit_script_id is None:
+        # praw does not connect before the first request, which is answered by the cache when replaying
+        reddit_script_id, reddit_secret = "replay", "replay"
 
+    session = pooled_session(PLATFORM.REDDIT, rate_limits)
     reddit = praw.Reddit(client_id=reddit_script_id,
                          client_secret=reddit_secret,
                          user_agent=user_agent,
                          username=reddit_user,
-                         password=reddit_password)
+                         password=reddit_password,
+                         requestor_kwargs={"session": session})
+    reddit.rate_limits = rate_limits
+    reddit.http_session = session
+    if cache is not None:
+        install_response_cache(reddit, PLATFORM.REDDIT, cache, cache_mode)
     return reddit
 
 
@@ -103,7 +160,10 @@ def create_mastodon(client_id=None,
                     access_token=None,
                     api_base_url="https://mastodon.social/",
                     use_yaml=False,
-                    yaml_path=None):
+                    yaml_path=None,
+                    cache=None,
+                    cache_mode=CACHE_MODE.RECORD,
+                    rate_limits=RATE_LIMITS):
     """
     Create the Mastodon connector
     You have to register your application in the mastodon web app first,
@@ -115,6 +175,9 @@ def create_mastodon(client_id=None,
     :param api_base_url:
     :param use_yaml:
     :param yaml_path:
+    :param cache: ResponseCache to record or replay the api responses
+    :param cache_mode: CACHE_MODE.RECORD or CACHE_MODE.REPLAY
+    :param rate_limits: RateLimitScheduler that delays the requests if the quota of the instance is spent
     :return:
     """
     if client_id is None:
@@ -127,6 +190,309 @@ def create_mastodon(client_id=None,
                 access_token = access["access_token"],
 
     mastodon = Mastodon(client_id=client_id, client_secret=client_secret, access_token=access_token,
-                        api_base_url=api_base_url
+                        api_base_url=api_base_url,
+                        session=pooled_session(PLATFORM.MASTODON, rate_limits)
                         )
+    mastodon.http_session = mastodon.session
+    if cache is not None:
+        install_response_cache(mastodon, PLATFORM.MASTODON, cache, cache_mode)
     return mastodon
+
+
+# the clients that must not be used by two threads at the same time
+THREAD_BOUND_PLATFORMS = (PLATFORM.REDDIT, PLATFORM.TWITTER)
+PRAW_CREDENTIALS = ("client_id", "client_secret", "username", "password", "user_agent")
+
+
+def copy_praw(reddit):
+    """
+    :param reddit: praw instance
+    :return: a new praw instance that logs in with the same credentials and shares the http session
+             (connection pool and rate limits) and the response cache of reddit
+    """
+    config = reddit.config
+    # the settings that were not given are not strings (None or praw's placeholder)
+    credentials = {name: getattr(config, name, None) for name in PRAW_CREDENTIALS}
+    kwargs = {name: value for name, value in credentials.items() if isinstance(value, str)}
+    session = getattr(reddit, "http_session", None)
+    if session is not None:
+        kwargs["requestor_kwargs"] = {"session": session}
+    copy = praw.Reddit(**kwargs)
+    for name in ("rate_limits", "http_session"):
+        if hasattr(reddit, name):
+            setattr(copy, name, getattr(reddit, name))
+    response_cache = getattr(reddit, "response_cache", None)
+    if response_cache is not None:
+        install_response_cache(copy, PLATFORM.REDDIT, response_cache, reddit.response_cache_mode)
+    return copy
+
+
+class ThreadCopy:
+    def __init__(self, connector):
+        self.connector = connector
+
+
+class ConnectorPool:
+    """
+    praw is not thread-safe (the prawcore session with its rate limiter and oauth token) and neither is twarc
+    (its session is replaced when it reconnects), so every thread uses its own copy of the connector.
+    The thread that created the pool uses the connector itself. The copy of a thread is handed to the next thread
+    when the thread ends, so that the copies do not log in again for every thread pool.
+    """
+
+    def __init__(self, platform, connector):
+        self.platform = platform
+        self.connector = connector
+        self.owner = threading.get_ident()
+        self.copies = []
+        self.idle = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return "ConnectorPool of {} with {} copies".format(self.platform, len(self.copies))
+
+    def for_thread(self):
+        """
+        :return: the connector or the copy of the current thread
+        """
+        if threading.get_ident() == self.owner:
+            return self.connector
+        holder = getattr(self.local, "holder", None)
+        if holder is None:
+            with self.lock:
+                copy = self.idle.pop() if len(self.idle) > 0 else None
+            if copy is None:
+                copy = self.connector.copy() if hasattr(self.connector, "copy") else copy_praw(self.connector)
+                # copies of copies are taken from the same pool
+                copy.connector_pool = self
+                with self.lock:
+                    self.copies.append(copy)
+            holder = ThreadCopy(copy)
+            # the local data of a thread is released when it ends
+            weakref.finalize(holder, self.release, copy)
+            self.local.holder = holder
+        return holder.connector
+
+    def release(self, copy):
+        with self.lock:
+            self.idle.append(copy)
+
+    def sessions(self):
+        """
+        :return: the http sessions of the connector and its copies, each once
+        """
+        with self.lock:
+            connectors = [self.connector] + self.copies
+        sessions = {}
+        for connector in connectors:
+            session = getattr(connector, "http_session", None)
+            if session is not None:
+                sessions[id(session)] = session
+        return list(sessions.values())
+
+
+_connector_pool_lock = threading.Lock()
+
+
+def connector_pool(connector, platform):
+    """
+    :return: the ConnectorPool of the connector, created with the current thread as its owner
+             (call it before the connector is handed to worker threads)
+    """
+    with _connector_pool_lock:
+        pool = getattr(connector, "connector_pool", None)
+        if pool is None:
+            pool = ConnectorPool(platform, connector)
+            connector.connector_pool = pool
+        return pool
+
+
+def thread_connector(connector, platform):
+    """
+    :param connector: the connector shared by the threads
+    :param platform:
+    :return: the connector to use in the current thread, a copy of it for praw and twarc (see ConnectorPool)
+    """
+    if platform not in THREAD_BOUND_PLATFORMS:
+        return connector
+    return connector_pool(connector, platform).for_thread()
+
+
+def mount_connection_pool(session):
+    """
+    keeps up to CONNECTOR_POOL_SIZE connections per host alive, so that parallel workers
+    (expansion workers, context fetches, fan-out) reuse them instead of opening new ones
+    """
+    adapter = HTTPAdapter(pool_connections=CONNECTOR_POOL_CONNECTIONS, pool_maxsize=CONNECTOR_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def pooled_session(platform, rate_limits=RATE_LIMITS):
+    return mount_connection_pool(RateLimitedSession(platform, rate_limits))
+
+
+def connection_pool_stats(session):
+    """
+    :param session: requests session
+    :return: (connections opened, requests sent) over the connection pools of the session
+    """
+    n_connections = n_requests = 0
+    if session is None:
+        return n_connections, n_requests
+    # the same adapter is mounted for http and https
+    for adapter in {id(adapter): adapter for adapter in session.adapters.values()}.values():
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            n_connections += pool.num_connections
+            n_requests += pool.num_requests
+    return n_connections, n_requests
+
+
+def connector_sessions(connector):
+    """
+    :return: the http sessions of the connector and of its copies for other threads
+    """
+    pool = getattr(connector, "connector_pool", None)
+    if pool is not None:
+        return pool.sessions()
+    session = getattr(connector, "http_session", None)
+    return [] if session is None else [session]
+
+
+def connector_pool_stats(connector):
+    """
+    :return: (connections opened, requests sent) over the sessions of the connector and its copies
+    """
+    n_connections = n_requests = 0
+    for session in connector_sessions(connector):
+        session_connections, session_requests = connection_pool_stats(session)
+        n_connections += session_connections
+        n_requests += session_requests
+    return n_connections, n_requests
+
+
+class ConnectorStats:
+    def __init__(self, n_created=0, n_reused=0, n_connections=0, n_requests=0):
+        self.n_created = n_created
+        self.n_reused = n_reused
+        self.n_connections = n_connections
+        self.n_requests = n_requests
+
+    def __str__(self):
+        return "{} connectors created, {} reused, {} requests over {} connections ({} handshakes avoided)".format(
+            self.n_created, self.n_reused, self.n_requests, self.n_connections, self.handshakes_avoided())
+
+    def handshakes_avoided(self):
+        """
+        :return: the requests that were sent over a connection that was already open
+        """
+        return self.n_requests - self.n_connections
+
+
+class ConnectorRegistry:
+    """
+    Hands out one connector per platform for the whole process, created on first use.
+    The connectors share the rate limits and keep their connections alive, so that helpers called
+    without a connector do not log in and connect again.
+    Mastodon.py is shared by all threads. praw and twarc are not thread-safe, so other threads than the one
+    that created the connector get their own copy (see ConnectorPool), the praw copies share the connection pool.
+    """
+
+    FACTORIES = {PLATFORM.REDDIT: get_praw, PLATFORM.MASTODON: create_mastodon, PLATFORM.TWITTER: DelabTwarc}
+
+    def __init__(self):
+        self.connectors = {}
+        self.settings = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return "\n".join("{}: {}".format(platform, stats) for platform, stats in self.get_stats().items())
+
+    def configure(self, platform, **kwargs):
+        """
+        sets the arguments the connector of the platform is created with (e.g. use_yaml, yaml_path, cache),
+        a connector created before is closed
+        """
+        self.close(platform)
+        with self.lock:
+            self.settings[platform] = kwargs
+
+    def register(self, platform, connector):
+        """
+        uses a connector created by the caller for the platform
+        """
+        self.close(platform)
+        with self.lock:
+            self.connectors[platform] = connector
+
+    def get(self, platform):
+        """
+        :param platform:
+        :return: the shared connector of the platform or the copy of the current thread
+        """
+        with self.lock:
+            stats = self.stats.setdefault(platform, ConnectorStats())
+            if platform in self.connectors:
+                stats.n_reused += 1
+                connector = self.connectors[platform]
+            else:
+                connector = self.FACTORIES[platform](**self.settings.get(platform, {}))
+                connector_pool(connector, platform)
+                stats.n_created += 1
+                self.connectors[platform] = connector
+        return thread_connector(connector, platform)
+
+    def get_stats(self):
+        """
+        :return: dict of platform to ConnectorStats, including the connection pools of the current connectors
+        """
+        with self.lock:
+            result = {}
+            for platform, stats in self.stats.items():
+                n_connections, n_requests = connector_pool_stats(self.connectors.get(platform))
+                result[platform] = ConnectorStats(stats.n_created, stats.n_reused,
+                                                  stats.n_connections + n_connections,
+                                                  stats.n_requests + n_requests)
+            return result
+
+    def close(self, platform=None):
+        """
+        closes the connections of the connector (of all connectors if platform is None),
+        the next get creates a new one
+        """
+        with self.lock:
+            platforms = list(self.connectors) if platform is None else [platform]
+            for name in platforms:
+                connector = self.connectors.pop(name, None)
+                if connector is None:
+                    continue
+                # the pools of a closed connector still count for the stats
+                n_connections, n_requests = connector_pool_stats(connector)
+                stats = self.stats.setdefault(name, ConnectorStats())
+                stats.n_connections += n_connections
+                stats.n_requests += n_requests
+                for session in connector_sessions(connector):
+                    session.close()
+
+
+# the connectors shared by the functions that are called without one
+CONNECTORS = ConnectorRegistry()
+
+
+def get_connector(platform):
+    """
+    :param platform:
+    :return: the connector of the platform shared by the process, see ConnectorRegistry
+    """
+    return CONNECTORS.get(platform)
+
+
+def close_connectors():
+    CONNECTORS.close()
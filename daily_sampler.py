@@ -1,68 +1,316 @@
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import pandas as pd
 
 from api_settings import *
+from connection_util import THREAD_BOUND_PLATFORMS, connector_pool, thread_connector
+from datasource.candidate_ranking import FlowYield
 from datasource.mastodon.download_daily_political_sample_mstd import MTSampler
 from datasource.reddit.download_daily_political_rd_sample import RD_Sampler
 from datasource.twitter.download_daily_political_sample import download_daily_political_sample
 from delab_trees import TreeManager
+from delab_trees.constants import TABLE
 from delab_trees.delab_post import DelabPost
 from delab_trees.delab_tree import DelabTree
+from delab_trees.util import get_root
+from download_exceptions import NoDailySubredditAvailableException, NoDailyMTHashtagsAvailableException
 from models.language import LANGUAGE
 from models.platform import PLATFORM
+from rate_limits import RATE_LIMITS, counting_requests
+from sampler_state import get_sampler_state
 
 logger = logging.getLogger(__name__)
 
 
-def download_samples(platform, min_results, language, connector) -> list[list[DelabPost]]:
-    result = []
-    flow_result_count = 0
-    while flow_result_count < min_results:
-        downloaded_trees = download_daily_sample(platform=platform, language=language, connector=connector)
-        validated_trees = validate_trees(downloaded_trees, platform)
+def download_samples(platform, min_results, language, connector, fan_out=1, state=None,
+                     checkpoint=None) -> list[list[DelabPost]]:
+    """
+    @param platform:
+    @param min_results: the number of flows needed
+    @param language:
+    @param connector:
+    @param fan_out: number of subreddits or hashtags sampled at the same time, 1 samples them one after another
+    @param state: SamplerState that picks the subreddits and hashtags and records their yield
+    @param checkpoint: JobCheckpoint, the trees of every sampled source are recorded in it
+    and a restarted sample starts with the trees recorded before
+    @return:
+    """
+    if state is None:
+        state = get_sampler_state()
+    if fan_out > 1:
+        return download_samples_concurrently(platform, min_results, language, connector, fan_out, state, checkpoint)
+    sampler = IncrementalFlowSampler()
+    restore_source_samples(sampler, checkpoint, platform)
+    flow_yield = FlowYield(platform, RATE_LIMITS)
+    while len(sampler) < min_results:
+        source_sample = download_source_sample(platform=platform, language=language, connector=connector,
+                                               state=state)
+        add_source_sample(sampler, source_sample, platform, language, state, checkpoint)
+    logger.info(flow_yield.report(len(sampler)))
+    return sampler.flows
+
+
+def download_samples_concurrently(platform, min_results, language, connector, fan_out=DAILY_SAMPLER_FAN_OUT,
+                                  state=None, checkpoint=None, source_sampler=None) -> list[list[DelabPost]]:
+    """
+    samples fan_out sources of the daily pool at the same time, the flows of each source are merged as soon as
+    it is finished. Once min_results flows are found, the sources not started yet are cancelled
+    and the running ones are asked to stop.
+    @param connector: each worker thread uses its own copy of a praw or twarc connector (see ConnectorPool)
+    @param source_sampler: function with the arguments of download_source_sample that samples one source,
+    download_source_sample if None
+    """
+    if source_sampler is None:
+        source_sampler = download_source_sample
+    if state is None:
+        state = get_sampler_state()
+    sampler = IncrementalFlowSampler()
+    restore_source_samples(sampler, checkpoint, platform)
+    if len(sampler) >= min_results:
+        return sampler.flows
+    flow_yield = FlowYield(platform, RATE_LIMITS)
+    cancel_event = threading.Event()
+    pool_exhausted = None
+    if connector is not None and platform in THREAD_BOUND_PLATFORMS:
+        connector_pool(connector, platform)
+    executor = ThreadPoolExecutor(max_workers=fan_out)
 
-        if len(validated_trees) > 0:
-            forest = TreeManager.from_trees(validated_trees)
+    def sample_source():
+        worker_connector = None if connector is None else thread_connector(connector, platform)
+        return source_sampler(platform=platform, language=language, connector=worker_connector,
+                              cancel_event=cancel_event, state=state)
 
-            flow_sample: list[list[DelabPost]] = forest.get_flow_sample(5, filter_function=meta_list_filter)
-            if flow_sample is not None and len(flow_sample) > 0:
-                logging.debug("found flows {}".format(len(flow_sample)))
-                result += flow_sample
+    def submit():
+        return executor.submit(sample_source)
 
-                # collect ids of the trees from the sample
-                sample_tree_ids = []
-                for sample in flow_sample:
-                    first_post = sample[0]
-                    tree_id = first_post.tree_id
-                    sample_tree_ids.append(tree_id)
-                # throw out the trees not sampled
-                forest.keep(sample_tree_ids)
+    running = {submit() for _ in range(fan_out)}
+    try:
+        while len(running) > 0:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    source_sample = future.result()
+                except (NoDailySubredditAvailableException, NoDailyMTHashtagsAvailableException) as ex:
+                    # the other sources in flight can still deliver flows
+                    pool_exhausted = ex
+                    continue
+                add_source_sample(sampler, source_sample, platform, language, state, checkpoint)
+            if len(sampler) >= min_results:
+                break
+            if pool_exhausted is None:
+                running |= {submit() for _ in range(fan_out - len(running))}
+    finally:
+        cancel_event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+    logger.info(flow_yield.report(len(sampler)))
+    if len(sampler) < min_results and pool_exhausted is not None:
+        raise pool_exhausted
+    return sampler.flows
 
-                flow_result_count = len(result)
 
-    return result
+class IncrementalFlowSampler:
+    """
+    Holds one forest across the iterations of download_samples.
+    Only the trees added in a batch are searched for flows, trees without flows are not kept
+    and the flows found so far are available at any time.
+    By default the posts failing the meta filter are pruned before the flows are enumerated
+    (see prune_to_flow_candidates), a custom filter_function is applied to every flow instead.
+    """
+
+    def __init__(self, flow_length=5, filter_function=None):
+        """
+        :param flow_length: same as in TreeManager.get_flow_sample
+        :param filter_function: function on a flow, None to prune by flow_post_mask
+        """
+        self.flow_length = flow_length
+        self.filter_function = filter_function
+        self.trees = {}
+        self.flows = []
+        self.n_trees_searched = 0
+
+    def __len__(self):
+        return len(self.flows)
+
+    def __str__(self):
+        return "IncrementalFlowSampler with {} flows from {} of {} trees".format(len(self.flows), len(self.trees),
+                                                                                self.n_trees_searched)
+
+    def add_trees(self, trees: list[DelabTree]) -> list[list[DelabPost]]:
+        """
+        @param trees: validated trees, trees already in the forest are skipped
+        @return: the flows of the new trees
+        """
+        new_flows = []
+        for tree in trees:
+            if tree.conversation_id in self.trees:
+                continue
+            self.n_trees_searched += 1
+            if self.filter_function is None:
+                pruned_tree = prune_to_flow_candidates(tree)
+                if pruned_tree is None:
+                    continue
+                flows = pruned_tree.get_flow_candidates(self.flow_length)
+            else:
+                flows = tree.get_flow_candidates(self.flow_length, filter_function=self.filter_function)
+            if len(flows) > 0:
+                self.trees[tree.conversation_id] = tree
+                new_flows += flows
+        if len(new_flows) > 0:
+            logger.debug("found flows {}".format(len(new_flows)))
+        self.flows += new_flows
+        return new_flows
+
+    def forest(self) -> TreeManager:
+        """
+        @return: the trees the flows were sampled from
+        """
+        return TreeManager.from_trees(list(self.trees.values()))
+
+
+def flow_post_mask(df: pd.DataFrame) -> pd.Series:
+    """
+    the vectorized version of meta_filter and filter_self_answers, computed once per post
+    @param df: the table of a DelabTree
+    @return: boolean Series aligned with df, False for posts that no flow may contain
+    """
+    text = df[TABLE.COLUMNS.TEXT].fillna("").astype(str)
+    is_short = text.str.len() < 500
+    is_bad_rd = text.str.contains(BAD_REDDIT_PATTERN, regex=True)
+    # a self answer has the same author as its parent, the parent precedes it in every flow
+    authors = df.drop_duplicates(TABLE.COLUMNS.POST_ID).set_index(TABLE.COLUMNS.POST_ID)[TABLE.COLUMNS.AUTHOR_ID]
+    parent_authors = df[TABLE.COLUMNS.PARENT_ID].map(authors)
+    is_self_answer = parent_authors.eq(df[TABLE.COLUMNS.AUTHOR_ID]) & parent_authors.notna()
+    return is_short & ~is_bad_rd & ~is_self_answer
+
+
+def prune_to_flow_candidates(tree: DelabTree):
+    """
+    removes the subtrees below posts that fail flow_post_mask and then the posts that are no longer
+    on a path to a leaf of the original tree, so that every remaining flow passes meta_list_filter
+    @param tree:
+    @return: the pruned DelabTree or None if no flow is left
+    """
+    graph = tree.reply_graph
+    if graph.number_of_nodes() == 0:
+        return None
+    mask = flow_post_mask(tree.df)
+    passes = dict(zip(tree.df[TABLE.COLUMNS.POST_ID], mask))
+    root = get_root(graph)
+    if not passes.get(root, False):
+        return None
+    # top down: a post is alive if it and all of its ancestors pass
+    alive = {root}
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        for child in graph.successors(node):
+            if passes.get(child, False):
+                alive.add(child)
+                stack.append(child)
+    # bottom up: keep the alive posts that lead to a leaf of the original tree
+    keep = set()
+    for node in alive:
+        if graph.out_degree(node) > 0:
+            continue
+        while node not in keep:
+            keep.add(node)
+            parents = list(graph.predecessors(node))
+            if len(parents) == 0:
+                break
+            node = parents[0]
+    if len(keep) < 2:
+        return None
+    if len(keep) == graph.number_of_nodes():
+        return tree
+    df = tree.df[tree.df[TABLE.COLUMNS.POST_ID].isin(keep)]
+    return DelabTree(df, graph.subgraph(keep).copy())
 
 
 def download_daily_sample(platform: PLATFORM,
                           language=LANGUAGE.ENGLISH,
                           max_results=MT_STUDY_DAILY_FLOWS_NEEDED,
-                          connector=None) -> list[DelabTree]:
+                          connector=None,
+                          cancel_event=None) -> list[DelabTree]:
     """
     @param platform:
     @param language:
     @param connector:
     @param max_results: the maximum number of suitable trees to be found for a given platform and a day
+    @param cancel_event: threading.Event, the download stops once it is set
     @return:
     """
-    if platform == PLATFORM.TWITTER:
-        return download_daily_political_sample(language, connector)
-    if platform == PLATFORM.REDDIT:
-        sampler = RD_Sampler(language)
-        return sampler.download_daily_rd_sample(max_results, connector)
-    if platform == PLATFORM.MASTODON:
-        sampler = MTSampler(language=language)
-        return sampler.download_daily_political_sample_mstd(connector)
-    else:
-        raise NotImplementedError()
+    return download_source_sample(platform, language, max_results, connector, cancel_event).trees
+
+
+class SourceSample:
+    """
+    the trees downloaded from one subreddit, hashtag or twitter query and the requests this took
+    """
+
+    def __init__(self, source, trees, n_requests):
+        self.source = source
+        self.trees = trees
+        self.n_requests = n_requests
+
+
+def download_source_sample(platform: PLATFORM,
+                           language=LANGUAGE.ENGLISH,
+                           max_results=MT_STUDY_DAILY_FLOWS_NEEDED,
+                           connector=None,
+                           cancel_event=None,
+                           state=None) -> SourceSample:
+    """
+    @see download_daily_sample
+    @param state: SamplerState that picks the subreddit or hashtag, the default one if None
+    @return: SourceSample, the source is None for twitter
+    """
+    with counting_requests() as counter:
+        if platform == PLATFORM.TWITTER:
+            source = None
+            trees = download_daily_political_sample(language, connector, cancel_event=cancel_event)
+        elif platform == PLATFORM.REDDIT:
+            sampler = RD_Sampler(language, state)
+            source = sampler.subreddit_string
+            trees = sampler.download_daily_rd_sample(max_results, connector, cancel_event=cancel_event)
+        elif platform == PLATFORM.MASTODON:
+            sampler = MTSampler(language=language, state=state)
+            source = sampler.hashtag_string
+            trees = sampler.download_daily_political_sample_mstd(connector, cancel_event=cancel_event)
+        else:
+            raise NotImplementedError()
+    return SourceSample(source, trees, counter[platform])
+
+
+def add_source_sample(sampler, source_sample: SourceSample, platform, language, state, checkpoint=None):
+    """
+    searches the valid trees of the source for flows and records the yield of the source
+    @param checkpoint: JobCheckpoint the source sample is recorded in
+    """
+    validated_trees = validate_trees(source_sample.trees, platform)
+    new_flows = sampler.add_trees(validated_trees)
+    if source_sample.source is not None:
+        state.record_yield(platform, language, source_sample.source, len(validated_trees), len(new_flows),
+                           source_sample.n_requests)
+    if checkpoint is not None:
+        # twitter samples have no source, they are numbered instead
+        unit = source_sample.source if source_sample.source is not None else "sample-{}".format(len(checkpoint))
+        checkpoint.complete(unit, source_sample)
+
+
+def restore_source_samples(sampler, checkpoint, platform):
+    """
+    adds the trees of the source samples recorded in the checkpoint, their yield was recorded before
+    """
+    if checkpoint is None:
+        return
+    source_samples = checkpoint.results()
+    for _, source_sample in source_samples:
+        sampler.add_trees(validate_trees(source_sample.trees, platform))
+    if len(source_samples) > 0:
+        logger.info("resumed {} sources with {} flows from {}".format(len(source_samples), len(sampler),
+                                                                     checkpoint.job))
 
 
 def validate_trees(downloaded_trees, platform):
@@ -115,6 +363,10 @@ def is_short_text(text):
     return len(text) < 500
 
 
+# the same markers as in is_bad_reddit_case
+BAD_REDDIT_PATTERN = r"\[removed\]|\[entfernt\]|!approve|!ban"
+
+
 def is_bad_reddit_case(text):
     return "[removed]" not in text and "[entfernt]" not in text and "!approve" not in text and "!ban" not in text
 
@@ -0,0 +1,96 @@
+import logging
+
+from api_settings import MIN_CONVERSATION_LENGTH, MAX_CONVERSATION_LENGTH, MAX_CONVERSATION_LENGTH_REDDIT, \
+    MIN_CONVERSATION_LENGTH_MASTODON
+from models.platform import PLATFORM
+
+logger = logging.getLogger(__name__)
+
+# (min, max) number of posts of a conversation as in check_general_tree_requirements
+CONVERSATION_BOUNDS = {
+    PLATFORM.TWITTER: (MIN_CONVERSATION_LENGTH, MAX_CONVERSATION_LENGTH),
+    PLATFORM.REDDIT: (MIN_CONVERSATION_LENGTH, MAX_CONVERSATION_LENGTH_REDDIT),
+    PLATFORM.MASTODON: (MIN_CONVERSATION_LENGTH_MASTODON, MAX_CONVERSATION_LENGTH),
+}
+
+
+def estimate_conversation_size(platform, candidate):
+    """
+    estimates the size of the conversation from the metadata that comes with the search results
+    :param platform:
+    :param candidate: a praw submission, a mastodon status or a tweet dict
+    :return: the estimated number of posts including the root
+    """
+    if platform == PLATFORM.REDDIT:
+        # the number of comments reddit shows for the submission, deleted comments included
+        return candidate.num_comments + 1
+    if platform == PLATFORM.MASTODON:
+        # only the direct replies are counted, a reply has at least its parent in the thread
+        size = candidate['replies_count'] + 1
+        if candidate['in_reply_to_id'] is not None:
+            size += 1
+        return size
+    # the replies to the candidate tweet, the conversation can only be larger
+    return candidate["public_metrics"]["reply_count"] + 1
+
+
+def is_exact_estimate(platform):
+    # only reddit counts the whole conversation, the other estimates are lower bounds
+    return platform == PLATFORM.REDDIT
+
+
+def rank_candidates(platform, candidates, min_size=None, max_size=None):
+    """
+    rejects the candidates that cannot meet the size bounds and sorts the others by their estimated size,
+    larger conversations (within the bounds) are more likely to contain long flows for about the same number
+    of requests. Candidates with the same estimate keep the order of the api.
+    :param platform:
+    :param candidates:
+    :param min_size: the conversation needs more posts, defaults to CONVERSATION_BOUNDS for exact estimates
+    :param max_size: the conversation needs fewer posts, defaults to CONVERSATION_BOUNDS
+    :return: the ranked candidates
+    """
+    default_min, default_max = CONVERSATION_BOUNDS[platform]
+    # a lower bound of the size can only reject small conversations if the caller asks for it
+    check_min_size = min_size is not None or is_exact_estimate(platform)
+    min_size = default_min if min_size is None else min_size
+    max_size = default_max if max_size is None else max_size
+    scored = []
+    n_rejected = 0
+    for candidate in candidates:
+        size = estimate_conversation_size(platform, candidate)
+        if size >= max_size or (check_min_size and size <= min_size):
+            n_rejected += 1
+            continue
+        scored.append((size, candidate))
+    scored.sort(key=lambda x: x[0], reverse=True)
+    logger.debug("ranked {} {} candidates, rejected {} by their metadata".format(len(scored), platform, n_rejected))
+    return [candidate for size, candidate in scored]
+
+
+class FlowYield:
+    """
+    counts the flows found per api request of a sampling run, the requests are taken from the RateLimitScheduler
+    all connectors of connection_util share
+    """
+
+    def __init__(self, platform, rate_limits):
+        self.platform = platform
+        self.rate_limits = rate_limits
+        self.requests_at_start = rate_limits.request_counts[platform]
+
+    def n_requests(self):
+        return self.rate_limits.request_counts[self.platform] - self.requests_at_start
+
+    def flows_per_request(self, n_flows):
+        n_requests = self.n_requests()
+        if n_requests == 0:
+            return None
+        return n_flows / n_requests
+
+    def report(self, n_flows):
+        flows_per_request = self.flows_per_request(n_flows)
+        if flows_per_request is None:
+            return "{} flows, no requests counted for {}".format(n_flows, self.platform)
+        return "{} flows from {} {} requests ({:.3f} flows per request)".format(n_flows, self.n_requests(),
+                                                                              self.platform, flows_per_request)
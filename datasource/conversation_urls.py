@@ -0,0 +1,53 @@
+from urllib.parse import urlparse
+
+import praw
+import prawcore
+from mastodon import MastodonNotFoundError
+
+from download_exceptions import ConversationNotFoundException
+from models.platform import PLATFORM
+
+REDDIT_HOSTS = ("reddit.com", "redd.it")
+TWITTER_HOSTS = ("twitter.com", "x.com")
+
+# the errors a url fails with again in every run, network errors, 429 and 5xx are worth another try
+PERMANENT_ERRORS = (ConversationNotFoundException, NotImplementedError, prawcore.exceptions.Forbidden,
+                    prawcore.exceptions.NotFound, prawcore.exceptions.Redirect,
+                    prawcore.exceptions.UnavailableForLegalReasons, praw.exceptions.InvalidURL,
+                    MastodonNotFoundError)
+
+
+class ConversationByUrl:
+    """
+    the result of downloading the conversation of one url, either the tree or the error
+    """
+
+    def __init__(self, url, platform, tree=None, error=None):
+        self.url = url
+        self.platform = platform
+        self.tree = tree
+        self.error = error
+
+    def __str__(self):
+        if self.error is not None:
+            return "{} failed: {}".format(self.url, self.error)
+        return "{} with {} posts".format(self.url, self.tree.total_number_of_posts())
+
+    def is_final(self):
+        """
+        :return: False if the download failed with an error that another run may not have, see PERMANENT_ERRORS
+        """
+        return self.error is None or isinstance(self.error, PERMANENT_ERRORS)
+
+
+def platform_of_url(url):
+    """
+    :param url: url of a submission, comment, tweet or status
+    :return: PLATFORM, mastodon for every host that is not reddit or twitter (mastodon servers have any name)
+    """
+    host = (urlparse(url).hostname or "").lower()
+    if any(host == name or host.endswith("." + name) for name in REDDIT_HOSTS):
+        return PLATFORM.REDDIT
+    if any(host == name or host.endswith("." + name) for name in TWITTER_HOSTS):
+        return PLATFORM.TWITTER
+    return PLATFORM.MASTODON
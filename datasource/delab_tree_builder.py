@@ -0,0 +1,86 @@
+import pandas as pd
+from delab_trees.delab_tree import DelabTree
+
+from datasource.normalization import normalize_columns
+from datasource.tree_assembly import ReplyTreeAssembler
+
+ID_COLUMNS = ("tree_id", "post_id", "parent_id")
+
+
+class DelabTreeBuilder:
+    """
+    Collects the posts of one conversation column by column while they are downloaded
+    and emits the DelabTree in one step, without materializing a recursive TreeNode structure first.
+    """
+
+    def __init__(self, tree_id, root_id, root_record):
+        """
+        :param tree_id: the conversation id used for all rows
+        :param root_id: the post id of the root
+        :param root_record: dict with the remaining columns of the root post (text, author_id, created_at, ...)
+        """
+        self.tree_id = tree_id
+        self.columns = {name: [] for name in ID_COLUMNS}
+        self.n_rows = 0
+        # the assembler stores the row index of each post as its payload
+        self.assembler = ReplyTreeAssembler(root_id, self.__append(root_id, None, root_record), tree_id=tree_id)
+
+    def add_post(self, post_id, parent_id, record):
+        """
+        :param post_id:
+        :param parent_id:
+        :param record: dict with the remaining columns of the post
+        :return: True if the post is connected to the root now
+        """
+        row = self.__append(post_id, parent_id, record)
+        return self.assembler.add(post_id, parent_id, row)
+
+    def __append(self, post_id, parent_id, record):
+        row = self.n_rows
+        columns = self.columns
+        columns["tree_id"].append(self.tree_id)
+        columns["post_id"].append(post_id)
+        columns["parent_id"].append(parent_id)
+        for name, value in record.items():
+            if name in ID_COLUMNS:
+                continue
+            column = columns.get(name)
+            if column is None:
+                column = [None] * row
+                columns[name] = column
+            column.append(value)
+        self.n_rows = row + 1
+        # keep all columns aligned if the record did not contain every column seen so far
+        for column in columns.values():
+            if len(column) < self.n_rows:
+                column.append(None)
+        return row
+
+    def flat_size(self):
+        """
+        :return: the number of posts connected to the root, including the root
+        """
+        return self.assembler.flat_size()
+
+    def max_path_length(self):
+        """
+        :return: the number of replies on the longest path from the root (same as TreeNode.compute_max_path_length)
+        """
+        return self.assembler.max_path_length
+
+    def orphan_report(self):
+        return self.assembler.orphan_report()
+
+    def to_dataframe(self):
+        """
+        emits the posts connected to the root, parents are always listed before their replies
+        :return: pd.DataFrame in the DelabTree format with normalized ids and timestamps
+        """
+        df = pd.DataFrame(normalize_columns(self.columns))
+        rows = list(self.assembler.posts.values())
+        if len(rows) < self.n_rows or rows != sorted(rows):
+            df = df.iloc[rows].reset_index(drop=True)
+        return df
+
+    def to_delab_tree(self):
+        return DelabTree(self.to_dataframe())
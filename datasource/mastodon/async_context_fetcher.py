@@ -0,0 +1,217 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from mastodon import MastodonNetworkError
+
+from api_settings import MST_TIMEOUT_SECONDS, MST_MAX_CONCURRENT_REQUESTS
+from datasource.mastodon.context_index import ContextIndex
+from datasource.mastodon.download_conversations_mastodon import get_root, thread_from_reply_context
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncContextFetcher:
+    """
+    Fetches the contexts of many statuses concurrently.
+    Mastodon.py is blocking, so every status_context call runs in a thread of an executor of the fetch.
+    A semaphore per mastodon instance bounds the number of requests in flight
+    and every request has its own timeout after which the fetch of that status is cancelled.
+    The fetch returns once every status is resolved or timed out: the executor is shut down without waiting,
+    a request that timed out is abandoned and its thread ends in the background when the response arrives.
+    Threads are resolved only once per ContextIndex.
+    """
+
+    def __init__(self, mastodon, max_concurrency=MST_MAX_CONCURRENT_REQUESTS, timeout_seconds=MST_TIMEOUT_SECONDS,
+                 index=None):
+        self.mastodon = mastodon
+        self.index = ContextIndex() if index is None else index
+        self.max_concurrency = max_concurrency
+        self.timeout_seconds = timeout_seconds
+        self.semaphores = {}
+        self.executor = None
+
+    def fetch_contexts(self, statuses):
+        """
+        blocking entry point, works inside and outside a running event loop (e.g. a notebook)
+        :param statuses:
+        :return: the contexts in the order of the statuses, statuses without context are skipped
+        """
+        return run_outside_running_loop(asyncio.run, self.find_contexts(statuses))
+
+    def iter_contexts(self, statuses):
+        """
+        the streaming version of fetch_contexts: up to max_concurrency statuses are resolved at the same time,
+        the next status is started as soon as one is resolved and every context is yielded as soon as it is complete,
+        so a slow request does not hold back the statuses after it. No status is started while the caller
+        does not ask for the next context, the statuses in flight are cancelled when the caller stops iterating.
+        :param statuses:
+        :return: generator of the contexts in the order they complete
+        """
+        loop = asyncio.new_event_loop()
+        self.semaphores = {}
+        statuses = self.__deduplicate(statuses)
+        self.executor = request_executor(len(statuses))
+        waiting = iter(statuses)
+        running = set()
+        try:
+            while True:
+                while len(running) < self.max_concurrency:
+                    status = next(waiting, None)
+                    if status is None:
+                        break
+                    # a context completed in the meantime may hold the status
+                    if self.index.is_resolved(status):
+                        self.index.record_skip(status)
+                        continue
+                    running.add(loop.create_task(self.find_context(status)))
+                if len(running) == 0:
+                    break
+                done, running = run_outside_running_loop(
+                    loop.run_until_complete, asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED))
+                for task in done:
+                    if task.result() is not None:
+                        yield task.result()
+        finally:
+            for task in running:
+                task.cancel()
+            if len(running) > 0:
+                run_outside_running_loop(loop.run_until_complete, asyncio.gather(*running, return_exceptions=True))
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            loop.close()
+            logger.debug(self.index)
+
+    async def find_contexts(self, statuses):
+        # semaphores are bound to the event loop they are used in
+        self.semaphores = {}
+        statuses = self.__deduplicate(statuses)
+        self.executor = request_executor(len(statuses))
+        try:
+            contexts = await asyncio.gather(*[self.find_context(status) for status in statuses])
+        finally:
+            # asyncio.run would wait for the threads of its default executor, also for the abandoned requests
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        logger.debug(self.index)
+        return [context for context in contexts if context is not None]
+
+    def __deduplicate(self, statuses):
+        """
+        skips the statuses of threads in the index and replaces replies to other statuses of the batch
+        by the top-most status of their chain, so that each chain is only fetched once
+        """
+        batch = {str(status['id']): status for status in statuses}
+        result = []
+        top_ids = set()
+        for status in statuses:
+            if self.index.is_resolved(status):
+                self.index.record_skip(status)
+                continue
+            top = status
+            chain = {str(top['id'])}
+            while top['in_reply_to_id'] is not None and str(top['in_reply_to_id']) in batch:
+                if str(top['in_reply_to_id']) in chain:
+                    break
+                top = batch[str(top['in_reply_to_id'])]
+                chain.add(str(top['id']))
+            if str(top['id']) in top_ids:
+                self.index.record_skip(status)
+                continue
+            top_ids.add(str(top['id']))
+            result.append(top)
+        return result
+
+    async def find_context(self, status):
+        """
+        the async version of download_conversations_mastodon.find_context
+        :param status:
+        :return: context dict or None
+        """
+        try:
+            return await self.__find_context(status)
+        except asyncio.TimeoutError:
+            logger.debug("Downloading context took too long. Skipping status {}".format(status['url']))
+        except MastodonNetworkError as neterr:
+            logger.debug("API threw following error: {}".format(neterr))
+        return None
+
+    async def __find_context(self, status):
+        context = {'root': status}
+        if status['in_reply_to_id'] is None:
+            if status['replies_count'] == 0:
+                return None
+            if not self.index.claim_root(status["id"]):
+                return None
+            context.update(await self.__root_context(status["id"]))
+        else:
+            original_context = {'origin': status}
+            original_context.update(await self.status_context(status["id"]))
+            root = get_root(original_context)
+            if root is None:
+                return None
+            # another status of the batch may have resolved the same thread in the meantime
+            if not self.index.claim_root(root["id"]):
+                return None
+            context['root'] = root
+            thread = thread_from_reply_context(original_context)
+            if thread is None:
+                thread = await self.__root_context(root["id"])
+            else:
+                self.index.saved_fetches += 1
+            context.update(thread)
+        self.index.add(context)
+        return context
+
+    async def __root_context(self, root_id):
+        try:
+            return await self.status_context(root_id)
+        except BaseException:
+            # give other statuses of the thread the chance to resolve it
+            self.index.release_root(root_id)
+            raise
+
+    async def status_context(self, status_id):
+        # the timeout starts when the request is sent, waiting for a free slot does not count
+        async with self.__get_semaphore():
+            request = asyncio.get_running_loop().run_in_executor(self.executor, self.mastodon.status_context,
+                                                                 status_id)
+            return await asyncio.wait_for(request, timeout=self.timeout_seconds)
+
+    def __get_semaphore(self):
+        instance = getattr(self.mastodon, "api_base_url", None)
+        if instance not in self.semaphores:
+            self.semaphores[instance] = asyncio.Semaphore(self.max_concurrency)
+        return self.semaphores[instance]
+
+
+def run_outside_running_loop(function, *args):
+    """
+    calls the function in another thread if the current thread runs an event loop (e.g. a notebook),
+    an event loop cannot be run inside another one
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return function(*args)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(function, *args).result()
+
+
+def request_executor(n_statuses):
+    """
+    :param n_statuses: the statuses of a fetch, each needs up to two requests
+    :return: ThreadPoolExecutor for the requests of a fetch, the semaphores bound the requests in flight.
+             Its threads are started on demand, a thread kept busy by an abandoned request does not delay the others.
+    """
+    return ThreadPoolExecutor(max_workers=max(2 * n_statuses, 1), thread_name_prefix="status_context")
+
+
+def fetch_contexts(statuses, mastodon, max_concurrency=MST_MAX_CONCURRENT_REQUESTS, index=None):
+    """
+    downloads the contexts of the statuses concurrently, each thread only once
+    :param statuses:
+    :param mastodon:
+    :param max_concurrency: max number of requests in flight for the mastodon instance
+    :param index: ContextIndex of the threads already resolved, a new one is used if None
+    :return: list of contexts as returned by find_context
+    """
+    return AsyncContextFetcher(mastodon, max_concurrency=max_concurrency, index=index).fetch_contexts(statuses)
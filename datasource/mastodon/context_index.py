@@ -0,0 +1,85 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def expected_context_fetches(status):
+    """
+    :param status:
+    :return: the number of status_context requests find_context needs for the status
+    """
+    if status['in_reply_to_id'] is None:
+        return 0 if status['replies_count'] == 0 else 1
+    return 2
+
+
+class ContextIndex:
+    """
+    Per-run index of the resolved threads, keyed by the root id and by the id of every status in the thread.
+    Statuses of a thread that is already resolved (or being resolved) are skipped before any request is sent.
+    """
+
+    def __init__(self):
+        self.contexts = {}
+        self.status_roots = {}
+        self.pending_roots = set()
+        self.saved_fetches = 0
+        self.skipped_statuses = 0
+
+    def __len__(self):
+        return len(self.contexts)
+
+    def __str__(self):
+        return "ContextIndex with {} threads, skipped {} statuses and saved {} context fetches".format(
+            len(self.contexts), self.skipped_statuses, self.saved_fetches)
+
+    def root_id_of(self, status):
+        """
+        :param status:
+        :return: the root id of the thread if the status or its parent is known, None otherwise
+        """
+        for status_id in (str(status['id']), str(status['in_reply_to_id'])):
+            if status_id in self.pending_roots:
+                return status_id
+            if status_id in self.status_roots:
+                return self.status_roots[status_id]
+        return None
+
+    def is_resolved(self, status):
+        """
+        :param status:
+        :return: True if the thread of the status is resolved or being resolved in this run
+        """
+        return self.root_id_of(status) is not None
+
+    def record_skip(self, status):
+        """
+        counts the requests find_context would have sent for a skipped status
+        :param status:
+        """
+        self.skipped_statuses += 1
+        self.saved_fetches += expected_context_fetches(status)
+
+    def claim_root(self, root_id):
+        """
+        marks a thread as being resolved, only the first status of a thread gets the claim
+        :param root_id:
+        :return: True if the caller should fetch the thread
+        """
+        root_id = str(root_id)
+        if root_id in self.contexts or root_id in self.pending_roots:
+            self.saved_fetches += 1
+            return False
+        self.pending_roots.add(root_id)
+        return True
+
+    def release_root(self, root_id):
+        self.pending_roots.discard(str(root_id))
+
+    def add(self, context):
+        root_id = str(context['root']['id'])
+        self.pending_roots.discard(root_id)
+        self.contexts[root_id] = context
+        self.status_roots[root_id] = root_id
+        for status in context.get('ancestors', []) + context.get('descendants', []):
+            self.status_roots[str(status['id'])] = root_id
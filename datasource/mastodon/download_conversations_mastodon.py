@@ -1,73 +1,119 @@
 import logging
 import signal
+import threading
+from collections import Counter
 
-import pandas as pd
-from bs4 import BeautifulSoup
 from mastodon import MastodonNetworkError
 
 from api_settings import MST_TIMEOUT_SECONDS
-from connection_util import create_mastodon
+from connection_util import get_connector
+from datasource.candidate_ranking import rank_candidates
+from datasource.mastodon.html_text import html_to_text, get_text_converter
+from datasource.normalization import records_to_dataframe
+from datasource.tree_assembly import ReplyTreeAssembler
 from delab_trees.delab_tree import DelabTree
 from models.language import LANGUAGE
+from models.platform import PLATFORM
 
 logger = logging.getLogger(__name__)
 
 
 def download_conversations_mstd(query, mastodon=None, since=None, max_conversations=5):
+    return list(iter_conversations_mstd(query, mastodon, since, max_conversations))
+
+
+def iter_conversations_mstd(query, mastodon=None, since=None, max_conversations=5):
     if mastodon is None:
-        mastodon = create_mastodon()
+        mastodon = get_connector(PLATFORM.MASTODON)
 
-    return download_conversations_to_search(query=query,
-                                            mastodon=mastodon,
-                                            since=since,
-                                            max_conversations=max_conversations)
+    return iter_conversations_to_search(query=query,
+                                        mastodon=mastodon,
+                                        since=since,
+                                        max_conversations=max_conversations)
 
 
-def download_conversations_to_search(query, mastodon, since, max_conversations=5):
-    statuses = download_timeline(query=query, mastodon=mastodon, since=since)
-    contexts = []
-    trees = []
+def download_conversations_to_search(query, mastodon, since, max_conversations=5, context_index=None,
+                                     cancel_event=None):
+    """
+    :param query: the hashtag
+    :param mastodon:
+    :param since:
+    :param max_conversations:
+    :param context_index: a ContextIndex to share the resolved threads with other downloads
+    :param cancel_event: threading.Event, no more contexts are downloaded once it is set
+    :return:
+    """
+    return list(iter_conversations_to_search(query, mastodon, since, max_conversations, context_index,
+                                             cancel_event))
 
-    for status in statuses:
-        if status in contexts:
-            continue
-        else:
-            context = find_context(status, mastodon)
-            if context is None:
-                continue
-            contexts.append(context)
 
-    for context in contexts:
-        conversation_id = context['root']["id"]
-        tree = toots_to_tree(context=context, conversation_id=conversation_id)
-        if tree is not None:
-            trees.append(tree)
-        if len(trees) >= max_conversations:
-            break
+def iter_conversations_to_search(query, mastodon, since, max_conversations=5, context_index=None,
+                                 cancel_event=None):
+    """
+    the generator version of download_conversations_to_search, up to MST_MAX_CONCURRENT_REQUESTS contexts
+    are downloaded at the same time, every tree is yielded as soon as its context is complete
+    and no more contexts are requested once the caller stops iterating
+    :return: generator of DelabTree
+    """
+    # imported here because the fetcher reuses the context helpers of this module
+    from datasource.mastodon.async_context_fetcher import AsyncContextFetcher
+
+    statuses = download_timeline(query=query, mastodon=mastodon, since=since)
+    # the statuses with more replies are resolved first
+    statuses = rank_candidates(PLATFORM.MASTODON, statuses)
+    n_trees = 0
 
-    return trees
+    # statuses of threads already resolved are skipped
+    contexts = AsyncContextFetcher(mastodon, index=context_index).iter_contexts(statuses)
+    try:
+        for context in contexts:
+            # the contexts in flight are cancelled when the loop stops
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            conversation_id = context['root']["id"]
+            tree = toots_to_tree(context=context, conversation_id=conversation_id)
+            if tree is not None:
+                n_trees += 1
+                yield tree
+            if n_trees >= max_conversations:
+                return
+    finally:
+        contexts.close()
 
 
 def timeout_handler(signum, frame):
     raise TimeoutError("process took too long")
 
 
+def set_alarm(timeout_seconds):
+    """
+    signals can only be handled in the main thread, in worker threads (e.g. the parallel daily sampler)
+    the request timeout of the mastodon session applies instead
+    :param timeout_seconds: 0 cancels the alarm
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    if timeout_seconds > 0:
+        signal.signal(signal.SIGALRM, timeout_handler)
+    signal.alarm(timeout_seconds)
+
+
 def download_timeline(query, mastodon, since):
     timeout_seconds = 30
-    signal.signal(signal.SIGALRM, timeout_handler)
-    signal.alarm(timeout_seconds)
+    set_alarm(timeout_seconds)
     try:
         timeline = mastodon.timeline_hashtag(hashtag=query, limit=40, since_id=since)
     except TimeoutError:
         logger.debug("Downloading timeline took too long. Skipping hashtag {}".format(query))
         return []
+    finally:
+        set_alarm(0)
     return timeline
 
 
 def find_context(status, mastodon):
     timeout_seconds = MST_TIMEOUT_SECONDS
-    signal.signal(signal.SIGALRM, timeout_handler)
-    signal.alarm(timeout_seconds)
+    set_alarm(timeout_seconds)
     context = {'root': status}
     try:
         if status['in_reply_to_id'] is None:
@@ -81,7 +127,10 @@ def find_context(status, mastodon):
             if root is None:
                 return None
             context['root'] = root
-            context.update(mastodon.status_context(root["id"]))
+            thread = thread_from_reply_context(original_context)
+            if thread is None:
+                thread = mastodon.status_context(root["id"])
+            context.update(thread)
 
     except TimeoutError:
         logger.debug("Downloading context took too long. Skipping status {}".format(status['url']))
@@ -89,6 +138,8 @@ def find_context(status, mastodon):
     except MastodonNetworkError as neterr:
         logger.debug("API threw following error: {}".format(neterr))
         return None
+    finally:
+        set_alarm(0)
 
     return context
 
@@ -118,18 +169,53 @@ def get_root(context):
     return None
 
 
-def toots_to_tree(context, conversation_id):
+def thread_from_reply_context(context):
+    """
+    The context of a reply only contains the descendants of the reply itself.
+    If every ancestor has exactly one reply, the thread is a chain and the context of the root
+    can be derived without downloading it.
+    The replies_count of a status is often stale (e.g. replies from other instances are counted late),
+    the counts are only trusted if they agree with the replies among the descendants.
+    :param context: the context of the reply with the reply as 'origin'
+    :return: dict with the ancestors and descendants of the root or None if the root context is needed
+    """
+    ancestors = context["ancestors"]
+    if len(ancestors) == 0 or ancestors[0]["in_reply_to_id"] is not None:
+        return None
+    if any(toot["replies_count"] != 1 for toot in ancestors):
+        return None
+    if not replies_counts_agree([context["origin"]] + context["descendants"], context["descendants"]):
+        return None
+    return {'ancestors': [], 'descendants': ancestors[1:] + [context["origin"]] + context["descendants"]}
+
+
+def replies_counts_agree(statuses, descendants):
+    """
+    :param statuses:
+    :param descendants: the replies below the statuses
+    :return: True if the replies_count of every status is the number of its replies among the descendants
+    """
+    n_replies = Counter(str(toot["in_reply_to_id"]) for toot in descendants)
+    return all(toot["replies_count"] == n_replies[str(toot["id"])] for toot in statuses)
+
+
+def toots_to_tree(context, conversation_id, text_converter=None):
+    """
+    :param context: dict with root, ancestors and descendants
+    :param conversation_id:
+    :param text_converter: HtmlTextConverter, the shared one if None
+    :return: DelabTree
+    """
+    if text_converter is None:
+        text_converter = get_text_converter()
     conversation_id = str(conversation_id)
     root = context["root"]
     descendants = context["descendants"]
     ancestors = context["ancestors"]  # should be empty
     tree_context = []
 
-    # List to keep track of valid post IDs in the conversation
-    valid_post_ids = [str(root['id'])]
-
     # Process root post
-    text = content_to_text(root["content"])
+    text = text_converter.convert(root)
     lang = root.get('language', LANGUAGE.UNKNOWN)
     tw_author__name = root['account'].get('display_name', root['account']["username"])
 
@@ -145,10 +231,9 @@ def toots_to_tree(context, conversation_id):
     tree_context.append(tree_status)
 
     # Function to process individual posts (ancestors or descendants)
-    def process_post(post):
+    def process_post(post, text):
         lang = post.get('language', LANGUAGE.UNKNOWN)
         tw_author__name = post['account'].get('display_name', post['account']["username"])
-        text = content_to_text(post["content"])
         parent_id_str = str(post.get('in_reply_to_id', ''))
 
         return {'tree_id': conversation_id,
@@ -164,15 +249,21 @@ def toots_to_tree(context, conversation_id):
     # Process ancestors and descendants
     post_list = sorted(ancestors + descendants, key=lambda x: x['created_at'])
 
+    # only keep the posts that are connected to the root by a reply chain
+    root_id = str(root['id'])
+    assembler = ReplyTreeAssembler(root_id, root, tree_id=conversation_id)
     for post in post_list:
-        if str(post.get('in_reply_to_id')) in valid_post_ids:
-            post_status = process_post(post)
-            tree_context.append(post_status)
-            # Add the post ID to the list of valid IDs, as it's now part of the conversation chain
-            valid_post_ids.append(str(post['id']))
-
-    context_df = pd.DataFrame(tree_context)
-    # context_df_clean = pre_process_df(context_df)
+        assembler.add(str(post['id']), str(post.get('in_reply_to_id')), post)
+    orphans = assembler.orphan_report()
+    if len(orphans) > 0:
+        logger.debug(orphans)
+
+    posts = [post for post in post_list if str(post['id']) != root_id and str(post['id']) in assembler]
+    # the html of the posts is converted in one batch
+    for post, text in zip(posts, text_converter.convert_many(posts)):
+        tree_context.append(process_post(post, text))
+
+    context_df = records_to_dataframe(tree_context)
     tree = DelabTree(context_df)
 
     return tree
@@ -197,6 +288,4 @@ def pre_process_df(context_df):
 
 def content_to_text(content):
     # content is html string --> get only necessary text
-    soup = BeautifulSoup(content, 'html.parser')
-    text = soup.get_text()
-    return text
+    return html_to_text(content)
@@ -1,12 +1,12 @@
 import logging
-from copy import deepcopy
-from random import choice
 from datetime import datetime, timedelta
 
-from connection_util import create_mastodon
+from connection_util import get_connector
 from datasource.mastodon.download_conversations_mastodon import download_conversations_to_search
 from download_exceptions import NoDailyMTHashtagsAvailableException
 from models.language import LANGUAGE
+from models.platform import PLATFORM
+from sampler_state import get_sampler_state, today
 
 logger = logging.getLogger(__name__)
 
@@ -230,66 +230,63 @@ class MTSampler:
         "Klimaskeptiker"
     ]
 
-    daily_en_hashtags = {}
-    daily_de_hashtags = {}
-
-    def __init__(self, language):
-        current_date, hashtag_string = pick_random_hashtag(language)
+    def __init__(self, language, state=None):
+        """
+        :param language:
+        :param state: SamplerState with the daily picks and the yields, shared by the samplers running in parallel
+        """
+        if state is None:
+            state = get_sampler_state()
+        current_date, hashtag_string = pick_hashtag(language, state)
         self.hashtag_string = hashtag_string
-        logger.debug(
-            "current hashtags to search are en: {}, de: {}".format(len(MTSampler.daily_en_hashtags[current_date]),
-                                                                   len(MTSampler.daily_de_hashtags[current_date])))
         self.language = language
         self.current_date = current_date
+        self.state = state
+        logger.debug("current hashtags to search for lang {}: {}".format(language, self.n_available()))
 
-    def download_daily_political_sample_mstd(self, mastodon):
+    def download_daily_political_sample_mstd(self, mastodon, cancel_event=None):
+        """
+        :param mastodon:
+        :param cancel_event: threading.Event, the download of the hashtag stops once it is set
+        :return: the downloaded trees
+        """
         hashtag = self.hashtag_string
         # toots in the last 24 hours
         today = datetime.now()
         yesterday = today - timedelta(days=1)
         if mastodon is None:
-            mastodon = create_mastodon()
+            mastodon = get_connector(PLATFORM.MASTODON)
 
         downloaded_trees = download_conversations_to_search(query=hashtag,
                                                             mastodon=mastodon,
-                                                            since=yesterday)
+                                                            since=yesterday,
+                                                            cancel_event=cancel_event)
 
         logger.debug("returning {} conversations for hashtags {}, {} hashtags not searched for lang {}"
                      .format(len(downloaded_trees), self.hashtag_string,
-                             len(self.get_current_dictionary()), self.language))
+                             self.n_available(), self.language))
 
         return downloaded_trees
 
-    def get_current_dictionary(self):
-        if self.language == LANGUAGE.ENGLISH:
-            return self.daily_en_hashtags[self.current_date]
-        else:
-            return self.daily_de_hashtags[self.current_date]
+    def n_available(self):
+        return self.state.n_available(PLATFORM.MASTODON, self.language, hashtag_pool(self.language),
+                                      self.current_date)
 
 
-def pick_random_hashtag(language):
-    current_date = datetime.now().date()
-    # init dictionary of subreddits if empty
-    if current_date not in MTSampler.daily_en_hashtags:
-        MTSampler.daily_en_hashtags[current_date] = deepcopy(MTSampler.hashtags)
-    if current_date not in MTSampler.daily_de_hashtags:
-        MTSampler.daily_de_hashtags[current_date] = deepcopy(MTSampler.german_hashtags)
-    # get current state of available subreddits and pick one
+def hashtag_pool(language):
     if language == LANGUAGE.GERMAN:
-        available_hashtags = MTSampler.daily_de_hashtags[current_date]
-    else:
-        available_hashtags = MTSampler.daily_en_hashtags[current_date]
-    if len(available_hashtags) == 0:
+        return MTSampler.german_hashtags
+    return MTSampler.hashtags
+
+
+def pick_hashtag(language, state):
+    """
+    :param language:
+    :param state: SamplerState
+    :return: (the day, the hashtag to sample next)
+    """
+    current_date = today()
+    hashtag_string = state.pick_source(PLATFORM.MASTODON, language, hashtag_pool(language), current_date)
+    if hashtag_string is None:
         raise NoDailyMTHashtagsAvailableException(language=language)
-    else:
-        hashtag_string = choice(available_hashtags)
-    # update dictionary with current available states
-    if language == LANGUAGE.ENGLISH:
-        current_list = deepcopy(MTSampler.daily_en_hashtags[current_date])
-        current_list.remove(hashtag_string)
-        MTSampler.daily_en_hashtags[current_date] = current_list
-    else:
-        current_list = deepcopy(MTSampler.daily_de_hashtags[current_date])
-        current_list.remove(hashtag_string)
-        MTSampler.daily_de_hashtags[current_date] = current_list
     return current_date, hashtag_string
@@ -1,8 +1,12 @@
-from connection_util import create_mastodon
-from datasource.mastodon.download_conversations_mastodon import find_context, toots_to_tree
+from connection_util import get_connector
+from datasource.mastodon.async_context_fetcher import fetch_contexts
+from datasource.mastodon.download_conversations_mastodon import toots_to_tree
+from datasource.mastodon.html_text import get_text_converter
+from models.platform import PLATFORM
 
 
-def download_user_conversations(username, mastodon=None, since="2023-01-01", max_conversations=1000):
+def download_user_conversations(username, mastodon=None, since="2023-01-01", max_conversations=1000,
+                                context_index=None):
     """
     Usage
     trees = download_user_conversations(username="the_user", mastodon=mastodon_instance, since="2023-01-01", max_conversations=5)
@@ -11,10 +15,11 @@ def download_user_conversations(username, mastodon=None, since="2023-01-01", max
     :param mastodon:
     :param since:
     :param max_conversations:
+    :param context_index: a ContextIndex to share the resolved threads with other downloads
     :return:
     """
     if mastodon is None:
-        mastodon = create_mastodon()
+        mastodon = get_connector(PLATFORM.MASTODON)
 
     user = mastodon.account_search(username, limit=1)
     if not user:
@@ -22,21 +27,20 @@ def download_user_conversations(username, mastodon=None, since="2023-01-01", max
 
     user_id = user[0]['id']
     statuses = mastodon.account_statuses(user_id, since_id=since)
-    contexts = []
     trees = []
 
-    for status in statuses:
-        if status in contexts:
-            continue
-        else:
-            context = find_context(status, mastodon)
-            if context is None:
-                continue
-            contexts.append(context)
+    # several statuses of the user are often part of the same thread
+    contexts = fetch_contexts(statuses, mastodon, index=context_index)
+
+    # the statuses of all contexts are converted in one batch (in a process pool if MST_TEXT_PROCESSES is set),
+    # the trees then take their texts from the cache
+    text_converter = get_text_converter()
+    text_converter.convert_many([status for context in contexts
+                                 for status in [context['root']] + context['ancestors'] + context['descendants']])
 
     for context in contexts:
         conversation_id = context['root']["id"]
-        tree = toots_to_tree(context=context, conversation_id=conversation_id)
+        tree = toots_to_tree(context=context, conversation_id=conversation_id, text_converter=text_converter)
         if tree is not None:
             trees.append(tree)
         if len(trees) >= max_conversations:
@@ -0,0 +1,63 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+from api_settings import MST_MAX_CONCURRENT_REQUESTS
+from connection_util import get_connector
+from datasource.conversation_urls import ConversationByUrl
+from datasource.mastodon.async_context_fetcher import fetch_contexts
+from datasource.mastodon.download_conversations_mastodon import toots_to_tree
+from download_exceptions import ConversationNotFoundException
+from models.platform import PLATFORM
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_status(url, mastodon):
+    """
+    :param url: url of a status on any mastodon server
+    :return: the status as seen by the server of the mastodon instance (fetched from the other server if needed)
+    """
+    statuses = mastodon.search_v2(url, resolve=True, result_type="statuses")["statuses"]
+    if len(statuses) == 0:
+        raise ConversationNotFoundException(url)
+    return statuses[0]
+
+
+def get_conversations_by_urls(urls, mastodon=None, max_workers=MST_MAX_CONCURRENT_REQUESTS):
+    """
+    resolves the urls in parallel and downloads the context of every thread once,
+    urls of statuses in the same thread get the same tree
+    :param urls: urls of statuses
+    :param mastodon: the mastodon instance, created once if None
+    :param max_workers: max number of requests in flight
+    :return: dict of url to ConversationByUrl, with the error if the conversation could not be downloaded
+    """
+    if mastodon is None:
+        mastodon = get_connector(PLATFORM.MASTODON)
+    urls = list(dict.fromkeys(urls))
+    results = {}
+    statuses = {}
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+        # each worker runs in a copy of the context, so that its requests are counted for the caller
+        futures = {url: executor.submit(copy_context().run, resolve_status, url, mastodon) for url in urls}
+        for url, future in futures.items():
+            try:
+                statuses[url] = future.result()
+            except Exception as ex:
+                logger.debug("could not resolve {}: {}".format(url, ex))
+                results[url] = ConversationByUrl(url, PLATFORM.MASTODON, error=ex)
+
+    trees = {}
+    for context in fetch_contexts(list(statuses.values()), mastodon, max_concurrency=max_workers):
+        tree = toots_to_tree(context=context, conversation_id=context["root"]["id"])
+        for post_id in tree.df["post_id"]:
+            trees[str(post_id)] = tree
+    for url, status in statuses.items():
+        tree = trees.get(str(status["id"]))
+        if tree is None:
+            # e.g. a status without replies or a thread that could not be downloaded
+            results[url] = ConversationByUrl(url, PLATFORM.MASTODON, error=ConversationNotFoundException(url))
+        else:
+            results[url] = ConversationByUrl(url, PLATFORM.MASTODON, tree=tree)
+    return {url: results[url] for url in urls}
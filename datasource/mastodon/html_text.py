@@ -0,0 +1,146 @@
+import html
+import logging
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from html.entities import html5
+
+from bs4 import BeautifulSoup
+
+from api_settings import MST_TEXT_CACHE_SIZE, MST_TEXT_PROCESSES
+
+logger = logging.getLogger(__name__)
+
+# the tags the mastodon sanitizer lets through, their text is the concatenation of their strings.
+# pre is missing as BeautifulSoup keeps the whitespace inside it
+SIMPLE_TAGS = frozenset(["p", "br", "span", "a", "del", "s", "code", "em", "strong", "b", "i", "u",
+                         "ul", "ol", "li", "blockquote", "h1", "h2", "h3", "h4", "h5", "h6", "sub", "sup"])
+TAG = re.compile(r"""<(/?)([a-zA-Z][a-zA-Z0-9]*)((?:\s+[^\s"'<>/=]+(?:\s*=\s*(?:"[^"]*"|'[^']*'|[^\s"'<>=`]+))?)*)\s*/?>""")
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+ENTITY = re.compile(r"&(#[0-9]+|#[xX][0-9a-fA-F]+|[A-Za-z][A-Za-z0-9]*);")
+
+PROCESS_POOL_MIN_BATCH = 1000  # smaller batches are converted faster in the process itself
+
+
+def fast_html_to_text(content):
+    """
+    strips the tags of simple html the way BeautifulSoup(content, 'html.parser').get_text() does
+    :param content: html string
+    :return: the text, or None if the content contains markup the fast path does not handle
+    (other tags, comments, unknown or unterminated entities, carriage returns)
+    """
+    if "\r" in content:
+        return None
+    segments = []
+    position = 0
+    for match in TAG.finditer(content):
+        if match.group(2).lower() not in SIMPLE_TAGS:
+            return None
+        segments.append(content[position:match.start()])
+        position = match.end()
+    segments.append(content[position:])
+    texts = []
+    for segment in segments:
+        if "<" in segment:
+            return None
+        if "&" in segment:
+            entities = ENTITY.findall(segment)
+            if segment.count("&") != len(entities):
+                return None
+            if any(not entity.startswith("#") and entity + ";" not in html5 for entity in entities):
+                return None
+            segment = html.unescape(segment)
+        # BeautifulSoup replaces the strings between two tags that only contain whitespace
+        if segment != "" and segment.strip(ASCII_SPACES) == "":
+            segment = "\n" if "\n" in segment else " "
+        texts.append(segment)
+    return "".join(texts)
+
+
+def html_to_text(content):
+    """
+    :param content: html string of a status
+    :return: the text as BeautifulSoup(content, 'html.parser').get_text() returns it
+    """
+    text = fast_html_to_text(content)
+    if text is None:
+        text = BeautifulSoup(content, 'html.parser').get_text()
+    return text
+
+
+class HtmlTextConverter:
+    """
+    converts the html content of statuses to text, the texts are cached by status id
+    (and edit time, as edited statuses keep their id), so that statuses that show up in several
+    contexts are converted once
+    """
+
+    def __init__(self, cache_size=MST_TEXT_CACHE_SIZE, processes=MST_TEXT_PROCESSES):
+        """
+        :param cache_size: statuses kept in the cache, the least recently used are dropped
+        :param processes: if set, batches of at least PROCESS_POOL_MIN_BATCH statuses are converted
+        in a process pool of that size (for large backfills)
+        """
+        self.cache_size = cache_size
+        self.processes = processes
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def convert(self, status):
+        return self.convert_many([status])[0]
+
+    def convert_many(self, statuses):
+        """
+        :param statuses: mastodon status dicts
+        :return: list of texts in the order of the statuses
+        """
+        keys = [(status["id"], status.get("edited_at")) for status in statuses]
+        texts = [None] * len(statuses)
+        missing = {}
+        with self.lock:
+            for i, key in enumerate(keys):
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    texts[i] = self.cache[key]
+                else:
+                    missing.setdefault(key, statuses[i]["content"])
+        if len(missing) > 0:
+            converted = dict(zip(missing, self.__convert_contents(list(missing.values()))))
+            with self.lock:
+                for key, text in converted.items():
+                    self.cache[key] = text
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+            texts = [converted[key] if text is None else text for key, text in zip(keys, texts)]
+        return texts
+
+    def __convert_contents(self, contents):
+        if self.processes is None or len(contents) < PROCESS_POOL_MIN_BATCH:
+            return [html_to_text(content) for content in contents]
+        with self.lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=self.processes)
+        chunk_size = max(1, len(contents) // (4 * self.processes))
+        return list(self.pool.map(html_to_text, contents, chunksize=chunk_size))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
+_text_converter = None
+_text_converter_lock = threading.Lock()
+
+
+def get_text_converter():
+    """
+    :return: the HtmlTextConverter shared by the mastodon downloads
+    """
+    global _text_converter
+    with _text_converter_lock:
+        if _text_converter is None:
+            _text_converter = HtmlTextConverter()
+        return _text_converter
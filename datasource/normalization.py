@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+# all platforms deliver their timestamps in (or with an offset to) utc
+NORMALIZED_TIMEZONE = "UTC"
+
+ID_COLUMNS = ("tree_id", "post_id", "parent_id", "author_id")
+TIME_COLUMNS = ("created_at",)
+
+# the values the platforms use for a missing parent, as strings (str(None), str(nan), str(pd.NA))
+MISSING_IDS = ["", "None", "nan", "NA", "<NA>"]
+
+
+def normalize_ids(values):
+    """
+    converts a batch of ids (int, str or missing) into one typed column, missing ids become NA.
+    The contract: if every id that is present is numeric, as the ids of reddit (interned, see id_interning),
+    twitter and mastodon (digit strings) are, the column is int64, or the nullable Int64 if an id is missing
+    (the parent of the root). Otherwise, e.g. for an instance with ids that are not numbers, the column holds
+    str and None.
+    The ids are parsed from their strings by numpy, so that large int ids never pass through float
+    (which pandas would use for a column of ints with a missing value).
+    :param values: list or Series
+    :return: Series of int64 or Int64, or of str and None
+    """
+    strings = np.asarray(values, dtype=object).astype(str)
+    missing = np.isin(strings, MISSING_IDS)
+    present = strings[~missing]
+    # a leading zero would be lost in the int
+    numeric = np.char.isdigit(present) & ~(np.char.startswith(present, "0") & (np.char.str_len(present) > 1))
+    if numeric.all():
+        try:
+            ids = np.zeros(len(strings), dtype=np.int64)
+            ids[~missing] = present.astype(np.int64)
+            if not missing.any():
+                return pd.Series(ids)
+            return pd.Series(pd.arrays.IntegerArray(ids, missing))
+        except OverflowError:
+            pass
+    ids = strings.astype(object)
+    ids[missing] = None
+    return pd.Series(ids, dtype=object)
+
+
+def normalize_timestamps(values):
+    """
+    converts a batch of timestamps into tz-aware datetimes in NORMALIZED_TIMEZONE
+    :param values: epoch seconds (reddit), iso strings (twitter) or datetimes (mastodon)
+    :return: Series of datetime64 with timezone
+    """
+    timestamps = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(timestamps):
+        result = pd.to_datetime(timestamps, unit="s", utc=True)
+    else:
+        result = pd.to_datetime(timestamps, utc=True)
+    if NORMALIZED_TIMEZONE != "UTC":
+        result = result.dt.tz_convert(NORMALIZED_TIMEZONE)
+    return result
+
+
+def normalize_columns(columns):
+    """
+    normalizes the id and time columns of a batch of posts from any platform, other columns are kept as they are
+    :param columns: dict of column name to list or Series
+    :return: dict of column name to Series or list
+    """
+    result = dict(columns)
+    for name in ID_COLUMNS:
+        if name in result:
+            result[name] = normalize_ids(result[name])
+    for name in TIME_COLUMNS:
+        if name in result:
+            result[name] = normalize_timestamps(result[name])
+    return result
+
+
+def records_to_dataframe(records):
+    """
+    :param records: list of post dicts
+    :return: pd.DataFrame with normalized id and time columns
+    """
+    names = list(dict.fromkeys(name for record in records for name in record))
+    columns = {name: [record.get(name) for record in records] for name in names}
+    return pd.DataFrame(normalize_columns(columns))
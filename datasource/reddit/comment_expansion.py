@@ -0,0 +1,106 @@
+import heapq
+import logging
+
+from praw.models import MoreComments
+
+from api_settings import MIN_CONVERSATION_LENGTH, MAX_CONVERSATION_LENGTH_REDDIT, MIN_CONVERSATION_DEPTH, \
+    REDDIT_MAX_EXPANSION_REQUESTS
+from download_exceptions import ConversationNotInRangeException
+
+logger = logging.getLogger(__name__)
+
+
+class ExpansionBudget:
+    """
+    The bounds a reddit conversation has to meet (same as check_general_tree_requirements) and the
+    number of requests that may be spent on expanding its MoreComments stubs.
+    Sizes count the posts including the submission, depths the posts on the longest reply path.
+    """
+
+    def __init__(self, min_posts=MIN_CONVERSATION_LENGTH, max_posts=MAX_CONVERSATION_LENGTH_REDDIT,
+                 min_depth=MIN_CONVERSATION_DEPTH, max_requests=REDDIT_MAX_EXPANSION_REQUESTS):
+        self.min_posts = min_posts
+        self.max_posts = max_posts
+        self.min_depth = min_depth
+        self.max_requests = max_requests
+
+    def size_in_range(self, size):
+        return self.min_posts < size < self.max_posts
+
+
+def expand_comments(submission, budget):
+    """
+    replaces the MoreComments stubs of the submission one request at a time (largest stub first, like replace_more)
+    and aborts as soon as the conversation can no longer meet the bounds of the budget
+    :param submission:
+    :param budget: ExpansionBudget
+    :return: list of the comments of the submission
+    """
+    # num_comments is known from the listing, so hopeless submissions are rejected without any request
+    expected_size = submission.num_comments + 1
+    if not budget.size_in_range(expected_size):
+        raise ConversationNotInRangeException(expected_size)
+
+    comments = []
+    seen = set()
+    more_comments = []
+    n_requests = 1  # loading the comment forest of the submission
+
+    def collect(items):
+        queue = list(items)
+        while queue:
+            item = queue.pop()
+            if isinstance(item, MoreComments):
+                item.submission = submission
+                heapq.heappush(more_comments, item)
+            elif item.id not in seen:
+                seen.add(item.id)
+                item.submission = submission
+                comments.append(item)
+                queue.extend(item.replies)
+
+    collect(submission.comments)
+    while True:
+        size = len(comments) + 1
+        if size >= budget.max_posts:
+            logger.debug("aborting expansion of {} after {} requests, too many posts".format(submission.id,
+                                                                                          n_requests))
+            raise ConversationNotInRangeException(size)
+        if len(more_comments) == 0:
+            break
+        if n_requests >= budget.max_requests:
+            logger.debug("aborting expansion of {}, the budget of {} requests is spent".format(submission.id,
+                                                                                             n_requests))
+            raise ConversationNotInRangeException(size, "Conversation could not be expanded within the budget")
+        more = heapq.heappop(more_comments)
+        n_requests += 1
+        collect(more.comments())
+
+    if not budget.size_in_range(size):
+        raise ConversationNotInRangeException(size)
+    depth = max_comment_depth(submission, comments)
+    if depth < budget.min_depth:
+        raise ConversationNotInRangeException(size, "Conversation is not deep enough")
+    return comments
+
+
+def max_comment_depth(submission, comments):
+    """
+    :param submission:
+    :param comments:
+    :return: the number of posts on the longest reply path, the submission included
+    """
+    depths = {submission.fullname: 1}
+    parents = {comment.fullname: comment.parent_id for comment in comments}
+    for fullname in parents:
+        path = []
+        current = fullname
+        while current not in depths and current in parents:
+            path.append(current)
+            current = parents[current]
+        # comments whose parent is missing start a new path
+        depth = depths.get(current, 0)
+        for node in reversed(path):
+            depth += 1
+            depths[node] = depth
+    return max(depths.values())
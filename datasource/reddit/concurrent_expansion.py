@@ -0,0 +1,121 @@
+import copy
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from itertools import islice
+
+import praw
+import prawcore
+
+from api_settings import REDDIT_EXPANSION_WORKERS, REDDIT_TOO_MANY_REQUESTS_PAUSE
+from connection_util import connector_pool, thread_connector
+from datasource.reddit.download_conversations_reddit import compute_reddit_delab_tree
+from download_exceptions import ConversationNotInRangeException
+from models.platform import PLATFORM
+from rate_limits import endpoint_of
+
+logger = logging.getLogger(__name__)
+
+
+def bind_submission(submission, reddit):
+    """
+    :param submission: lazy praw submission
+    :param reddit: the praw instance of the current thread
+    :return: a copy of the submission that sends its requests through reddit
+    """
+    if getattr(submission, "_reddit", None) is reddit:
+        return submission
+    # fetching replaces the attributes of the copy, the submission itself is not changed
+    bound = copy.copy(submission)
+    bound._reddit = reddit
+    return bound
+
+
+def expand_submission(submission, language=None, expansion_budget=None, rate_limits=None):
+    """
+    downloads the comments of one submission, errors are logged instead of raised
+    :param submission:
+    :param language:
+    :param expansion_budget: ExpansionBudget, submissions that do not fit are skipped
+    :param rate_limits: RateLimitScheduler of the praw instance, knows when the quota is reset
+    :return: DelabTree or None if the submission could not be downloaded
+    """
+    for attempt in range(2):
+        try:
+            return compute_reddit_delab_tree(submission, language, expansion_budget)
+        except ConversationNotInRangeException as ex:
+            logger.debug("skipping submission {}: {}".format(submission.id, ex))
+            return None
+        except prawcore.exceptions.TooManyRequests:
+            # the scheduler holds back the requests of all threads until the reset announced by reddit,
+            # the fixed pause is only used if reddit did not announce it
+            seconds = None
+            if rate_limits is not None:
+                seconds = rate_limits.seconds_until_reset(PLATFORM.REDDIT)
+            if seconds is None:
+                seconds = REDDIT_TOO_MANY_REQUESTS_PAUSE
+                if rate_limits is not None:
+                    rate_limits.pause(PLATFORM.REDDIT, endpoint_of(PLATFORM.REDDIT, None), seconds)
+            logger.debug("too many requests, pausing for {:.0f} seconds".format(seconds))
+            if rate_limits is None:
+                time.sleep(seconds)
+        except (prawcore.exceptions.PrawcoreException, praw.exceptions.PRAWException) as ex:
+            logger.debug("could not expand submission {}: {}".format(submission.id, ex))
+            return None
+    return None
+
+
+def expand_in_thread(submission, reddit, *args):
+    """
+    expand_submission with the copy of the praw instance that belongs to the worker thread, praw is not thread-safe
+    """
+    return expand_submission(bind_submission(submission, thread_connector(reddit, PLATFORM.REDDIT)), *args)
+
+
+def expand_submissions(submissions, reddit, language=None, max_workers=REDDIT_EXPANSION_WORKERS,
+                       expansion_budget=None):
+    """
+    expands the submissions in parallel under the rate limits of the praw instance (see rate_limits),
+    the requests of all workers are paced by the token bucket of reddit.
+    praw objects are lazy, so the first access to a submission and the expansion of its comments
+    both run in the worker threads, each with its own copy of the praw instance.
+    :param submissions: list of submissions
+    :param reddit: the praw instance the submissions were created with
+    :param language:
+    :param max_workers: number of submissions expanded at the same time
+    :param expansion_budget: ExpansionBudget, all comments are expanded if None
+    :return: list of DelabTree or None (for failed or skipped submissions) in the order of the submissions
+    """
+    # set by connection_util.get_praw
+    rate_limits = getattr(reddit, "rate_limits", None)
+    if max_workers <= 1 or len(submissions) <= 1:
+        return [expand_submission(submission, language, expansion_budget, rate_limits)
+                for submission in submissions]
+    # the copies for the workers are made from the praw instance of the calling thread
+    connector_pool(reddit, PLATFORM.REDDIT)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # each worker runs in a copy of the context, so that its requests are counted for the caller
+        futures = [executor.submit(copy_context().run, expand_in_thread, submission, reddit, language,
+                                   expansion_budget, rate_limits)
+                   for submission in submissions]
+        return [future.result() for future in futures]
+
+
+def expand_submission_stream(submissions, reddit, language=None, max_workers=REDDIT_EXPANSION_WORKERS,
+                             expansion_budget=None):
+    """
+    like expand_submissions for long listings, the submissions are read and expanded in chunks of max_workers
+    so that the caller can stop early
+    :param submissions: iterable of submissions, e.g. a listing
+    :return: generator of (submission, DelabTree or None) in the order of the submissions
+    """
+    iterator = iter(submissions)
+    chunk_size = max(max_workers, 1)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if len(chunk) == 0:
+            return
+        trees = expand_submissions(chunk, reddit, language, max_workers=max_workers,
+                                   expansion_budget=expansion_budget)
+        yield from zip(chunk, trees)
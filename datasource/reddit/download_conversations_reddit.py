@@ -1,16 +1,20 @@
 import datetime
 import logging
-import time
+from itertools import islice
+
 import prawcore
 import pytz
 
-from api_settings import MAX_CANDIDATES_REDDIT
-from connection_util import get_praw
+from api_settings import MAX_CANDIDATES_REDDIT, REDDIT_COMPACT_PAYLOAD
+from connection_util import get_connector
 from delab_trees import TreeNode
-from delab_trees.delab_tree import DelabTree
-from delab_trees.recursive_tree.recursive_tree_util import solve_orphans
+from datasource.delab_tree_builder import DelabTreeBuilder
+from datasource.normalization import ID_COLUMNS, TIME_COLUMNS, normalize_columns
+from datasource.reddit.comment_expansion import expand_comments
+from datasource.tree_assembly import assemble_recursive_tree
+from id_interning import ID_NAMESPACE, get_id_interner
 from models.language import LANGUAGE
-from util.abusing_strings import convert_to_hash
+from models.platform import PLATFORM
 
 """
 get the moderators like this
@@ -25,6 +29,14 @@ for message in reddit.subreddit("mod").mod.inbox(limit=5):
 
 logger = logging.getLogger(__name__)
 
+# the scalar attributes kept in rd_data in compact mode
+RD_SUBMISSION_FIELDS = ("id", "name", "subreddit_id", "subreddit_name_prefixed", "score", "upvote_ratio",
+                        "num_comments", "created_utc", "edited", "over_18", "stickied", "locked", "is_self",
+                        "link_flair_text", "url", "permalink")
+RD_COMMENT_FIELDS = ("id", "name", "subreddit_id", "subreddit_name_prefixed", "link_id", "parent_id", "score",
+                     "controversiality", "created_utc", "edited", "stickied", "distinguished", "is_submitter",
+                     "permalink")
+
 
 def search_r_all(query: str, max_conversations=5, reddit=None, recent=True,
                  language=LANGUAGE.ENGLISH):
@@ -37,124 +49,198 @@ def search_r_all(query: str, max_conversations=5, reddit=None, recent=True,
     :param language:
     :return:
     """
-    trees = []
+    return list(iter_r_all(query, max_conversations, reddit, recent, language))
+
+
+def iter_r_all(query: str, max_conversations=5, reddit=None, recent=True,
+               language=LANGUAGE.ENGLISH):
+    """
+    the generator version of search_r_all, the submissions are expanded in parallel chunks
+    and no more chunks are expanded once the caller stops iterating
+    :return: generator of DelabTree
+    """
+    # imported here because the concurrent expansion reuses compute_reddit_delab_tree of this module
+    from datasource.reddit.concurrent_expansion import expand_submission_stream
+
     if reddit is None:
-        reddit = get_praw()
+        reddit = get_connector(PLATFORM.REDDIT)
     try:
         if recent:
-            for submission in reddit.subreddit("all").search(query=query, limit=MAX_CANDIDATES_REDDIT,
-                                                             sort="new"):
-                result_tree = compute_reddit_tree(submission, language)
-                trees.append(result_tree)
-                if len(trees) >= max_conversations:
-                    break
+            listing = reddit.subreddit("all").search(query=query, limit=MAX_CANDIDATES_REDDIT, sort="new")
         else:
-            for submission in reddit.subreddit("all").search(query=query, limit=MAX_CANDIDATES_REDDIT):
-                result_tree = compute_reddit_tree(submission, language)
-                trees.append(result_tree)
-                if len(trees) >= max_conversations:
-                    break
+            listing = reddit.subreddit("all").search(query=query, limit=MAX_CANDIDATES_REDDIT)
+        for submission, tree in expand_submission_stream(islice(listing, max_conversations), reddit, language):
+            if tree is not None:
+                yield tree
     except prawcore.exceptions.Redirect:
         logger.error("reddit with this name does not exist")
 
-    result = [DelabTree.from_recursive_tree(x) for x in trees]
-    return result
-
 
 def download_subreddit(reddit, sub_reddit_string, language=LANGUAGE.ENGLISH,
                        hot=False):
+    from datasource.reddit.concurrent_expansion import expand_submission_stream
+
     logger.debug("saving subreddit {}".format(sub_reddit_string))
 
     if reddit is None:
-        reddit = get_praw()
+        reddit = get_connector(PLATFORM.REDDIT)
     trees = []
     try:
         if not hot:
-            count = 0
-            for submission in reddit.subreddit(sub_reddit_string).top(limit=None):
-                try:
-                    count += 1
-                    logger.debug("saving subreddit {}, submission {}".format(sub_reddit_string, count))
-                    trees.append(compute_reddit_tree(submission, language))
-                except prawcore.exceptions.TooManyRequests:
-                    time.sleep(600)
+            listing = reddit.subreddit(sub_reddit_string).top(limit=None)
         else:
-            for submission in reddit.subreddit(sub_reddit_string).hot(limit=10):
-                trees.append(compute_reddit_tree(submission, language))
+            listing = reddit.subreddit(sub_reddit_string).hot(limit=10)
+        # the submissions are expanded in parallel, a submission that fails is skipped
+        for count, (submission, tree) in enumerate(expand_submission_stream(listing, reddit, language), start=1):
+            logger.debug("saving subreddit {}, submission {}".format(sub_reddit_string, count))
+            if tree is not None:
+                trees.append(tree)
     except prawcore.exceptions.Redirect:
         logger.error("reddit with this name does not exist{}".format(sub_reddit_string))
     except prawcore.exceptions.Forbidden:
         logger.error("reddit with this name could not be accessed {}".format(sub_reddit_string))
-    result = [DelabTree.from_recursive_tree(x) for x in trees]
-    return result
+    return trees
 
 
-def compute_reddit_tree(submission, language=None):
+def compute_reddit_tree(submission, language=None, compact=REDDIT_COMPACT_PAYLOAD):
     comments = sort_comments_for_db(submission)
 
+    intern_conversation(submission, comments)
+    tree_id, data = submission_to_record(submission, language, compact)
+    records = [data] + [comment_to_record(comment, tree_id, language, compact)[2] for comment in comments]
+    # the same ids and utc timestamps as in the table of compute_reddit_delab_tree
+    columns = normalize_columns({name: [record.get(name) for record in records]
+                                 for name in ID_COLUMNS + TIME_COLUMNS})
+    for name, values in columns.items():
+        for record, value in zip(records, values.tolist()):
+            record[name] = value
     # root node
+    tree_id = data["tree_id"]
+    root = TreeNode(data, tree_id, tree_id=tree_id)
+    nodes = [TreeNode(record, record["post_id"], record["parent_id"], tree_id=tree_id) for record in records[1:]]
+    # nodes whose parent never shows up are reported as orphans instead of being placed in the tree
+    root, orphans = assemble_recursive_tree(root, nodes)
+    if len(orphans) > 0:
+        logger.error('{} orphaned tweets for conversation {}'.format(len(orphans), submission.fullname))
+        logger.error('{} downloaded tweets'.format(len(comments)))
+    return root
+
+
+def compute_reddit_delab_tree(submission, language=None, budget=None, compact=REDDIT_COMPACT_PAYLOAD):
+    """
+    same as compute_reddit_tree but collects the comments directly into the DelabTree table
+    instead of going through a recursive TreeNode structure
+    :param submission:
+    :param language:
+    :param budget: ExpansionBudget, raises ConversationNotInRangeException if the conversation does not fit
+    :param compact: see submission_to_record
+    :return: DelabTree
+    """
+    comments = sort_comments_for_db(submission, budget)
+
+    intern_conversation(submission, comments)
+    tree_id, data = submission_to_record(submission, language, compact)
+    builder = DelabTreeBuilder(tree_id, tree_id, data)
+    for comment in comments:
+        node_id, parent_id, comment_data = comment_to_record(comment, tree_id, language, compact)
+        builder.add_post(node_id, parent_id, comment_data)
+    orphans = builder.orphan_report()
+    if len(orphans) > 0:
+        logger.error('{} orphaned tweets for conversation {}'.format(len(orphans), submission.fullname))
+        logger.error('{} downloaded tweets'.format(len(comments)))
+    return builder.to_delab_tree()
+
+
+def intern_conversation(submission, comments):
+    """
+    the new ids of the whole conversation are assigned at once instead of one transaction per post
+    """
+    id_interner = get_id_interner()
+    id_interner.intern_many(ID_NAMESPACE.REDDIT_POST,
+                            [submission.fullname] + [comment.fullname for comment in comments])
+    id_interner.intern_many(ID_NAMESPACE.REDDIT_AUTHOR,
+                            [author_name(thing) for thing in [submission] + comments])
+
+
+def submission_to_record(submission, language=None, compact=REDDIT_COMPACT_PAYLOAD):
+    """
+    :param submission:
+    :param language: used if the submission has no language set
+    :param compact: store a dict of scalar fields as rd_data instead of the praw object,
+           which references the reddit session and the comment forest
+    :return: (tree_id, record) the submission is the root so its post_id is the tree_id
+    """
     author_id, author_name = compute_author_id(submission)
-    tree_id = str(convert_to_hash(submission.fullname))
-    root_node_id = str(convert_to_hash(submission.fullname))
-    if hasattr(submission, 'lang'):
-        submission_lang = submission.lang
-    else:
-        submission_lang = language
+    tree_id = get_id_interner().intern(ID_NAMESPACE.REDDIT_POST, submission.fullname)
+    # vars() instead of hasattr, praw would fetch a submission that was not loaded yet for the missing attribute
+    submission_lang = vars(submission).get('lang', language)
     data = {
         "tree_id": tree_id,
-        "post_id": root_node_id,
+        "post_id": tree_id,
         "text": submission.title + "\n" + submission.selftext,
         "author_id": author_id,
-        "created_at": convert_time_stamp_to_django(submission),
+        # the epoch is converted for the whole table by DelabTreeBuilder
+        "created_at": submission.created_utc,
         "tw_author__name": author_name,
-        "rd_data": submission,
+        "rd_data": compact_rd_data(submission, RD_SUBMISSION_FIELDS) if compact else submission,
         "lang": submission_lang,
         "url": "https://reddit.com" + submission.permalink,
         "reddit_id": submission.id}
-    root = TreeNode(data, root_node_id, tree_id=tree_id)
-    orphans = []
+    return tree_id, data
 
-    for comment in comments:
-        # node_id = comment.id
-        node_id = str(convert_to_hash(comment.fullname))
-        # parent_id = comment.parent_id.split("_")[1]
-        parent_id = str(convert_to_hash(comment.parent_id))
-        comment_author_id, comment_author_name = compute_author_id(comment)
-        if hasattr(comment, 'lang'):
-            comment_lang = comment.lang
-        else:
-            comment_lang = language
-        comment_data = {
-            "tree_id": tree_id,
-            "post_id": node_id,
-            "text": comment.body,
-            "author_id": comment_author_id,
-            "tw_author__name": comment_author_name,
-            "created_at": convert_time_stamp_to_django(comment),
-            "parent_id": parent_id,
-            "rd_data": comment,
-            "lang": comment_lang,
-            "url": "https://reddit.com" + comment.permalink,
-            "reddit_id": comment.id}
-        node = TreeNode(comment_data, node_id, parent_id, tree_id=tree_id)
-        # IF NODE CANNOT BE PLACED IN TREE, ORPHAN IT UNTIL ITS PARENT IS FOUND
-        if not root.find_parent_of(node):
-            orphans.append(node)
-    # logger.info('{} orphaned tweets for conversation {} before resolution'.format(len(orphans), submission.id))
-    orphan_added = True
-    while orphan_added:
-        orphan_added, orphans = solve_orphans(orphans, root)
-    if len(orphans) > 0:
-        logger.error('{} orphaned tweets for conversation {}'.format(len(orphans), submission.fullname))
-        logger.error('{} downloaded tweets'.format(len(comments)))
-    return root
 
+def comment_to_record(comment, tree_id, language=None, compact=REDDIT_COMPACT_PAYLOAD):
+    """
+    :param comment:
+    :param tree_id:
+    :param language: used if the comment has no language set
+    :param compact: see submission_to_record
+    :return: (post_id, parent_id, record)
+    """
+    id_interner = get_id_interner()
+    node_id = id_interner.intern(ID_NAMESPACE.REDDIT_POST, comment.fullname)
+    parent_id = id_interner.intern(ID_NAMESPACE.REDDIT_POST, comment.parent_id)
+    comment_author_id, comment_author_name = compute_author_id(comment)
+    comment_lang = vars(comment).get('lang', language)
+    comment_data = {
+        "tree_id": tree_id,
+        "post_id": node_id,
+        "text": comment.body,
+        "author_id": comment_author_id,
+        "tw_author__name": comment_author_name,
+        "created_at": comment.created_utc,
+        "parent_id": parent_id,
+        "rd_data": compact_rd_data(comment, RD_COMMENT_FIELDS) if compact else comment,
+        "lang": comment_lang,
+        "url": "https://reddit.com" + comment.permalink,
+        "reddit_id": comment.id}
+    return node_id, parent_id, comment_data
+
+
+def compact_rd_data(thing, fields):
+    """
+    :param thing: praw submission or comment
+    :param fields: the attributes to keep
+    :return: dict of the fields the thing has been loaded with, missing fields are not fetched
+    """
+    # vars() instead of getattr, praw would fetch a lazy object for a missing attribute
+    attributes = vars(thing)
+    return {field: attributes[field] for field in fields if field in attributes}
 
-def sort_comments_for_db(submission):
-    submission.comments.replace_more(limit=None)
-    result = []
-    for comment in submission.comments.list():
-        result.append(comment)
+
+def sort_comments_for_db(submission, budget=None):
+    """
+    :param submission:
+    :param budget: ExpansionBudget, all comments are expanded if None
+    :return: the comments sorted by creation time
+    """
+    if budget is None:
+        submission.comments.replace_more(limit=None)
+        result = []
+        for comment in submission.comments.list():
+            result.append(comment)
+    else:
+        result = expand_comments(submission, budget)
     if len(result) > 3:
         pass
     result.sort(key=lambda x: x.created)
@@ -163,16 +249,21 @@ def sort_comments_for_db(submission):
 
 
 def convert_time_stamp_to_django(comment):
-    created_time = datetime.datetime.fromtimestamp(comment.created_utc)
+    # created_utc is an epoch, fromtimestamp without tz would use the timezone of the machine
+    created_time = datetime.datetime.fromtimestamp(comment.created_utc, tz=datetime.timezone.utc)
     amsterdam_timezone = pytz.timezone('Europe/Berlin')
-    created_time = amsterdam_timezone.localize(created_time)
+    created_time = created_time.astimezone(amsterdam_timezone)
     return created_time
 
 
 def compute_author_id(comment):
+    name = author_name(comment)
+    return get_id_interner().intern(ID_NAMESPACE.REDDIT_AUTHOR, name), name
+
+
+def author_name(comment):
     name = "[deleted]"
     if comment.author is not None:
         if hasattr(comment.author, "name"):
             name = comment.author.name
-    author_id = convert_to_hash(name)
-    return author_id, name
+    return name
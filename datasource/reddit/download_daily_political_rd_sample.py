@@ -1,15 +1,15 @@
 import logging
+
 import prawcore
 
-from copy import deepcopy
-from datetime import datetime
-from random import choice
-from time import sleep
-from connection_util import get_praw
-from datasource.reddit.download_conversations_reddit import compute_reddit_tree
-from delab_trees.delab_tree import DelabTree
+from connection_util import get_connector
+from datasource.candidate_ranking import rank_candidates
+from datasource.reddit.comment_expansion import ExpansionBudget
+from datasource.reddit.concurrent_expansion import expand_submission_stream
 from download_exceptions import NoDailySubredditAvailableException
 from models.language import LANGUAGE
+from models.platform import PLATFORM
+from sampler_state import get_sampler_state, today
 
 logger = logging.getLogger(__name__)
 
@@ -203,30 +203,46 @@ class RD_Sampler:
         "PoliticalHumor"
     ]
 
-    daily_en_subreddits = {}
-    daily_de_subreddits = {}
-
-    def __init__(self, language):
-        current_date, subreddit_string = pick_random_subreddit(language)
+    def __init__(self, language, state=None):
+        """
+        :param language:
+        :param state: SamplerState with the daily picks and the yields, shared by the samplers running in parallel
+        """
+        if state is None:
+            state = get_sampler_state()
+        current_date, subreddit_string = pick_subreddit(language, state)
         self.subreddit_string = subreddit_string
-        logger.debug(
-            "current subreddits to search are en: {}, de: {}".format(len(RD_Sampler.daily_en_subreddits[current_date]),
-                                                                     len(RD_Sampler.daily_de_subreddits[current_date])))
         self.language = language
         self.current_date = current_date
+        self.state = state
+        logger.debug("current subreddits to search for lang {}: {}".format(language, self.n_available()))
 
-    def download_daily_rd_sample(self, max_results, connector):
+    def download_daily_rd_sample(self, max_results, connector, cancel_event=None):
+        """
+        :param max_results:
+        :param connector: praw instance
+        :param cancel_event: threading.Event, the download stops after the current chunk of submissions once it is set
+        :return: list of DelabTree
+        """
         result = []
         try:
-            if connector is None:
-                reddit = get_praw()
+            reddit = connector
+            if reddit is None:
+                reddit = get_connector(PLATFORM.REDDIT)
 
             # could use .hot()
             count = 0
-            for submission in reddit.subreddit(self.subreddit_string).top(time_filter='day'):
-                # print(submission)
-                root = compute_reddit_tree(submission, self.language)
-                tree = DelabTree.from_recursive_tree(root)
+            listing = reddit.subreddit(self.subreddit_string).top(time_filter='day')
+            # the listing is one request, the submissions that are likely to fit are expanded first
+            candidates = rank_candidates(PLATFORM.REDDIT, listing)
+            # the submissions are expanded in parallel chunks, so the loop can stop after any chunk,
+            # conversations that cannot meet the tree requirements are dropped during the expansion
+            for submission, tree in expand_submission_stream(candidates, reddit, self.language,
+                                                             expansion_budget=ExpansionBudget()):
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                if tree is None:
+                    continue
                 # validate tree here so that there are not too many downloads necessary
                 valid = tree.validate(verbose=False)
                 if valid:
@@ -241,48 +257,36 @@ class RD_Sampler:
         except prawcore.exceptions.Redirect as ex:
             logger.debug(ex)
         except prawcore.exceptions.TooManyRequests as ex:
-            # logger.debug(ex)
-            logger.debug("too many requests, going to sleep for 15 min")
-            sleep(60 * 15)
+            # the rate limit scheduler of the connector delays the next request until the quota is reset
+            logger.debug("too many requests, the next request waits for the reset of the quota")
         except prawcore.exceptions.ServerError as ex:
             logger.debug(ex)
         except prawcore.exceptions.ResponseException as ex:
             logger.debug(ex)
         logger.debug("returning {} conversations for subreddit {}, {} subreddits not searched for lang {}"
-                     .format(len(result), self.subreddit_string, len(self.get_current_dictionary()), self.language))
+                     .format(len(result), self.subreddit_string, self.n_available(), self.language))
 
         return result
 
-    def get_current_dictionary(self):
-        if self.language == LANGUAGE.ENGLISH:
-            return self.daily_en_subreddits[self.current_date]
-        else:
-            return self.daily_de_subreddits[self.current_date]
+    def n_available(self):
+        return self.state.n_available(PLATFORM.REDDIT, self.language, subreddit_pool(self.language),
+                                      self.current_date)
 
 
-def pick_random_subreddit(language):
-    current_date = datetime.now().date()
-    # init dictionary of subreddits if empty
-    if current_date not in RD_Sampler.daily_en_subreddits:
-        RD_Sampler.daily_en_subreddits[current_date] = deepcopy(RD_Sampler.subreddits)
-    if current_date not in RD_Sampler.daily_de_subreddits:
-        RD_Sampler.daily_de_subreddits[current_date] = deepcopy(RD_Sampler.german_political_subreddits)
-    # get current state of available subreddits and pick one
+def subreddit_pool(language):
     if language == LANGUAGE.GERMAN:
-        available_reddits = RD_Sampler.daily_de_subreddits[current_date]
-    else:
-        available_reddits = RD_Sampler.daily_en_subreddits[current_date]
-    if len(available_reddits) == 0:
+        return RD_Sampler.german_political_subreddits
+    return RD_Sampler.subreddits
+
+
+def pick_subreddit(language, state):
+    """
+    :param language:
+    :param state: SamplerState
+    :return: (the day, the subreddit to sample next)
+    """
+    current_date = today()
+    subreddit_string = state.pick_source(PLATFORM.REDDIT, language, subreddit_pool(language), current_date)
+    if subreddit_string is None:
         raise NoDailySubredditAvailableException(language=language)
-    else:
-        subreddit_string = choice(available_reddits)
-    # update dictionary with current available states
-    if language == LANGUAGE.ENGLISH:
-        current_list = deepcopy(RD_Sampler.daily_en_subreddits[current_date])
-        current_list.remove(subreddit_string)
-        RD_Sampler.daily_en_subreddits[current_date] = current_list
-    else:
-        current_list = deepcopy(RD_Sampler.daily_de_subreddits[current_date])
-        current_list.remove(subreddit_string)
-        RD_Sampler.daily_de_subreddits[current_date] = current_list
     return current_date, subreddit_string
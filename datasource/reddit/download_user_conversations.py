@@ -1,15 +1,71 @@
-import praw
+from itertools import islice
 
-from connection_util import get_praw
+from connection_util import get_connector
 from datetime import datetime, timezone
 
-from datasource.reddit.download_conversations_reddit import compute_reddit_tree
-from delab_trees.delab_tree import DelabTree
+from datasource.candidate_ranking import rank_candidates
+from datasource.reddit.comment_expansion import ExpansionBudget
+from datasource.reddit.concurrent_expansion import expand_submission_stream
+from models.platform import PLATFORM
 
+SUBMISSION_IDS_UNIT = "submission_ids"
+INFO_BATCH_SIZE = 100  # max fullnames per request to /api/info
 
-def get_user_conversations(username, start_date=None, max_conversations=1000, reddit=None):
+
+def get_user_conversations(username, start_date=None, max_conversations=1000, reddit=None, checkpoint=None):
+    """
+    :param username:
+    :param start_date: epoch, the default is 2023-01-01
+    :param max_conversations:
+    :param reddit:
+    :param checkpoint: JobCheckpoint, the listing of the user and every expanded submission are recorded in it,
+           so that a restarted download only expands the submissions that are missing
+    :return: list of DelabTree, the conversations that meet the tree requirements in the order of their ids
+    """
     if reddit is None:
-        reddit = get_praw()
+        reddit = get_connector(PLATFORM.REDDIT)
+
+    submission_ids = None
+    if checkpoint is not None:
+        submission_ids = checkpoint.result(SUBMISSION_IDS_UNIT)
+    if submission_ids is None:
+        submission_ids = list_user_submission_ids(reddit, username, start_date, max_conversations)
+        if checkpoint is not None:
+            checkpoint.complete(SUBMISSION_IDS_UNIT, submission_ids)
+
+    trees = {}
+    missing = []
+    for submission_id in submission_ids:
+        if checkpoint is not None and checkpoint.is_done(submission_id):
+            trees[submission_id] = checkpoint.result(submission_id)
+        else:
+            missing.append(submission_id)
+    # the batches of /api/info come with num_comments, so the submissions that cannot meet the tree requirements
+    # are skipped without loading their comments and the largest ones are expanded first
+    submissions = list(hydrate_submissions(reddit, missing))
+    candidates = rank_candidates(PLATFORM.REDDIT, submissions)
+    if checkpoint is not None:
+        ranked = set(submission.id for submission in candidates)
+        for submission in submissions:
+            if submission.id not in ranked:
+                checkpoint.complete(submission.id, None)
+    # the trees are recorded as they are expanded (in chunks of REDDIT_EXPANSION_WORKERS)
+    for submission, tree in expand_submission_stream(candidates, reddit, expansion_budget=ExpansionBudget()):
+        trees[submission.id] = tree
+        if checkpoint is not None:
+            checkpoint.complete(submission.id, tree)
+
+    # deleted or removed submissions are not returned by reddit
+    trees = [trees.get(submission_id) for submission_id in submission_ids]
+    return [tree for tree in trees if tree is not None]
+
+
+def list_user_submission_ids(reddit, username, start_date=None, max_conversations=1000):
+    """
+    walks the comments and submissions of the user from the newest to the oldest and stops as soon as
+    max_conversations submissions are found or the listing is older than the start date
+    :return: the sorted ids of the submissions the user commented on or posted
+    """
 
     if start_date is None:
         # Define the start date for fetching comments and submissions
@@ -17,21 +73,54 @@ def get_user_conversations(username, start_date=None, max_conversations=1000, re
 
     user = reddit.redditor(username)
 
-    submissions = set()
+    # the ids are collected without creating a submission per comment, the set removes the duplicates.
+    # The cap is checked before the next thing is read, as reading it can fetch the next page of the listing
+    submission_ids = set()
     # Fetch submissions from the user's comments
-    for comment in user.comments.new(limit=None):  # Adjust limit as necessary
-        if comment.created_utc >= start_date and len(submissions) < max_conversations:
-            submission = reddit.submission(id=comment.link_id.split('_')[1])
-            submissions.add(submission)
-
-        # Fetch submissions directly made by the user
-    for submission in user.submissions.new(limit=None):  # Adjust limit as necessary
-        if submission.created_utc >= start_date and len(submissions) < max_conversations:
-            submissions.add(submission)
-
-    trees = []
-    for submission in submissions:
-        trees.append(compute_reddit_tree(submission))
-
-    trees_delab_format = [DelabTree.from_recursive_tree(x) for x in trees]
-    return trees_delab_format
+    if max_conversations > 0:
+        for comment in newer_than(user.comments.new(limit=None), start_date):
+            submission_ids.add(comment.link_id.split('_')[1])
+            if len(submission_ids) >= max_conversations:
+                break
+
+    # Fetch submissions directly made by the user
+    if len(submission_ids) < max_conversations:
+        for submission in newer_than(user.submissions.new(limit=None), start_date):
+            submission_ids.add(submission.id)
+            if len(submission_ids) >= max_conversations:
+                break
+
+    # sorted so that the order of the trees does not depend on the hashing of the set
+    return sorted(submission_ids)
+
+
+def newer_than(listing, start_date):
+    """
+    :param listing: a listing sorted by new
+    :param start_date: epoch
+    :return: generator of the things created at or after the start date, the listing is not read any further
+    once a thing is older
+    """
+    for thing in listing:
+        if thing.created_utc < start_date:
+            # things pinned to the profile are listed first whatever their age
+            if getattr(thing, "stickied", False) or getattr(thing, "pinned", False):
+                continue
+            return
+        yield thing
+
+
+def hydrate_submissions(reddit, submission_ids, batch_size=INFO_BATCH_SIZE):
+    """
+    loads the submissions with one request per batch_size ids instead of one request per submission
+    :param reddit:
+    :param submission_ids: ids without the t3_ prefix
+    :param batch_size:
+    :return: generator of submissions in the order of the ids, the ones reddit does not return are skipped
+    """
+    iterator = iter(submission_ids)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if len(batch) == 0:
+            return
+        yield from reddit.info(fullnames=["t3_{}".format(submission_id) for submission_id in batch])
@@ -1,13 +1,50 @@
-from connection_util import get_praw
-from datasource.reddit.download_conversations_reddit import compute_reddit_tree
-from delab_trees.delab_tree import DelabTree
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+from api_settings import REDDIT_EXPANSION_WORKERS
+from connection_util import connector_pool, get_connector, thread_connector
+from datasource.conversation_urls import ConversationByUrl
+from datasource.reddit.download_conversations_reddit import compute_reddit_delab_tree
+from models.platform import PLATFORM
+
+logger = logging.getLogger(__name__)
 
 
 def get_conversations_by_url(url, reddit=None):
     if reddit is None:
-        reddit = get_praw()
+        reddit = get_connector(PLATFORM.REDDIT)
 
     original_comment = reddit.submission(url=url)
-    recursive_tree = compute_reddit_tree(original_comment)
-    delab_tree = DelabTree.from_recursive_tree(recursive_tree)
-    return delab_tree
+    return compute_reddit_delab_tree(original_comment)
+
+
+def get_conversation_in_thread(url, reddit):
+    # praw is not thread-safe, every worker uses its own copy of the praw instance
+    return get_conversations_by_url(url, thread_connector(reddit, PLATFORM.REDDIT))
+
+
+def get_conversations_by_urls(urls, reddit=None, max_workers=REDDIT_EXPANSION_WORKERS):
+    """
+    downloads the conversations of many urls in parallel with copies of one praw instance
+    under the rate limits of the praw instance (see rate_limits)
+    :param urls: urls of submissions or comments
+    :param reddit: the praw instance, created once if None
+    :param max_workers: number of conversations downloaded at the same time
+    :return: dict of url to ConversationByUrl, with the error if the conversation could not be downloaded
+    """
+    if reddit is None:
+        reddit = get_connector(PLATFORM.REDDIT)
+    urls = list(dict.fromkeys(urls))
+    connector_pool(reddit, PLATFORM.REDDIT)
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+        # each worker runs in a copy of the context, so that its requests are counted for the caller
+        futures = {url: executor.submit(copy_context().run, get_conversation_in_thread, url, reddit) for url in urls}
+        results = {}
+        for url, future in futures.items():
+            try:
+                results[url] = ConversationByUrl(url, PLATFORM.REDDIT, tree=future.result())
+            except Exception as ex:
+                logger.debug("could not download {}: {}".format(url, ex))
+                results[url] = ConversationByUrl(url, PLATFORM.REDDIT, error=ex)
+    return results
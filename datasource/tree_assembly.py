@@ -0,0 +1,127 @@
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+class OrphanReport:
+    """
+    The posts of a download that could not be connected to the root of their conversation.
+
+    Attributes:
+        tree_id -- the conversation the orphans belong to
+        orphans -- the posts that are not part of the tree (in the order they were added)
+        missing_parent_ids -- parent ids that never showed up in the download
+    """
+
+    def __init__(self, tree_id, orphans, missing_parent_ids):
+        self.tree_id = tree_id
+        self.orphans = orphans
+        self.missing_parent_ids = missing_parent_ids
+
+    def __len__(self):
+        return len(self.orphans)
+
+    def __iter__(self):
+        return iter(self.orphans)
+
+    def __str__(self):
+        return "{} orphaned posts in tree {} waiting for {} missing parents".format(len(self.orphans),
+                                                                                  self.tree_id,
+                                                                                  len(self.missing_parent_ids))
+
+
+class ReplyTreeAssembler:
+    """
+    Places posts into a reply tree in a single pass.
+    Every attached post is indexed by its id so finding the parent is a dictionary lookup instead of a tree walk.
+    Posts arriving before their parent wait in a bucket keyed by the parent id and are attached
+    as soon as the parent arrives, which replaces the repeated solve_orphans passes.
+    """
+
+    def __init__(self, root_id, root=None, tree_id=None, on_attach=None):
+        """
+        :param root_id: the post id of the root
+        :param root: the payload stored for the root (e.g. a TreeNode or a record)
+        :param tree_id: used for reporting only, defaults to the root_id
+        :param on_attach: optional callback(parent_payload, child_payload) called once per attached post
+        """
+        self.root_id = root_id
+        self.tree_id = root_id if tree_id is None else tree_id
+        self.on_attach = on_attach
+        self.posts = {root_id: root}
+        self.depths = {root_id: 0}
+        self.waiting = defaultdict(list)
+        self.max_path_length = 0
+
+    def __contains__(self, post_id):
+        return post_id in self.depths
+
+    def add(self, post_id, parent_id, post=None):
+        """
+        adds a post to the tree or lets it wait for its parent
+        :param post_id:
+        :param parent_id:
+        :param post: the payload to store for the post
+        :return: True if the post is connected to the root now
+        """
+        if post_id in self.depths:
+            logger.debug("post {} was added twice to tree {}".format(post_id, self.tree_id))
+            return False
+        if parent_id in self.depths:
+            self.__attach(post_id, parent_id, post)
+            return True
+        self.waiting[parent_id].append((post_id, post))
+        return False
+
+    def __attach(self, post_id, parent_id, post):
+        stack = [(post_id, parent_id, post)]
+        while stack:
+            post_id, parent_id, post = stack.pop()
+            if post_id in self.depths:
+                continue
+            depth = self.depths[parent_id] + 1
+            self.posts[post_id] = post
+            self.depths[post_id] = depth
+            if depth > self.max_path_length:
+                self.max_path_length = depth
+            if self.on_attach is not None:
+                self.on_attach(self.posts[parent_id], post)
+            children = self.waiting.pop(post_id, None)
+            if children is not None:
+                # reversed so that siblings are attached in the order they arrived
+                stack.extend((child_id, post_id, child) for child_id, child in reversed(children))
+
+    def flat_size(self):
+        """
+        :return: the number of posts connected to the root, including the root
+        """
+        return len(self.depths)
+
+    def orphan_report(self):
+        orphans = []
+        waiting_ids = set()
+        for children in self.waiting.values():
+            for child_id, child in children:
+                orphans.append(child)
+                waiting_ids.add(child_id)
+        missing_parent_ids = [parent_id for parent_id in self.waiting if parent_id not in waiting_ids]
+        return OrphanReport(self.tree_id, orphans, missing_parent_ids)
+
+
+def attach_tree_node(parent, child):
+    parent.children.append(child)
+
+
+def assemble_recursive_tree(root, nodes):
+    """
+    connects the TreeNodes to the given root using their node_id and parent_id
+    :param root: the TreeNode of the root post
+    :param nodes: iterable of TreeNodes, the order does not matter
+    :return: (root, OrphanReport)
+    """
+    assembler = ReplyTreeAssembler(root.node_id, root, tree_id=getattr(root, "tree_id", root.node_id),
+                                   on_attach=attach_tree_node)
+    for node in nodes:
+        assembler.add(node.node_id, node.parent_id, node)
+    return root, assembler.orphan_report()
@@ -1,18 +1,22 @@
 import logging
-import time
 
 from requests import HTTPError
 
 from api_settings import MAX_CONVERSATION_LENGTH, MIN_CONVERSATION_LENGTH, MAX_CANDIDATES
-from connection_util import DelabTwarc
+from connection_util import get_connector
+from datasource.candidate_ranking import rank_candidates
+from datasource.delab_tree_builder import DelabTreeBuilder
+from datasource.tree_assembly import assemble_recursive_tree
 from delab_trees.recursive_tree.recursive_tree import TreeNode
-from delab_trees.recursive_tree.recursive_tree_util import solve_orphans
 from download_exceptions import ConversationNotInRangeException
 from models.language import LANGUAGE
 from models.platform import PLATFORM
+from util.abusing_lists import batch
 
 logger = logging.getLogger(__name__)
 
+TWEET_LOOKUP_BATCH_SIZE = 100  # max number of ids per tweet lookup request
+
 
 def download_conversations_tw(twarc, query_string, language=LANGUAGE.ENGLISH,
                               platform=PLATFORM.TWITTER,
@@ -27,17 +31,31 @@ def download_conversations_tw(twarc, query_string, language=LANGUAGE.ENGLISH,
      @param max_number_of_candidates: the number of tweets used as candidates for a conversation
      @param min_conversation_length: this restricts conversations with too few posts,
             it should be noted that this is no flow analysis
+     @return: list of DelabTree
      """
+    return list(iter_conversations_tw(twarc, query_string, language, platform, recent, min_conversation_length,
+                                      max_number_of_candidates))
+
+
+def iter_conversations_tw(twarc, query_string, language=LANGUAGE.ENGLISH,
+                          platform=PLATFORM.TWITTER,
+                          recent=True,
+                          min_conversation_length=MIN_CONVERSATION_LENGTH,
+                          max_number_of_candidates=MAX_CANDIDATES):
+    """
+    the generator version of download_conversations_tw
+    @return: generator of DelabTree
+    """
     if twarc is None:
-        twarc = DelabTwarc()
+        twarc = get_connector(PLATFORM.TWITTER)
 
     if query_string is None or query_string.strip() == "":
-        return False
+        return iter([])
 
     # in case max_data is false we don't compute the powerset of the hashtags
-    filter_conversations(twarc, query_string, platform, language=language, recent=recent,
-                         min_conversation_length=min_conversation_length,
-                         max_number_of_candidates=max_number_of_candidates)
+    return iter_filtered_conversations(twarc, query_string, language=language, recent=recent,
+                                       min_conversation_length=min_conversation_length,
+                                       max_number_of_candidates=max_number_of_candidates)
 
 
 def filter_conversations(twarc,
@@ -55,7 +73,22 @@ def filter_conversations(twarc,
     @param language:
     @param max_number_of_candidates:
     @param recent:
-    @return:
+    @return: list of DelabTree
+    """
+    return list(iter_filtered_conversations(twarc, query, max_conversation_length, min_conversation_length,
+                                            language, max_number_of_candidates, recent))
+
+
+def iter_filtered_conversations(twarc,
+                                query,
+                                max_conversation_length=MAX_CONVERSATION_LENGTH,
+                                min_conversation_length=MIN_CONVERSATION_LENGTH,
+                                language=LANGUAGE.ENGLISH,
+                                max_number_of_candidates=MAX_CANDIDATES, recent=True):
+    """
+    the generator version of filter_conversations, a conversation is only downloaded when the caller asks
+    for the next tree
+    @return: generator of DelabTree
     """
 
     # download the tweets that fulfill the query as candidates for whole conversation trees
@@ -65,50 +98,62 @@ def filter_conversations(twarc,
     downloaded_tweets = 0
     n_dismissed_candidates = 0
 
-    result = []
+    # apply the length constraints early, before the root tweets are looked up,
+    # the conversations that are likely larger are downloaded first
+    selected = rank_tweet_candidates(candidates, min_conversation_length, max_conversation_length)
+    n_dismissed_candidates += len(candidates) - len(selected)
+    roots = lookup_root_tweets(twarc, [candidate["conversation_id"] for candidate in selected])
+
+    downloaded_conversations = set()
     # iterate through the candidates
-    for candidate in candidates:
+    for candidate in selected:
         try:
-            reply_count = candidate["public_metrics"]["reply_count"]
-            # apply the length constraints early
-            if (min_conversation_length / 2) < reply_count < max_conversation_length:
-                logger.debug("selected candidate tweet {}".format(candidate))
-                conversation_id = candidate["conversation_id"]
-
-                # download the other tweets from the conversation as a TWConversationTree
-                root_node = download_conversation_as_tree(twarc, conversation_id, max_conversation_length)
-
-                # skip the processing if there was a problem with constructing the conversation tree
-                if root_node is None:
-                    logger.error("found conversation_id that could not be processed")
-                    continue
-                else:
-                    # some communication code in order to see what kinds of trees are being downloaded
-                    flat_tree_size = root_node.flat_size()
-                    logger.debug("found tree with size: {}".format(flat_tree_size))
-                    logger.debug("found tree with depth: {}".format(root_node.compute_max_path_length()))
-                    downloaded_tweets += flat_tree_size
-                    if min_conversation_length < flat_tree_size < max_conversation_length:
-                        result.append(root_node)
-                        logger.debug("found suitable conversation and saved to db {}".format(conversation_id))
-                        # for debugging you can ascii art print the downloaded conversation_tree
-                        # root_node.print_tree(0)
-            else:
+            logger.debug("selected candidate tweet {}".format(candidate))
+            conversation_id = candidate["conversation_id"]
+            # several candidates can belong to the same conversation
+            if conversation_id in downloaded_conversations:
+                n_dismissed_candidates += 1
+                continue
+            downloaded_conversations.add(conversation_id)
+
+            root_data = roots.get(str(conversation_id))
+            if root_data is None:
+                logger.error("could not look up the root of conversation {}".format(conversation_id))
                 n_dismissed_candidates += 1
+                continue
+
+            # download the other tweets from the conversation
+            builder = download_conversation_as_builder(twarc, conversation_id, max_conversation_length,
+                                                       root_data=root_data)
+
+            # skip the processing if there was a problem with constructing the conversation tree
+            if builder is None:
+                logger.error("found conversation_id that could not be processed")
+                continue
+            else:
+                # some communication code in order to see what kinds of trees are being downloaded
+                flat_tree_size = builder.flat_size()
+                logger.debug("found tree with size: {}".format(flat_tree_size))
+                logger.debug("found tree with depth: {}".format(builder.max_path_length()))
+                downloaded_tweets += flat_tree_size
+                if min_conversation_length < flat_tree_size < max_conversation_length:
+                    logger.debug("found suitable conversation {}".format(conversation_id))
+                    yield builder.to_delab_tree()
         except ConversationNotInRangeException as ex:
             n_dismissed_candidates += 1
             logger.debug("conversation was dismissed because it was longer than {}".format(max_conversation_length))
     logger.debug("{} of {} candidates were dismissed".format(n_dismissed_candidates, len(candidates)))
 
 
-def ensuring_tweet_lookup_quota(n_pages, recent, tweet_lookup_request_counter):
-    if tweet_lookup_request_counter - n_pages <= 0:
-        tweet_lookup_request_counter = 250
-        if recent:
-            tweet_lookup_request_counter = 400
-        logger.error("going to sleep between processing candidates because of rate limitations")
-        time.sleep(300 * 60)
-    return tweet_lookup_request_counter
+def rank_tweet_candidates(candidates, min_conversation_length, max_conversation_length):
+    """
+    keeps the candidates with min_conversation_length / 2 < reply_count < max_conversation_length
+    and sorts them by their reply count, the largest first
+    @return: the ranked candidates
+    """
+    # rank_candidates compares the estimated size, reply_count + 1, so the bounds are one larger
+    return rank_candidates(PLATFORM.TWITTER, candidates, min_size=min_conversation_length / 2 + 1,
+                           max_size=max_conversation_length + 1)
 
 
 def download_conversation_representative_tweets(twarc, query, n_candidates,
@@ -165,14 +210,56 @@ def download_conversation_as_tree(twarc, conversation_id, max_replies, root_data
     :return:
     """
     if root_data is None:
-        results = next(twarc.tweet_lookup(tweet_ids=[conversation_id]))
-        if "data" in results:
-            root_data = results["data"][0]
-        else:
+        root_data = lookup_root_tweet(twarc, conversation_id)
+        if root_data is None:
             return None
     return create_tree_from_raw_tweet_stream(conversation_id, max_replies, root_data, twarc)
 
 
+def download_conversation_as_builder(twarc, conversation_id, max_replies, root_data=None):
+    """
+    same as download_conversation_as_tree but collects the tweets into a DelabTreeBuilder,
+    call to_delab_tree() on the result once the size and depth checks are passed
+    :param twarc:
+    :param conversation_id:
+    :param max_replies:
+    :param root_data:
+    :return: DelabTreeBuilder or None
+    """
+    if root_data is None:
+        root_data = lookup_root_tweet(twarc, conversation_id)
+        if root_data is None:
+            return None
+    return create_builder_from_raw_tweet_stream(conversation_id, max_replies, root_data, twarc)
+
+
+def lookup_root_tweet(twarc, conversation_id):
+    results = next(twarc.tweet_lookup(tweet_ids=[conversation_id]))
+    if "data" in results:
+        return results["data"][0]
+    return None
+
+
+def lookup_root_tweets(twarc, conversation_ids):
+    """
+    looks up the root tweets of many conversations with one request per 100 ids
+    instead of one request per conversation
+    :param twarc:
+    :param conversation_ids:
+    :return: dict of conversation_id -> root tweet, deleted or protected roots are missing
+    """
+    unique_ids = list(dict.fromkeys(str(conversation_id) for conversation_id in conversation_ids))
+    roots = {}
+    n_requests = 0
+    for id_batch in batch(unique_ids, TWEET_LOOKUP_BATCH_SIZE):
+        for results in twarc.tweet_lookup(tweet_ids=id_batch):
+            n_requests += 1
+            for tweet in results.get("data", []):
+                roots[tweet["id"]] = tweet
+    logger.debug("looked up {} of {} root tweets with {} requests".format(len(roots), len(unique_ids), n_requests))
+    return roots
+
+
 def create_tree_from_raw_tweet_stream(conversation_id, max_replies, root_data, twarc):
     """
     this uses the conversation_id to download the whole conversation from twitter as far as available
@@ -184,46 +271,87 @@ def create_tree_from_raw_tweet_stream(conversation_id, max_replies, root_data, t
     """
     tweets = []
     for result in twarc.search_all("conversation_id:{}".format(conversation_id)):
-        tweets = tweets + result.get("data", [])
-        check_conversation_max_size(max_replies, tweets)
+        tweets.extend(result.get("data", []))
+        check_conversation_max_size(max_replies, len(tweets))
     root, orphans = create_conversation_tree_from_tweet_data(conversation_id, root_data, tweets)
     return root
 
 
+def create_builder_from_raw_tweet_stream(conversation_id, max_replies, root_data, twarc):
+    """
+    @see create_tree_from_raw_tweet_stream
+    the pages are added to the builder as they arrive and no more pages are requested
+    as soon as the conversation is too long
+    :return: DelabTreeBuilder
+    """
+    builder = DelabTreeBuilder(conversation_id, int(root_data["id"]), root_data)
+    n_tweets = 0
+    for result in twarc.search_all("conversation_id:{}".format(conversation_id)):
+        page = result.get("data", [])
+        n_tweets += len(page)
+        check_conversation_max_size(max_replies, n_tweets)
+        add_tweets_to_builder(builder, page)
+    log_orphans(builder, conversation_id, n_tweets)
+    return builder
+
+
 def create_conversation_tree_from_tweet_data(conversation_id, root_tweet, tweets):
     """
     this function constructs a TwConversationTree structure out of the unsorted list of tweets
     @param conversation_id:
     @param root_tweet:
     @param tweets:
-    @return: (TwConversationTree, [orphan_data])
+    @return: (TwConversationTree, OrphanReport)
     """
-    # sort tweets by creation date in order to speed up the tree construction
+    # sort tweets by creation date so that siblings keep their chronological order
     tweets.sort(key=lambda x: x["created_at"], reverse=False)
-    root = TreeNode(root_tweet, root_tweet["id"])
-    orphans = []
+    # the references use int ids, so the root is indexed by its int id as well
+    root = TreeNode(root_tweet, int(root_tweet["id"]))
+    nodes = []
     for item in tweets:
         # node_id = item["author_id"]
         # parent_id = item["in_reply_to_user_id"]
         node_id = int(item["id"])
         parent_id, parent_type = get_priority_parent_from_references(item["referenced_tweets"])
         # parent_id = item["referenced_tweets.id"]
-        node = TreeNode(item, node_id, parent_id, parent_type=parent_type)
-        # IF NODE CANNOT BE PLACED IN TREE, ORPHAN IT UNTIL ITS PARENT IS FOUND
-        if not root.find_parent_of(node):
-            orphans.append(node)
-    logger.info('{} orphaned tweets for conversation {} before resolution'.format(len(orphans), conversation_id))
-    orphan_added = True
-    while orphan_added:
-        orphan_added, orphans = solve_orphans(orphans, root)
+        nodes.append(TreeNode(item, node_id, parent_id, parent_type=parent_type))
+    root, orphans = assemble_recursive_tree(root, nodes)
     if len(orphans) > 0:
         logger.error('{} orphaned tweets for conversation {}'.format(len(orphans), conversation_id))
         logger.error('{} downloaded tweets'.format(len(tweets)))
     return root, orphans
 
 
-def check_conversation_max_size(max_replies, tweets):
-    conversation_size = len(tweets)
+def create_builder_from_tweet_data(conversation_id, root_tweet, tweets):
+    """
+    collects the unsorted list of tweets column-wise for the DelabTree table
+    @param conversation_id:
+    @param root_tweet:
+    @param tweets:
+    @return: DelabTreeBuilder
+    """
+    tweets.sort(key=lambda x: x["created_at"], reverse=False)
+    builder = DelabTreeBuilder(conversation_id, int(root_tweet["id"]), root_tweet)
+    add_tweets_to_builder(builder, tweets)
+    log_orphans(builder, conversation_id, len(tweets))
+    return builder
+
+
+def add_tweets_to_builder(builder, tweets):
+    # pages arrive newest first, replies to tweets of later pages wait in the builder until their parent shows up
+    for item in tweets:
+        parent_id, parent_type = get_priority_parent_from_references(item["referenced_tweets"])
+        builder.add_post(int(item["id"]), parent_id, item)
+
+
+def log_orphans(builder, conversation_id, n_tweets):
+    orphans = builder.orphan_report()
+    if len(orphans) > 0:
+        logger.error('{} orphaned tweets for conversation {}'.format(len(orphans), conversation_id))
+        logger.error('{} downloaded tweets'.format(n_tweets))
+
+
+def check_conversation_max_size(max_replies, conversation_size):
     if conversation_size >= max_replies > 0:
         raise ConversationNotInRangeException(conversation_size)
 
@@ -250,6 +378,6 @@ def get_priority_parent_from_references(references):
 
 
 class TWEET_RELATIONSHIPS:
-    REPLIED_TO = "replied_to",
-    QUOTED = "quoted",
+    REPLIED_TO = "replied_to"
+    QUOTED = "quoted"
     RETWEETED = "retweeted"
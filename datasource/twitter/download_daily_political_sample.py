@@ -2,22 +2,25 @@ import logging
 from datetime import datetime, timedelta
 from random import choice
 
-from connection_util import DelabTwarc
+from connection_util import get_connector
+from datasource.candidate_ranking import rank_candidates
 from datasource.twitter.download_conversations_twitter import download_conversation_representative_tweets, \
-    download_conversation_as_tree
+    download_conversation_as_builder, lookup_root_tweets
 from delab_trees.delab_tree import DelabTree
 from download_exceptions import ConversationNotInRangeException
 from models.language import LANGUAGE
+from models.platform import PLATFORM
 from sample_political_keywords import topics, search_phrases
 
 logger = logging.getLogger(__name__)
 
 
-def download_daily_political_sample(language, connector) -> list[DelabTree]:
+def download_daily_political_sample(language, connector, cancel_event=None) -> list[DelabTree]:
     """
     TODO implement Twitter sampler
     :param language:
     :param connector:
+    :param cancel_event: threading.Event, the download stops before the next conversation once it is set
     :return:
     """
     if language != LANGUAGE.ENGLISH:
@@ -27,9 +30,7 @@ def download_daily_political_sample(language, connector) -> list[DelabTree]:
     random_phrase = choice(phrases)
     # query = construct_daily_query(random_phrase)
     query = random_phrase
-    downloaded_trees = download_twitter_sample(query=query, connector=connector)
-    result = list(map(lambda x: DelabTree.from_recursive_tree(x), downloaded_trees))
-    return result
+    return download_twitter_sample(query=query, twarc=connector, cancel_event=cancel_event)
 
 
 def construct_daily_query(search_query):
@@ -46,46 +47,54 @@ def construct_daily_query(search_query):
     return search_query_with_dates
 
 
-def download_twitter_sample(query, twarc):
+def download_twitter_sample(query, twarc, cancel_event=None):
     if twarc is None:
-        twarc = DelabTwarc()
+        twarc = get_connector(PLATFORM.TWITTER)
     # download the tweets that fulfill the query as candidates for whole conversation trees
     candidates, n_pages = download_conversation_representative_tweets(twarc, query, n_candidates=100)
     downloaded_tweets = 0
     n_dismissed_candidates = 0
 
+    # apply the length constraints early, the conversations that are likely larger are downloaded first
+    selected = rank_candidates(PLATFORM.TWITTER, candidates, min_size=6, max_size=100)
+    n_dismissed_candidates += len(candidates) - len(selected)
+    # the roots of all promising candidates are looked up in batches of 100 ids
+    roots = lookup_root_tweets(twarc, [candidate["conversation_id"] for candidate in selected])
+
     downloaded_trees = []
     # iterate through the candidates
-    for candidate in candidates:
+    for candidate in selected:
         if len(downloaded_trees) > 5:
             break
+        if cancel_event is not None and cancel_event.is_set():
+            break
         try:
-            reply_count = candidate["public_metrics"]["reply_count"]
-            # apply the length constraints early
-            if reply_count > 5:
-                conversation_id = candidate["conversation_id"]
-
-                # download the other tweets from the conversation as a TWConversationTree
-                root_node = download_conversation_as_tree(twarc, conversation_id, max_replies=100)
-
-                # skip the processing if there was a problem with constructing the conversation tree
-                if root_node is None:
-                    logger.error("found conversation_id that could not be processed")
-                    continue
-                else:
-                    # some communication code in order to see what kinds of trees are being downloaded
-                    flat_tree_size = root_node.flat_size()
-                    logger.debug("found tree with size: {}".format(flat_tree_size))
-                    depth = root_node.compute_max_path_length()
-                    logger.debug("found tree with depth: {}".format(depth))
-                    # maybe add this check to a later point but this is easy for now
-                    if depth > 5:
-                        downloaded_tweets += flat_tree_size
-                        downloaded_trees.append(root_node)
-                    else:
-                        n_dismissed_candidates += 1
-            else:
+            conversation_id = candidate["conversation_id"]
+
+            # download the other tweets from the conversation
+            root_data = roots.get(str(conversation_id))
+            if root_data is None:
                 n_dismissed_candidates += 1
+                continue
+            builder = download_conversation_as_builder(twarc, conversation_id, max_replies=100,
+                                                       root_data=root_data)
+
+            # skip the processing if there was a problem with constructing the conversation tree
+            if builder is None:
+                logger.error("found conversation_id that could not be processed")
+                continue
+            else:
+                # some communication code in order to see what kinds of trees are being downloaded
+                flat_tree_size = builder.flat_size()
+                logger.debug("found tree with size: {}".format(flat_tree_size))
+                depth = builder.max_path_length()
+                logger.debug("found tree with depth: {}".format(depth))
+                # maybe add this check to a later point but this is easy for now
+                if depth > 5:
+                    downloaded_tweets += flat_tree_size
+                    downloaded_trees.append(builder.to_delab_tree())
+                else:
+                    n_dismissed_candidates += 1
         except ConversationNotInRangeException as ex:
             n_dismissed_candidates += 1
 
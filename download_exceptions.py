@@ -37,4 +37,36 @@ class NoDailyMTHashtagsAvailableException(Exception):
     def __init__(self, language, message="There are no more daily mastodon hashtags available"):
         self.language = language
         self.message = message
-        super().__init__(self.message)
\ No newline at end of file
+        super().__init__(self.message)
+
+
+class CacheMissException(Exception):
+    """Exception raised if a response is not in the cache while replaying offline.
+
+    Attributes:
+        platform -- the platform of the request
+        endpoint -- the endpoint or path of the request
+        object_id -- the arguments of the request
+        message -- explanation of the error
+    """
+
+    def __init__(self, platform, endpoint, object_id, message="The response was not recorded in the cache"):
+        self.platform = platform
+        self.endpoint = endpoint
+        self.object_id = object_id
+        self.message = message
+        super().__init__("{}: {} {} {}".format(message, platform, endpoint, object_id))
+
+
+class ConversationNotFoundException(Exception):
+    """Exception raised if the url of a conversation does not lead to a conversation.
+
+    Attributes:
+        url -- the url of the conversation
+        message -- explanation of the error
+    """
+
+    def __init__(self, url, message="No conversation found for the url"):
+        self.url = url
+        self.message = message
+        super().__init__("{}: {}".format(message, url))
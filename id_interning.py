@@ -0,0 +1,120 @@
+import logging
+import sqlite3
+import threading
+
+from api_settings import ID_INTERNER_PATH
+
+logger = logging.getLogger(__name__)
+
+SQLITE_MAX_VARIABLES = 500  # keys per query, below the limit of older sqlite versions
+
+
+class ID_NAMESPACE:
+    REDDIT_POST = "reddit_post"  # fullnames of submissions and comments (t3_..., t1_...)
+    REDDIT_AUTHOR = "reddit_author"  # user names
+
+
+class IdInterner:
+    """
+    Maps platform ids and author names to dense int64 ids (1, 2, 3, ...) per namespace, without collisions.
+    The ids are memoized in the process and stored in SQLite, so that they stay the same across runs;
+    the file can be shared by several processes.
+    Without a path (e.g. in tests), the ids are only kept in the process and depend on the order
+    in which the keys are seen.
+    """
+
+    def __init__(self, path=ID_INTERNER_PATH):
+        self.path = path
+        self.ids = {}
+        self.lock = threading.Lock()
+        self.connection = None
+        if path is not None:
+            self.connection = sqlite3.connect(path, check_same_thread=False, timeout=60, isolation_level=None)
+            self.connection.execute("CREATE TABLE IF NOT EXISTS interned_ids ("
+                                    "namespace TEXT, key TEXT, id INTEGER, PRIMARY KEY (namespace, key))")
+
+    def __str__(self):
+        return "IdInterner {} with {} ids".format(self.path, sum(len(ids) for ids in self.ids.values()))
+
+    def intern(self, namespace, key):
+        """
+        :param namespace: see ID_NAMESPACE
+        :param key: the platform id or name
+        :return: the int id of the key
+        """
+        ids = self.ids.get(namespace)
+        if ids is not None and key in ids:
+            return ids[key]
+        return self.intern_many(namespace, [key])[0]
+
+    def intern_many(self, namespace, keys):
+        """
+        interns a batch of keys, the keys not seen before are assigned in one transaction
+        :param namespace:
+        :param keys:
+        :return: list of int ids in the order of the keys
+        """
+        with self.lock:
+            ids = self.ids.setdefault(namespace, {})
+            new_keys = list(dict.fromkeys(key for key in keys if key not in ids))
+            if len(new_keys) > 0:
+                if self.connection is None:
+                    for key in new_keys:
+                        ids[key] = len(ids) + 1
+                else:
+                    ids.update(self.__store(namespace, new_keys))
+            return [ids[key] for key in keys]
+
+    def __store(self, namespace, keys):
+        # the write lock is taken at once, so that two processes cannot assign the same id
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            stored = {}
+            for start in range(0, len(keys), SQLITE_MAX_VARIABLES):
+                chunk = keys[start:start + SQLITE_MAX_VARIABLES]
+                rows = self.connection.execute("SELECT key, id FROM interned_ids WHERE namespace = ? AND key IN ({})"
+                                               .format(",".join("?" * len(chunk))), [namespace] + chunk)
+                stored.update(rows)
+            next_id = self.connection.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM interned_ids WHERE namespace = ?",
+                                              (namespace,)).fetchone()[0]
+            new_rows = []
+            for key in keys:
+                if key not in stored:
+                    stored[key] = next_id
+                    new_rows.append((namespace, key, next_id))
+                    next_id += 1
+            self.connection.executemany("INSERT INTO interned_ids VALUES (?, ?, ?)", new_rows)
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        return stored
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+
+_id_interner = None
+_id_interner_lock = threading.Lock()
+
+
+def get_id_interner():
+    """
+    :return: the IdInterner at ID_INTERNER_PATH the reddit downloads use
+    """
+    global _id_interner
+    with _id_interner_lock:
+        if _id_interner is None:
+            _id_interner = IdInterner()
+        return _id_interner
+
+
+def set_id_interner(id_interner):
+    """
+    replaces the IdInterner the reddit downloads use, e.g. by one without a file
+    :param id_interner: IdInterner
+    """
+    global _id_interner
+    with _id_interner_lock:
+        _id_interner = id_interner
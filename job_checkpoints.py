@@ -0,0 +1,109 @@
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+
+from api_settings import JOB_CHECKPOINT_PATH
+
+logger = logging.getLogger(__name__)
+
+
+class JobCheckpoint:
+    """
+    Progress of a long running job (a list of urls, the submissions of a user, a daily sample) in SQLite.
+    Every unit of work is committed with its result as soon as it is finished, so that a restarted job
+    skips the finished units. A crash only loses the units in flight (one per worker).
+    The file can be shared by several jobs and processes, the units are kept per job name.
+    """
+
+    def __init__(self, job, path=JOB_CHECKPOINT_PATH):
+        """
+        :param job: name of the job, e.g. "user_conversations/reddit/some_user"
+        :param path: the sqlite file
+        """
+        self.job = job
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS finished_units ("
+                                    "job TEXT, unit TEXT, result BLOB, finished_at REAL, "
+                                    "PRIMARY KEY (job, unit))")
+
+    def __str__(self):
+        return "JobCheckpoint {} with {} finished units".format(self.job, self.n_done())
+
+    def __len__(self):
+        return self.n_done()
+
+    def is_done(self, unit):
+        with self.lock:
+            row = self.connection.execute("SELECT 1 FROM finished_units WHERE job = ? AND unit = ?",
+                                          (self.job, str(unit))).fetchone()
+        return row is not None
+
+    def n_done(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM finished_units WHERE job = ?",
+                                           (self.job,)).fetchone()[0]
+
+    def complete(self, unit, result=None):
+        """
+        :param unit: the key of the unit, e.g. an url or a submission id
+        :param result: picklable result of the unit, e.g. a DelabTree or None
+        """
+        blob = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO finished_units VALUES (?, ?, ?, ?)",
+                                    (self.job, str(unit), blob, time.time()))
+
+    def result(self, unit, default=None):
+        with self.lock:
+            row = self.connection.execute("SELECT result FROM finished_units WHERE job = ? AND unit = ?",
+                                          (self.job, str(unit))).fetchone()
+        return default if row is None else pickle.loads(row[0])
+
+    def results(self):
+        """
+        :return: list of (unit, result) in the order the units were finished
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT unit, result FROM finished_units WHERE job = ? "
+                                           "ORDER BY finished_at, rowid", (self.job,)).fetchall()
+        return [(unit, pickle.loads(blob)) for unit, blob in rows]
+
+    def clear(self):
+        """
+        forgets the progress of the job, e.g. to download it again
+        """
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM finished_units WHERE job = ?", (self.job,))
+
+    def close(self):
+        self.connection.close()
+
+
+def run_units(units, function, checkpoint=None, key=str, retry_errors=()):
+    """
+    runs the function on every unit that is not finished yet and records its result
+    :param units: iterable of units
+    :param function: called with a unit, returns a picklable result
+    :param checkpoint: JobCheckpoint, None runs all units without recording them
+    :param key: the key of a unit in the checkpoint
+    :param retry_errors: the exception types of units that may succeed in another run (e.g. network errors),
+           such a unit is logged and left out without being recorded
+    :return: generator of (unit, result) in the order of the units, stored results for finished units
+    """
+    for unit in units:
+        if checkpoint is not None and checkpoint.is_done(key(unit)):
+            yield unit, checkpoint.result(key(unit))
+            continue
+        try:
+            result = function(unit)
+        except retry_errors as ex:
+            logger.debug("unit {} failed and is left for the next run: {}".format(key(unit), ex))
+            continue
+        if checkpoint is not None:
+            checkpoint.complete(key(unit), result)
+        yield unit, result
@@ -0,0 +1,264 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from urllib.parse import urlparse
+
+import requests
+
+from api_settings import REDDIT_REQUESTS_PER_MINUTE
+from models.platform import PLATFORM
+
+logger = logging.getLogger(__name__)
+
+# the names of the quota headers, reset is an epoch (twitter), a number of seconds (reddit) or a timestamp (mastodon)
+RATE_LIMIT_HEADERS = {
+    PLATFORM.TWITTER: ("x-rate-limit-remaining", "x-rate-limit-reset"),
+    PLATFORM.REDDIT: ("x-ratelimit-remaining", "x-ratelimit-reset"),
+    PLATFORM.MASTODON: ("x-ratelimit-remaining", "x-ratelimit-reset"),
+}
+
+
+class RateLimit:
+    def __init__(self, remaining, reset_at):
+        self.remaining = remaining
+        self.reset_at = reset_at
+
+    def __str__(self):
+        return "{} requests remaining until {}".format(self.remaining, datetime.fromtimestamp(self.reset_at))
+
+
+class TokenBucket:
+    """
+    Paces the requests of a platform: each request takes one token, the tokens are refilled evenly
+    over the period, so that threads sending at the same time do not spend the quota in one burst.
+    """
+
+    def __init__(self, requests_per_period, period_seconds=60):
+        self.capacity = requests_per_period
+        self.tokens = float(requests_per_period)
+        self.refill_rate = requests_per_period / period_seconds
+        self.updated_at = time.monotonic()
+
+    def __str__(self):
+        return "TokenBucket of {} requests per minute".format(self.refill_rate * 60)
+
+    def take(self):
+        """
+        takes a token if there is one, not thread-safe (the scheduler holds its lock)
+        :return: 0 if the token was taken, the seconds until the next token otherwise
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.refill_rate
+
+
+class RequestCounter:
+    """
+    counts the requests sent in one context, e.g. while a single subreddit is sampled
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def __getitem__(self, platform):
+        return self.counts[platform]
+
+    def add(self, platform):
+        with self.lock:
+            self.counts[platform] += 1
+
+
+# the counter of the current context, worker threads only count if they run in a copy of the context
+REQUEST_COUNTER = ContextVar("request_counter", default=None)
+
+
+@contextmanager
+def counting_requests():
+    """
+    counts the requests the scheduler lets through in this context (asyncio.to_thread copies the context,
+    a ThreadPoolExecutor needs contextvars.copy_context().run)
+    :return: the RequestCounter
+    """
+    counter = RequestCounter()
+    token = REQUEST_COUNTER.set(counter)
+    try:
+        yield counter
+    finally:
+        REQUEST_COUNTER.reset(token)
+
+
+class RateLimitScheduler:
+    """
+    Tracks the remaining quota and the reset time of every endpoint from the response headers.
+    A request to an endpoint without quota waits until the exact reset moment, only the thread
+    sending it is delayed. One scheduler can be shared by the connectors of all platforms.
+    The requests of a platform with a TokenBucket are paced as well (reddit, whose threads would spend
+    the quota of the account in bursts otherwise).
+    """
+
+    def __init__(self, requests_per_minute=None):
+        """
+        :param requests_per_minute: dict of platform to the requests per minute its TokenBucket lets through
+        """
+        self.limits = {}
+        self.buckets = {platform: TokenBucket(n_requests)
+                        for platform, n_requests in (requests_per_minute or {}).items()}
+        self.request_counts = Counter()
+        self.waited_seconds = Counter()
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return "RateLimitScheduler with requests {} and waits {}".format(dict(self.request_counts),
+                                                                       dict(self.waited_seconds))
+
+    def before_request(self, platform, endpoint):
+        """
+        blocks until the endpoint has quota left and the token bucket of the platform a token,
+        then reserves one request
+        :param platform:
+        :param endpoint: see endpoint_of
+        """
+        while True:
+            with self.lock:
+                limit = self.limits.get((platform, endpoint))
+                now = time.time()
+                if limit is None or limit.reset_at <= now or limit.remaining > 0:
+                    bucket = self.buckets.get(platform)
+                    wait = 0 if bucket is None else bucket.take()
+                    if wait <= 0:
+                        if limit is not None and limit.reset_at > now:
+                            limit.remaining -= 1
+                        self.request_counts[platform] += 1
+                        counter = REQUEST_COUNTER.get()
+                        if counter is not None:
+                            counter.add(platform)
+                        return
+                    wait_until = now + wait
+                else:
+                    wait_until = limit.reset_at
+                    logger.debug("quota of {} {} is spent, waiting for {:.0f} seconds".format(platform, endpoint,
+                                                                                           wait_until - now))
+            self.__wait_until(platform, wait_until)
+
+    def after_response(self, platform, endpoint, response):
+        """
+        updates the quota of the endpoint from the headers of the response
+        :param platform:
+        :param endpoint:
+        :param response: requests.Response
+        """
+        remaining, reset_at = parse_rate_limit_headers(platform, response.headers)
+        if response.status_code == 429:
+            remaining = 0
+            if reset_at is None and "retry-after" in response.headers:
+                reset_at = time.time() + float(response.headers["retry-after"])
+        if remaining is None or reset_at is None:
+            return
+        with self.lock:
+            self.limits[(platform, endpoint)] = RateLimit(remaining, reset_at)
+
+    def pause(self, platform, endpoint, seconds):
+        """
+        treats the quota of the endpoint as spent for the next seconds, e.g. after a 429 without rate limit headers
+        :param platform:
+        :param endpoint: see endpoint_of
+        :param seconds:
+        """
+        reset_at = time.time() + seconds
+        with self.lock:
+            limit = self.limits.get((platform, endpoint))
+            if limit is None or limit.reset_at < reset_at:
+                self.limits[(platform, endpoint)] = RateLimit(0, reset_at)
+
+    def seconds_until_reset(self, platform, endpoint=None):
+        """
+        :param platform:
+        :param endpoint: None for the longest wait of all endpoints of the platform
+        :return: the seconds until the spent quota is reset or None if the quota is not spent
+        """
+        now = time.time()
+        with self.lock:
+            waits = [limit.reset_at - now for (limit_platform, limit_endpoint), limit in self.limits.items()
+                     if limit_platform == platform and (endpoint is None or limit_endpoint == endpoint)
+                     and limit.remaining <= 0 and limit.reset_at > now]
+        if len(waits) == 0:
+            return None
+        return max(waits)
+
+    def __wait_until(self, platform, reset_at):
+        start = time.time()
+        # sleep can return early, so check the clock again
+        while time.time() < reset_at:
+            time.sleep(reset_at - time.time())
+        with self.lock:
+            self.waited_seconds[platform] += time.time() - start
+
+
+def endpoint_of(platform, url):
+    """
+    :param platform:
+    :param url: the request url
+    :return: the key the platform uses for its quota: the path for twitter, the instance for mastodon
+            and the account for reddit
+    """
+    if platform == PLATFORM.REDDIT:
+        return "*"
+    parsed = urlparse(url)
+    if platform == PLATFORM.MASTODON:
+        return parsed.netloc
+    # ids in the path (not the api version) are replaced, the quota is per endpoint
+    return re.sub(r"/\d{5,}", "/:id", parsed.path)
+
+
+def parse_rate_limit_headers(platform, headers):
+    """
+    :param platform:
+    :param headers: the (case-insensitive) response headers
+    :return: (remaining, reset_at as epoch), None for headers that are missing
+    """
+    remaining_header, reset_header = RATE_LIMIT_HEADERS[platform]
+    remaining = headers.get(remaining_header)
+    reset = headers.get(reset_header)
+    if remaining is None or reset is None:
+        return None, None
+    remaining = int(float(remaining))
+    if platform == PLATFORM.TWITTER:
+        reset_at = float(reset)
+    elif platform == PLATFORM.REDDIT:
+        reset_at = time.time() + float(reset)
+    else:
+        reset_at = datetime.fromisoformat(reset.replace("Z", "+00:00")).timestamp()
+    return remaining, reset_at
+
+
+class RateLimitedSession(requests.Session):
+    """
+    requests session that sends every request through the scheduler,
+    praw and mastodon accept it as their http session
+    """
+
+    def __init__(self, platform, scheduler):
+        super().__init__()
+        self.platform = platform
+        self.scheduler = scheduler
+
+    def request(self, method, url, *args, **kwargs):
+        endpoint = endpoint_of(self.platform, url)
+        self.scheduler.before_request(self.platform, endpoint)
+        response = super().request(method, url, *args, **kwargs)
+        self.scheduler.after_response(self.platform, endpoint, response)
+        return response
+
+
+# the scheduler shared by the connectors created in connection_util
+RATE_LIMITS = RateLimitScheduler(requests_per_minute={PLATFORM.REDDIT: REDDIT_REQUESTS_PER_MINUTE})
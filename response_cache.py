@@ -0,0 +1,270 @@
+import json
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from praw.const import API_PATH
+
+from api_settings import RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_ENDPOINT_TTL_SECONDS
+from download_exceptions import CacheMissException
+from models.platform import PLATFORM
+
+logger = logging.getLogger(__name__)
+
+
+class CACHE_MODE:
+    RECORD = "record"  # answer from the cache if possible, download and store otherwise
+    REPLAY = "replay"  # offline, answer from the cache only and raise CacheMissException otherwise
+
+
+# the connector methods that return api responses (reddit caches every GET request instead)
+CACHED_ENDPOINTS = {
+    PLATFORM.MASTODON: ["status", "status_context", "timeline_hashtag", "account_search", "account_statuses",
+                        "search_v2"],
+    PLATFORM.TWITTER: ["tweet_lookup", "search_all", "search_recent"],
+}
+
+# twarc returns generators of result pages
+PAGINATED_ENDPOINTS = {"tweet_lookup", "search_all", "search_recent"}
+
+# the last part of the reddit paths that return listings, e.g. r/{subreddit}/new or user/{user}/submitted
+REDDIT_LISTINGS = {"hot", "new", "top", "rising", "controversial", "search", "submitted", "comments", "overview"}
+
+
+class ResponseCache:
+    """
+    On-disk cache of raw platform API responses in SQLite, keyed by platform, endpoint and object id.
+    Entries older than the ttl of their endpoint are downloaded again in record mode (replay mode answers with them),
+    the least recently used entries are evicted if the cache grows beyond max_bytes.
+    The file can be shared by several processes.
+    """
+
+    def __init__(self, path="delab_response_cache.sqlite", ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+                 max_bytes=RESPONSE_CACHE_MAX_BYTES, endpoint_ttls=None):
+        """
+        :param ttl_seconds: the ttl of the endpoints without their own
+        :param endpoint_ttls: dict of endpoint to ttl, RESPONSE_CACHE_ENDPOINT_TTL_SECONDS if None
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.endpoint_ttls = RESPONSE_CACHE_ENDPOINT_TTL_SECONDS if endpoint_ttls is None else endpoint_ttls
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS responses ("
+                                    "platform TEXT, endpoint TEXT, object_id TEXT, response BLOB, "
+                                    "created_at REAL, accessed_at REAL, size INTEGER, "
+                                    "PRIMARY KEY (platform, endpoint, object_id))")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+
+    def __str__(self):
+        return "ResponseCache {} with {} hits and {} misses".format(self.path, self.hits, self.misses)
+
+    def get(self, platform, endpoint, object_id, ignore_ttl=False):
+        """
+        :param platform:
+        :param endpoint:
+        :param object_id:
+        :param ignore_ttl: also return expired entries (used for offline replay)
+        :return: (True, response) for a hit, (False, None) otherwise
+        """
+        now = time.time()
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT response, created_at FROM responses "
+                                          "WHERE platform = ? AND endpoint = ? AND object_id = ?",
+                                          (platform, endpoint, object_id)).fetchone()
+            if row is None or (not ignore_ttl and now - row[1] >= self.ttl(platform, endpoint)):
+                self.misses += 1
+                return False, None
+            self.connection.execute("UPDATE responses SET accessed_at = ? "
+                                    "WHERE platform = ? AND endpoint = ? AND object_id = ?",
+                                    (now, platform, endpoint, object_id))
+        self.hits += 1
+        return True, pickle.loads(row[0])
+
+    def ttl(self, platform, endpoint):
+        """
+        :return: the seconds a response of the endpoint is answered from the cache in record mode
+        """
+        if platform == PLATFORM.REDDIT:
+            endpoint = reddit_endpoint(endpoint)
+        return self.endpoint_ttls.get(endpoint, self.ttl_seconds)
+
+    def put(self, platform, endpoint, object_id, response):
+        blob = pickle.dumps(response, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    (platform, endpoint, object_id, blob, now, now, len(blob)))
+            self.__evict()
+
+    def __evict(self):
+        total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+        # remove the least recently used entries until the cache is 10 % below its limit
+        to_free = total_size - 0.9 * self.max_bytes
+        freed = 0
+        evicted = []
+        for platform, endpoint, object_id, size in self.connection.execute(
+                "SELECT platform, endpoint, object_id, size FROM responses ORDER BY accessed_at"):
+            evicted.append((platform, endpoint, object_id))
+            freed += size
+            if freed >= to_free:
+                break
+        self.connection.executemany("DELETE FROM responses WHERE platform = ? AND endpoint = ? AND object_id = ?",
+                                    evicted)
+        logger.debug("evicted {} responses ({} bytes) from {}".format(len(evicted), freed, self.path))
+
+    def size(self):
+        with self.lock:
+            return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def clear(self, platform=None):
+        with self.lock, self.connection:
+            if platform is None:
+                self.connection.execute("DELETE FROM responses")
+            else:
+                self.connection.execute("DELETE FROM responses WHERE platform = ?", (platform,))
+
+    def close(self):
+        self.connection.close()
+
+    def fetch(self, platform, endpoint, object_id, download, mode=CACHE_MODE.RECORD):
+        """
+        answers a request from the cache or downloads and stores it
+        :param platform:
+        :param endpoint:
+        :param object_id:
+        :param download: function without arguments that sends the request
+        :param mode: CACHE_MODE
+        :return: the response
+        """
+        hit, response = self.get(platform, endpoint, object_id, ignore_ttl=mode == CACHE_MODE.REPLAY)
+        if hit:
+            return response
+        if mode == CACHE_MODE.REPLAY:
+            raise CacheMissException(platform, endpoint, object_id)
+        response = download()
+        self.put(platform, endpoint, object_id, response)
+        return response
+
+    def fetch_pages(self, platform, endpoint, object_id, download, mode=CACHE_MODE.RECORD):
+        """
+        like fetch for paginated endpoints, the pages are stored when the consumer stops reading,
+        a partial result is only replayed as far as it was read during the recording
+        :param download: function without arguments that returns an iterator of pages
+        :return: generator of pages
+        """
+        hit, entry = self.get(platform, endpoint, object_id, ignore_ttl=mode == CACHE_MODE.REPLAY)
+        if hit and (entry["complete"] or mode == CACHE_MODE.REPLAY):
+            yield from entry["pages"]
+            if not entry["complete"]:
+                raise CacheMissException(platform, endpoint, object_id)
+            return
+        if mode == CACHE_MODE.REPLAY:
+            raise CacheMissException(platform, endpoint, object_id)
+        pages = []
+        complete = False
+        try:
+            for page in download():
+                pages.append(page)
+                yield page
+            complete = True
+        finally:
+            self.put(platform, endpoint, object_id, {"pages": pages, "complete": complete})
+
+
+def reddit_endpoint(path):
+    """
+    :param path: the path of a reddit api request
+    :return: the endpoint its ttl is looked up with, "listing", "comments", "morechildren" or the path
+    """
+    if path == API_PATH["morechildren"]:
+        return "morechildren"
+    parts = path.strip("/").split("/")
+    if parts[0] == "comments":
+        return "comments"
+    if parts[0] in ("r", "user", "search") and parts[-1] in REDDIT_LISTINGS:
+        return "listing"
+    return path
+
+
+def to_object_id(*args, **kwargs):
+    return json.dumps([args, kwargs], sort_keys=True, default=str)
+
+
+def install_response_cache(connector, platform, cache, mode=CACHE_MODE.RECORD):
+    """
+    routes the api calls of a praw, mastodon or twarc connector through the cache.
+    The wrappers are set on the connector instance, so the connector can be used as before.
+    :param connector: the connector created in connection_util
+    :param platform: PLATFORM
+    :param cache: ResponseCache
+    :param mode: CACHE_MODE
+    :return: the connector
+    """
+    # kept for the copies of the connector, see connection_util.ConnectorPool
+    connector.response_cache = cache
+    connector.response_cache_mode = mode
+    if platform == PLATFORM.REDDIT:
+        connector.request = cached_reddit_request(connector.request, cache, mode)
+        return connector
+    for endpoint in CACHED_ENDPOINTS[platform]:
+        method = getattr(connector, endpoint, None)
+        if method is None:
+            continue
+        if endpoint in PAGINATED_ENDPOINTS:
+            wrapper = cached_paginated_method(method, platform, endpoint, cache, mode)
+        else:
+            wrapper = cached_method(method, platform, endpoint, cache, mode)
+        setattr(connector, endpoint, wrapper)
+    return connector
+
+
+def cached_method(method, platform, endpoint, cache, mode):
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        return cache.fetch(platform, endpoint, to_object_id(*args, **kwargs),
+                           lambda: method(*args, **kwargs), mode)
+
+    return wrapper
+
+
+def cached_paginated_method(method, platform, endpoint, cache, mode):
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        return cache.fetch_pages(platform, endpoint, to_object_id(*args, **kwargs),
+                                 lambda: method(*args, **kwargs), mode)
+
+    return wrapper
+
+
+def cached_reddit_request(request, cache, mode):
+    """
+    praw sends every api call through Reddit.request and builds its lazy objects from the returned json,
+    caching the GET requests there covers submissions, listings and the expansion of MoreComments
+    """
+
+    @wraps(request)
+    def wrapper(*, method, path, params=None, data=None, files=None, json=None):
+        # morechildren is sent as POST but only reads comments
+        if path == API_PATH["morechildren"] and files is None and json is None:
+            # the children can be sent as params or as form data, the request is the same
+            return cache.fetch(PLATFORM.REDDIT, path, to_object_id(**{**(params or {}), **(data or {})}),
+                               lambda: request(method=method, path=path, params=params, data=data), mode)
+        if method != "GET" or data is not None or files is not None or json is not None:
+            if mode == CACHE_MODE.REPLAY:
+                raise CacheMissException(PLATFORM.REDDIT, path, method)
+            return request(method=method, path=path, params=params, data=data, files=files, json=json)
+        return cache.fetch(PLATFORM.REDDIT, path, to_object_id(**(params or {})),
+                           lambda: request(method=method, path=path, params=params), mode)
+
+    return wrapper
+
@@ -0,0 +1,176 @@
+import logging
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from api_settings import SAMPLER_STATE_PATH, SAMPLER_EXPLORATION_RATE
+
+logger = logging.getLogger(__name__)
+
+
+class SourceYield:
+    def __init__(self, n_picks=0, n_trees=0, n_flows=0, n_requests=0):
+        self.n_picks = n_picks
+        self.n_trees = n_trees
+        self.n_flows = n_flows
+        self.n_requests = n_requests
+
+    def __str__(self):
+        return "{} flows and {} trees from {} requests in {} picks".format(self.n_flows, self.n_trees,
+                                                                          self.n_requests, self.n_picks)
+
+    def flows_per_request(self):
+        """
+        :return: the reward of the source, flows per pick if no requests were counted (e.g. a custom connector)
+        """
+        if self.n_requests > 0:
+            return self.n_flows / self.n_requests
+        return self.n_flows / max(self.n_picks, 1)
+
+    def trees_per_request(self):
+        if self.n_requests > 0:
+            return self.n_trees / self.n_requests
+        return self.n_trees / max(self.n_picks, 1)
+
+
+class SamplerState:
+    """
+    State of the daily samplers in SQLite: the sources (subreddits, hashtags) already picked per day
+    and the yield of every source over all days. The file can be shared by several processes,
+    a source is only handed out once per day.
+    The next source is picked epsilon-greedy: sources without a yield first, then with probability
+    exploration_rate a random source and otherwise the one with the most flows per request.
+    """
+
+    def __init__(self, path=SAMPLER_STATE_PATH, exploration_rate=SAMPLER_EXPLORATION_RATE):
+        self.path = path
+        self.exploration_rate = exploration_rate
+        self.lock = threading.Lock()
+        # transactions are opened explicitly, so that a pick can lock the file against other processes
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=60, isolation_level=None)
+        with self.lock:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS daily_picks ("
+                                    "platform TEXT, language TEXT, day TEXT, source TEXT, picked_at REAL, "
+                                    "PRIMARY KEY (platform, language, day, source))")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS source_yields ("
+                                    "platform TEXT, language TEXT, source TEXT, n_picks INTEGER, n_trees INTEGER, "
+                                    "n_flows INTEGER, n_requests INTEGER, "
+                                    "PRIMARY KEY (platform, language, source))")
+
+    def __str__(self):
+        return "SamplerState {}".format(self.path)
+
+    def pick_source(self, platform, language, sources, day=None):
+        """
+        :param platform:
+        :param language:
+        :param sources: the pool of subreddits or hashtags
+        :param day: defaults to today
+        :return: the source to sample next or None if all sources were picked that day
+        """
+        day = today() if day is None else day
+        with self.lock:
+            # the write lock is taken at once, so that two processes cannot pick the same source
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                picked = {row[0] for row in self.connection.execute(
+                    "SELECT source FROM daily_picks WHERE platform = ? AND language = ? AND day = ?",
+                    (platform, language, day))}
+                available = [source for source in sources if source not in picked]
+                if len(available) == 0:
+                    self.connection.execute("COMMIT")
+                    return None
+                source = self.__choose(available, self.__yields(platform, language))
+                self.connection.execute("INSERT INTO daily_picks VALUES (?, ?, ?, ?, ?)",
+                                        (platform, language, day, source, time.time()))
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        return source
+
+    def __choose(self, available, yields):
+        untried = [source for source in available if source not in yields]
+        if len(untried) > 0:
+            return random.choice(untried)
+        if random.random() < self.exploration_rate:
+            return random.choice(available)
+        # max keeps the first of equal sources, the order of the pool breaks ties
+        return max(available, key=lambda source: yields[source].flows_per_request())
+
+    def record_yield(self, platform, language, source, n_trees, n_flows, n_requests):
+        """
+        adds the result of sampling the source once
+        :param platform:
+        :param language:
+        :param source:
+        :param n_trees: valid trees found
+        :param n_flows: flows found in these trees
+        :param n_requests: api requests spent on the source
+        """
+        with self.lock:
+            self.connection.execute("INSERT INTO source_yields VALUES (?, ?, ?, 1, ?, ?, ?) "
+                                    "ON CONFLICT (platform, language, source) DO UPDATE SET "
+                                    "n_picks = n_picks + 1, n_trees = n_trees + excluded.n_trees, "
+                                    "n_flows = n_flows + excluded.n_flows, "
+                                    "n_requests = n_requests + excluded.n_requests",
+                                    (platform, language, source, n_trees, n_flows, n_requests))
+        logger.debug("{} {} yielded {} trees and {} flows from {} requests".format(platform, source, n_trees,
+                                                                                   n_flows, n_requests))
+
+    def yields(self, platform, language):
+        """
+        :return: dict of source to SourceYield
+        """
+        with self.lock:
+            return self.__yields(platform, language)
+
+    def __yields(self, platform, language):
+        rows = self.connection.execute("SELECT source, n_picks, n_trees, n_flows, n_requests FROM source_yields "
+                                       "WHERE platform = ? AND language = ?", (platform, language))
+        return {source: SourceYield(*counts) for source, *counts in rows}
+
+    def n_available(self, platform, language, sources, day=None):
+        """
+        :return: the number of sources not picked that day
+        """
+        day = today() if day is None else day
+        with self.lock:
+            picked = {row[0] for row in self.connection.execute(
+                "SELECT source FROM daily_picks WHERE platform = ? AND language = ? AND day = ?",
+                (platform, language, day))}
+        return len([source for source in sources if source not in picked])
+
+    def reset_day(self, platform, language, day=None):
+        """
+        makes the sources of the platform and language available again for the day, the yields are kept.
+        The samplers never call it, the picks of the other processes sampling that day would be handed out again.
+        """
+        day = today() if day is None else day
+        with self.lock:
+            self.connection.execute("DELETE FROM daily_picks WHERE platform = ? AND language = ? AND day = ?",
+                                    (platform, language, day))
+
+    def close(self):
+        self.connection.close()
+
+
+def today():
+    return datetime.now().date().isoformat()
+
+
+_sampler_state = None
+_sampler_state_lock = threading.Lock()
+
+
+def get_sampler_state():
+    """
+    :return: the SamplerState at SAMPLER_STATE_PATH the samplers use if they are not given another one
+    """
+    global _sampler_state
+    with _sampler_state_lock:
+        if _sampler_state is None:
+            _sampler_state = SamplerState()
+        return _sampler_state
@@ -4,17 +4,20 @@ import mastodon
 from mastodon import MastodonServiceUnavailableError
 
 from daily_sampler import download_samples, check_general_tree_requirements
-from datasource.mastodon.download_conversations_mastodon import download_conversations_mstd
-from datasource.mastodon.download_daily_political_sample_mstd import MTSampler
+from datasource.conversation_urls import ConversationByUrl, platform_of_url
+from datasource.mastodon.download_conversations_mastodon import iter_conversations_mstd
 from datasource.mastodon.download_user_conversations import download_user_conversations
-from datasource.reddit.download_conversations_reddit import search_r_all
-from datasource.reddit.download_daily_political_rd_sample import RD_Sampler
+from datasource.mastodon.get_conversations_by_url import get_conversations_by_urls as get_mastodon_conversations_by_urls
+from datasource.reddit.download_conversations_reddit import iter_r_all
 from datasource.reddit.download_user_conversations import get_user_conversations
 from datasource.reddit.get_conversations_by_url import get_conversations_by_url
-from datasource.twitter.download_conversations_twitter import download_conversations_tw
+from datasource.reddit.get_conversations_by_url import get_conversations_by_urls as get_reddit_conversations_by_urls
+from datasource.twitter.download_conversations_twitter import iter_conversations_tw
 from download_exceptions import NoDailySubredditAvailableException, NoDailyMTHashtagsAvailableException
+from job_checkpoints import JobCheckpoint
 from models.language import LANGUAGE
 from models.platform import PLATFORM
+from sampler_state import get_sampler_state, today
 
 logger = logging.getLogger(__name__)
 
@@ -36,50 +39,71 @@ def download_conversations(query_string="Politik",
     :param max_conversations: max number of conversations. Cuts of querying before checking tree requirements!
     :return:
     """
-    result = []
+    return list(iter_conversations(query_string, platform, language, recent, max_conversations, connector))
 
+
+def iter_conversations(query_string="Politik",
+                       platform=PLATFORM.REDDIT,
+                       language=LANGUAGE.ENGLISH,
+                       recent=True,
+                       max_conversations=30,
+                       connector=None
+                       ):
+    """
+    The generator version of download_conversations. Every validated tree is yielded as soon as it is built,
+    the next conversations are only downloaded when the caller asks for them (reddit and mastodon download
+    a small chunk in parallel). Stop iterating (or call close()) to end the download early.
+    :return: generator of DelabTree
+    """
     if platform == PLATFORM.TWITTER:
-        result = download_conversations_tw(connector,
-                                           query_string=query_string,
-                                           language=language,
-                                           platform=platform,
-                                           recent=recent)
+        trees = iter_conversations_tw(connector,
+                                      query_string=query_string,
+                                      language=language,
+                                      platform=platform,
+                                      recent=recent)
     elif platform == PLATFORM.REDDIT:
-        result = search_r_all(query_string,
-                              max_conversations=max_conversations,
-                              recent=recent,
-                              language=language,
-                              reddit=connector)
+        trees = iter_r_all(query_string,
+                           max_conversations=max_conversations,
+                           recent=recent,
+                           language=language,
+                           reddit=connector)
     elif platform == PLATFORM.MASTODON:
-        result = download_conversations_mstd(query=query_string, max_conversations=max_conversations,
-                                             mastodon=connector)
-
-    result_filtered = [x for x in result if x.total_number_of_posts() > 2 and x.validate(verbose=False)]
+        trees = iter_conversations_mstd(query=query_string, max_conversations=max_conversations,
+                                        mastodon=connector)
+    else:
+        trees = []
 
-    return result_filtered
+    for tree in trees:
+        if tree.total_number_of_posts() > 2 and tree.validate(verbose=False):
+            yield tree
 
 
-def download_daily_sample_conversations(platform, min_results, language, connector=None):
+def download_daily_sample_conversations(platform, min_results, language, connector=None, fan_out=1, store=None,
+                                        resume=False):
     """
     This is a proxy to download a sample of political conversations from the given platform for the current day
     :param platform:
     :param min_results:
     :param language:
     :param connector:
+    :param fan_out: number of subreddits or hashtags sampled in parallel, e.g. DAILY_SAMPLER_FAN_OUT
+    :param store: TreeStore the flows are appended to
+    :param resume: record the sampled trees in a JobCheckpoint of the day, so that a restarted sample
+           continues with the trees and subreddits or hashtags of the run before
     :return:
     """
-    # reset the list of subreddits to download
-    if platform == PLATFORM.REDDIT:
-        RD_Sampler.daily_en_subreddits = {}
-        RD_Sampler.daily_de_subreddits = {}
-    elif platform == PLATFORM.MASTODON:
-        MTSampler.daily_en_hashtags = {}
-        MTSampler.daily_de_hashtags = {}
+    state = get_sampler_state()
+    checkpoint = None
+    if resume:
+        checkpoint = JobCheckpoint("daily_sample/{}/{}/{}".format(platform, language, today()))
     # Perform 100 runs of the function and measure the time taken
     try:
         # download_mturk_sample_helper = partial(download_mturk_samples, platform, min_results, language, persist)
         # execution_time = timeit.timeit(download_mturk_sample_helper, number=n_runs)
-        results = download_samples(platform, min_results, language, connector)
+        results = download_samples(platform, min_results, language, connector, fan_out=fan_out, state=state,
+                                   checkpoint=checkpoint)
+        if store is not None:
+            store.write_flows(results, platform, language)
         return results
         # average_time = (execution_time / 100) / 60
         # print("Execution time:", execution_time, "seconds")
@@ -99,17 +123,21 @@ def download_daily_sample_conversations(platform, min_results, language, connect
         logger.error("Mastodon seemed not to be available {}".format(mastodonerror))
 
 
-def get_conversations_by_user(username, platform, max_conversations=1000, connector=None):
+def get_conversations_by_user(username, platform, max_conversations=1000, connector=None, resume=False):
     """
     Get all conversations a given user has participated in on a given platform
     :param max_conversations: max number of conversations to download
     :param username: reddit username with u/ and mastodon user with @
     :param platform: (reddit or mastodon)
     :param connector: the praw object or the mastodon object
+    :param resume: reddit only, record the downloaded conversations in a JobCheckpoint,
+           so that a restarted download skips them
     :return:
     """
     if platform == PLATFORM.REDDIT:
-        conversations = get_user_conversations(username, max_conversations=max_conversations, reddit=connector)
+        checkpoint = JobCheckpoint("user_conversations/{}/{}".format(platform, username)) if resume else None
+        conversations = get_user_conversations(username, max_conversations=max_conversations, reddit=connector,
+                                               checkpoint=checkpoint)
     elif platform == PLATFORM.MASTODON:
         conversations = download_user_conversations(username, max_conversations=max_conversations, mastodon=connector)
     else:
@@ -120,6 +148,35 @@ def get_conversations_by_user(username, platform, max_conversations=1000, connec
 
 def get_conversations_by_conversation_url(conversation_url, platform, connector=None):
     if platform == PLATFORM.REDDIT:
-        return get_conversations_by_url(conversation_url)
+        return get_conversations_by_url(conversation_url, reddit=connector)
+    elif platform == PLATFORM.MASTODON:
+        result = get_mastodon_conversations_by_urls([conversation_url], mastodon=connector)[conversation_url]
+        if result.error is not None:
+            raise result.error
+        return result.tree
     else:
         raise NotImplementedError
+
+
+def get_conversations_by_conversation_urls(conversation_urls, connectors=None):
+    """
+    Downloads the conversations of many urls from reddit and mastodon,
+    with one connector per platform and several conversations at the same time
+    :param conversation_urls: urls of reddit submissions or comments and mastodon statuses, the platform is
+           taken from the host
+    :param connectors: dict of PLATFORM to the praw object or the mastodon object, created once if missing
+    :return: dict of url to ConversationByUrl with the tree or the error (twitter urls are not supported)
+    """
+    connectors = {} if connectors is None else connectors
+    urls_by_platform = {}
+    for url in dict.fromkeys(conversation_urls):
+        urls_by_platform.setdefault(platform_of_url(url), []).append(url)
+    results = {}
+    for platform, urls in urls_by_platform.items():
+        if platform == PLATFORM.REDDIT:
+            results.update(get_reddit_conversations_by_urls(urls, reddit=connectors.get(platform)))
+        elif platform == PLATFORM.MASTODON:
+            results.update(get_mastodon_conversations_by_urls(urls, mastodon=connectors.get(platform)))
+        else:
+            results.update({url: ConversationByUrl(url, platform, error=NotImplementedError(platform)) for url in urls})
+    return {url: results[url] for url in dict.fromkeys(conversation_urls)}
@@ -0,0 +1,42 @@
+import unittest
+from collections import Counter
+from types import SimpleNamespace
+
+from api_settings import MAX_CONVERSATION_LENGTH_REDDIT, MIN_CONVERSATION_LENGTH
+from datasource.candidate_ranking import rank_candidates, FlowYield
+from models.platform import PLATFORM
+
+
+def tweet(tweet_id, reply_count):
+    return {"id": tweet_id, "public_metrics": {"reply_count": reply_count}}
+
+
+class CandidateRankingTestCase(unittest.TestCase):
+
+    def test_reddit_bounds(self):
+        submissions = [SimpleNamespace(id=name, num_comments=num_comments) for name, num_comments in
+                       [("small", MIN_CONVERSATION_LENGTH - 1), ("a", 20), ("large", MAX_CONVERSATION_LENGTH_REDDIT),
+                        ("b", 30), ("c", 20)]]
+        ranked = rank_candidates(PLATFORM.REDDIT, submissions)
+        assert [submission.id for submission in ranked] == ["b", "a", "c"]
+
+    def test_lower_bounds(self):
+        tweets = [tweet("none", 0), tweet("few", 6), tweet("many", 50), tweet("too_many", 99)]
+        # the reply count of a tweet does not tell whether the conversation is too small
+        assert [t["id"] for t in rank_candidates(PLATFORM.TWITTER, tweets)] == ["too_many", "many", "few", "none"]
+        ranked = rank_candidates(PLATFORM.TWITTER, tweets, min_size=6, max_size=100)
+        assert [t["id"] for t in ranked] == ["many", "few"]
+        statuses = [{"id": 1, "replies_count": 1, "in_reply_to_id": None},
+                    {"id": 2, "replies_count": 1, "in_reply_to_id": 5}]
+        assert [s["id"] for s in rank_candidates(PLATFORM.MASTODON, statuses)] == [2, 1]
+
+    def test_flow_yield(self):
+        rate_limits = SimpleNamespace(request_counts=Counter({PLATFORM.REDDIT: 10}))
+        flow_yield = FlowYield(PLATFORM.REDDIT, rate_limits)
+        assert flow_yield.flows_per_request(3) is None
+        rate_limits.request_counts[PLATFORM.REDDIT] += 12
+        assert flow_yield.flows_per_request(3) == 0.25
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+
+from datasource.reddit.comment_expansion import ExpansionBudget, expand_comments, max_comment_depth
+from download_exceptions import ConversationNotInRangeException
+from tests.fake_reddit import FakeComment, FakeMoreComments, FakeSubmission, reply_chain
+
+
+def flat_comments(submission_id, n_comments, prefix):
+    return [FakeComment("{}{}".format(prefix, index), "t3_" + submission_id) for index in range(n_comments)]
+
+
+class CommentExpansionTestCase(unittest.TestCase):
+
+    def test_rejected_without_requests(self):
+        budget = ExpansionBudget(min_posts=3, max_posts=10, min_depth=2)
+        for num_comments in [1, 20]:
+            stub = FakeMoreComments(flat_comments("s", 5, "m"), "t3_s")
+            submission = FakeSubmission("s", [reply_chain("s", 3), stub], num_comments=num_comments)
+            with self.assertRaises(ConversationNotInRangeException) as context:
+                expand_comments(submission, budget)
+            assert context.exception.conversation_size == num_comments + 1
+            assert stub.n_requests == 0
+
+    def test_stubs_are_expanded(self):
+        chain = reply_chain("s", 3)
+        last = chain.replies[0].replies[0]
+        # the stub below the chain holds a reply with another stub
+        inner = FakeMoreComments([FakeComment("x1", "t1_x0")], "t1_x0")
+        deeper = FakeComment("x0", last.fullname)
+        deeper.replies.append(inner)
+        stub = FakeMoreComments([deeper], last.fullname)
+        last.replies.append(stub)
+        submission = FakeSubmission("s", [chain])
+        comments = expand_comments(submission, ExpansionBudget(min_posts=3, max_posts=10, min_depth=6))
+        assert sorted(comment.id for comment in comments) == ["cs0", "cs1", "cs2", "x0", "x1"]
+        assert stub.n_requests == 1 and inner.n_requests == 1
+        assert max_comment_depth(submission, comments) == 6
+        assert all(comment.submission is submission for comment in comments)
+
+    def test_aborted_when_too_large(self):
+        # the larger stub is expanded first, after that the conversation is too large for the budget
+        large = FakeMoreComments(flat_comments("s", 6, "l"), "t3_s")
+        small = FakeMoreComments(flat_comments("s", 2, "m"), "t3_s")
+        submission = FakeSubmission("s", [reply_chain("s", 2), small, large], num_comments=5)
+        with self.assertRaises(ConversationNotInRangeException) as context:
+            expand_comments(submission, ExpansionBudget(min_posts=3, max_posts=8, min_depth=2))
+        assert context.exception.conversation_size == 9
+        assert large.n_requests == 1 and small.n_requests == 0
+
+    def test_request_budget(self):
+        stubs = [FakeMoreComments(flat_comments("s", 2, prefix), "t3_s") for prefix in "mno"]
+        submission = FakeSubmission("s", [reply_chain("s", 3)] + stubs)
+        # loading the forest is the first request, one stub can be expanded
+        with self.assertRaises(ConversationNotInRangeException) as context:
+            expand_comments(submission, ExpansionBudget(min_posts=3, max_posts=20, min_depth=2, max_requests=2))
+        assert "budget" in context.exception.message
+        assert sum(stub.n_requests for stub in stubs) == 1
+
+    def test_not_deep_enough(self):
+        submission = FakeSubmission("s", flat_comments("s", 5, "f"))
+        with self.assertRaises(ConversationNotInRangeException) as context:
+            expand_comments(submission, ExpansionBudget(min_posts=3, max_posts=10, min_depth=3))
+        assert "deep" in context.exception.message
+
+    def test_depth_of_comments_without_parent(self):
+        submission = FakeSubmission("s")
+        comments = [FakeComment("a", "t1_missing"), FakeComment("b", "t1_a"), FakeComment("c", "t3_s")]
+        assert max_comment_depth(submission, comments) == 2
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer
+
+import requests
+
+from connection_util import get_praw, thread_connector
+from datasource.reddit.concurrent_expansion import expand_submission_stream
+from models.platform import PLATFORM
+from rate_limits import RateLimitScheduler
+from response_cache import CACHE_MODE, ResponseCache, to_object_id
+from tests.connector_registry_tests import EmptyJsonHandler
+from tests.fake_reddit import FakeSubmission, reply_chain
+
+
+class FakeReddit:
+    """
+    the praw instance the fake submissions were listed with, the workers get copies of it
+    """
+
+    def __init__(self):
+        self.http_session = requests.Session()
+
+    def copy(self):
+        return FakeReddit()
+
+
+class CountingListing:
+    def __init__(self, submissions):
+        self.submissions = submissions
+        self.n_read = 0
+
+    def __iter__(self):
+        for submission in self.submissions:
+            self.n_read += 1
+            yield submission
+
+
+class ConcurrentExpansionTestCase(unittest.TestCase):
+
+    def test_pacing_charges_network_requests_only(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), EmptyJsonHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResponseCache(os.path.join(directory, "cache.sqlite"))
+            cache.put(PLATFORM.REDDIT, "api/v1/me", to_object_id(), {"name": "cached"})
+            try:
+                rate_limits = RateLimitScheduler(requests_per_minute={PLATFORM.REDDIT: 100})
+                reddit = get_praw(cache=cache, cache_mode=CACHE_MODE.REPLAY, rate_limits=rate_limits)
+                for _ in range(3):
+                    assert reddit.request(method="GET", path="api/v1/me") == {"name": "cached"}
+                assert rate_limits.request_counts[PLATFORM.REDDIT] == 0
+                # the scheduler paces the session the requests are sent with, the copies for the workers share it
+                thread_connector(reddit, PLATFORM.REDDIT).http_session.get(
+                    "http://127.0.0.1:{}/".format(server.server_port))
+                assert rate_limits.request_counts[PLATFORM.REDDIT] == 1
+                assert rate_limits.buckets[PLATFORM.REDDIT].tokens < 100
+            finally:
+                cache.close()
+                server.shutdown()
+
+    def test_stream_in_chunks(self):
+        reddit = FakeReddit()
+        listing = CountingListing([FakeSubmission("s{}".format(index), [reply_chain("s{}".format(index), 5)])
+                                   for index in range(10)])
+        submissions = iter(listing)
+        stream = expand_submission_stream(submissions, reddit, max_workers=3)
+        submission, tree = next(stream)
+        # the first chunk is read and expanded by up to 3 workers, each with its own copy of the praw instance
+        assert submission.id == "s0" and tree.total_number_of_posts() == 6
+        assert listing.n_read == 3 and 1 <= len(reddit.connector_pool.copies) <= 3
+        assert [submission.id for submission, _ in [next(stream), next(stream), next(stream)]] == ["s1", "s2", "s3"]
+        assert listing.n_read == 6
+        # no chunk is read once the caller stops
+        stream.close()
+        assert listing.n_read == 6
+        # the next chunks reuse the copies of the worker threads that ended
+        assert len(list(expand_submission_stream(submissions, reddit, max_workers=3))) == 4
+        assert len(reddit.connector_pool.copies) <= 3
+
+
+if __name__ == '__main__':
+    unittest.main()
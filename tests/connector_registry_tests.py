@@ -0,0 +1,91 @@
+import os
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from connection_util import ConnectorRegistry, pooled_session
+from models.platform import PLATFORM
+from response_cache import CACHE_MODE, ResponseCache, to_object_id
+
+
+class EmptyJsonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalConnector:
+    def __init__(self):
+        self.http_session = pooled_session(PLATFORM.MASTODON)
+
+
+class ConnectorRegistryTestCase(unittest.TestCase):
+
+    def test_shared_connector_reuses_connections(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), EmptyJsonHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:{}/api/v1/instance".format(server.server_port)
+        registry = ConnectorRegistry()
+        registry.FACTORIES = {PLATFORM.MASTODON: LocalConnector}
+        try:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                list(executor.map(lambda _: registry.get(PLATFORM.MASTODON).http_session.get(url), range(40)))
+            stats = registry.get_stats()[PLATFORM.MASTODON]
+            assert stats.n_created == 1 and stats.n_reused == 39
+            assert stats.n_requests == 40 and stats.n_connections <= 4
+            connector = registry.get(PLATFORM.MASTODON)
+            registry.close()
+            assert registry.get(PLATFORM.MASTODON) is not connector
+            assert registry.get_stats()[PLATFORM.MASTODON].n_requests == 40
+        finally:
+            registry.close()
+            server.shutdown()
+
+    def test_client_per_thread(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResponseCache(os.path.join(directory, "cache.sqlite"))
+            cache.put(PLATFORM.REDDIT, "api/v1/me", to_object_id(), {"name": "cached"})
+            registry = ConnectorRegistry()
+            # the real factories, replaying reddit and twitter with a bearer token do not connect
+            registry.configure(PLATFORM.REDDIT, cache=cache, cache_mode=CACHE_MODE.REPLAY)
+            registry.configure(PLATFORM.TWITTER, bearer_token="token")
+            try:
+                reddit = registry.get(PLATFORM.REDDIT)
+                twarc = registry.get(PLATFORM.TWITTER)
+                assert registry.get(PLATFORM.REDDIT) is reddit and registry.get(PLATFORM.TWITTER) is twarc
+
+                def in_thread(barrier):
+                    # the tasks wait for each other, so that both threads of the pool get a client
+                    barrier.wait()
+                    thread_reddit = registry.get(PLATFORM.REDDIT)
+                    # the same copy for the whole thread
+                    assert registry.get(PLATFORM.REDDIT) is thread_reddit
+                    assert thread_reddit.request(method="GET", path="api/v1/me") == {"name": "cached"}
+                    return thread_reddit, registry.get(PLATFORM.TWITTER)
+
+                for _ in range(2):
+                    with ThreadPoolExecutor(max_workers=2) as executor:
+                        clients = list(executor.map(in_thread, [threading.Barrier(2)] * 2))
+                    reddits = {id(thread_reddit) for thread_reddit, _ in clients}
+                    assert len(reddits) == 2 and id(reddit) not in reddits
+                    # the praw copies share the connection pool, twarc reconnects with its own session
+                    assert all(thread_reddit.http_session is reddit.http_session for thread_reddit, _ in clients)
+                    assert all(thread_twarc.client is not twarc.client for _, thread_twarc in clients)
+                # the copies of the threads that ended are handed to the next threads
+                assert len(reddit.connector_pool.copies) == 2
+            finally:
+                registry.close()
+                cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import datetime
+import unittest
+from types import SimpleNamespace
+
+import prawcore
+
+from datasource.conversation_urls import ConversationByUrl, platform_of_url
+from datasource.mastodon.get_conversations_by_url import get_conversations_by_urls
+from download_exceptions import ConversationNotFoundException
+from models.platform import PLATFORM
+
+
+def status(status_id, parent_id, replies_count=0):
+    return {"id": status_id, "in_reply_to_id": parent_id, "replies_count": replies_count,
+            "content": "<p>toot {}</p>".format(status_id), "language": "de",
+            "created_at": datetime.datetime(2023, 1, 1, 0, status_id, tzinfo=datetime.timezone.utc),
+            "url": "https://mastodon.social/@a/{}".format(status_id),
+            "account": {"id": status_id % 2, "username": "a", "display_name": "a"}}
+
+
+class ThreadServer:
+    """
+    answers search_v2 and status_context for one thread 1 <- 2 <- 3 and a status 4 without replies
+    """
+
+    def __init__(self):
+        self.statuses = {1: status(1, None, 1), 2: status(2, 1, 1), 3: status(3, 2), 4: status(4, None)}
+        self.n_context_requests = 0
+
+    def search_v2(self, q, resolve=True, result_type=None):
+        status_id = int(q.rsplit("/", 1)[1])
+        return {"statuses": [self.statuses[status_id]] if status_id in self.statuses else []}
+
+    def status_context(self, status_id):
+        self.n_context_requests += 1
+        thread = [self.statuses[1], self.statuses[2], self.statuses[3]]
+        return {"ancestors": [s for s in thread if s["id"] < status_id],
+                "descendants": [s for s in thread if s["id"] > status_id]}
+
+
+class ConversationUrlsTestCase(unittest.TestCase):
+
+    def test_platform_of_url(self):
+        assert platform_of_url("https://www.reddit.com/r/politics/comments/abc/title/") == PLATFORM.REDDIT
+        assert platform_of_url("https://x.com/user/status/1") == PLATFORM.TWITTER
+        assert platform_of_url("https://chaos.social/@user/110") == PLATFORM.MASTODON
+
+    def test_final_results(self):
+        def result(error):
+            return ConversationByUrl("https://reddit.com/r/a/comments/b", PLATFORM.REDDIT, error=error)
+
+        def response(status_code):
+            return SimpleNamespace(status_code=status_code, headers={}, text="")
+
+        # a forbidden subreddit or a deleted conversation fail again, the other errors are worth another run
+        assert result(None).is_final() and result(ConversationNotFoundException("url")).is_final()
+        assert result(prawcore.exceptions.Forbidden(response(403))).is_final()
+        assert not result(prawcore.exceptions.TooManyRequests(response(429))).is_final()
+        assert not result(prawcore.exceptions.ServerError(response(503))).is_final()
+        assert not result(ConnectionError()).is_final()
+
+    def test_mastodon_urls(self):
+        server = ThreadServer()
+        urls = ["https://mastodon.social/@a/{}".format(status_id) for status_id in [3, 1, 4, 9]]
+        results = get_conversations_by_urls(urls, mastodon=server)
+        assert list(results) == urls
+        assert results[urls[0]].tree is results[urls[1]].tree
+        assert results[urls[0]].tree.total_number_of_posts() == 3
+        assert isinstance(results[urls[2]].error, ConversationNotFoundException)
+        assert isinstance(results[urls[3]].error, ConversationNotFoundException)
+        # the thread is fetched once for both urls
+        assert server.n_context_requests <= 2
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from daily_sampler import SourceSample, download_samples_concurrently
+from datasource.reddit.download_conversations_reddit import compute_reddit_delab_tree
+from download_exceptions import NoDailySubredditAvailableException
+from models.language import LANGUAGE
+from models.platform import PLATFORM
+from sampler_state import SamplerState
+from tests.fake_reddit import FakeSubmission, reply_chain
+
+
+class FakeConnector:
+    def copy(self):
+        return FakeConnector()
+
+
+class StubSources:
+    """
+    samples the subreddits s0, s1, ... of a pool of n_sources, each yields one tree with one flow.
+    The subreddit named slow_source runs until it is cancelled.
+    """
+
+    def __init__(self, n_sources=100, delay_seconds=0.05, slow_source=None):
+        self.n_sources = n_sources
+        self.delay_seconds = delay_seconds
+        self.slow_source = slow_source
+        self.started = []
+        self.connectors = {}
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+
+    def __call__(self, platform, language, connector, cancel_event, state):
+        with self.lock:
+            if len(self.started) == self.n_sources:
+                raise NoDailySubredditAvailableException(language)
+            source = "s{}".format(len(self.started))
+            self.started.append(source)
+            self.connectors.setdefault(threading.get_ident(), set()).add(id(connector))
+        if source == self.slow_source:
+            if cancel_event.wait(10):
+                self.cancelled.set()
+            return SourceSample(source, [], 1)
+        time.sleep(self.delay_seconds)
+        tree = compute_reddit_delab_tree(FakeSubmission(source, [reply_chain(source, 6)]))
+        return SourceSample(source, [tree], 1)
+
+
+class DailySamplerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.state = SamplerState(os.path.join(self.directory.name, "state.sqlite"))
+
+    def tearDown(self):
+        self.state.close()
+        self.directory.cleanup()
+
+    def sample(self, sources, min_results, connector=None, fan_out=3):
+        return download_samples_concurrently(PLATFORM.REDDIT, min_results, LANGUAGE.ENGLISH, connector,
+                                             fan_out=fan_out, state=self.state, source_sampler=sources)
+
+    def test_stops_once_enough_flows(self):
+        sources = StubSources()
+        flows = self.sample(sources, 4)
+        assert len(flows) >= 4
+        # no more sources are started than the ones needed and the ones in flight
+        assert len(sources.started) <= 4 + 2
+        assert self.state.yields(PLATFORM.REDDIT, LANGUAGE.ENGLISH)["s0"].n_flows == 1
+
+    def test_running_sources_are_cancelled(self):
+        sources = StubSources(slow_source="s0")
+        start = time.monotonic()
+        flows = self.sample(sources, 2)
+        assert len(flows) == 2 and time.monotonic() - start < 5
+        assert sources.cancelled.wait(5)
+
+    def test_pool_exhausted(self):
+        # the sources in flight when the pool is exhausted still deliver their flows
+        assert len(self.sample(StubSources(n_sources=3), 3)) == 3
+        with self.assertRaises(NoDailySubredditAvailableException):
+            self.sample(StubSources(n_sources=3), 5)
+
+    def test_connector_per_thread(self):
+        connector = FakeConnector()
+        sources = StubSources(delay_seconds=0.1)
+        self.sample(sources, 6, connector=connector)
+        # every worker thread sampled with its own copy of the connector
+        assert all(len(connectors) == 1 for connectors in sources.connectors.values())
+        assert id(connector) not in set.union(*sources.connectors.values())
+        assert 1 <= len(connector.connector_pool.copies) <= 3
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+"""
+a local mastodon instance that serves the contexts of a fixed set of statuses, for offline tests of the downloads
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTEXT_PATH = re.compile(r"/api/v1/statuses/(\w+)/context")
+STATUS_PATH = re.compile(r"/api/v1/statuses/(\w+)$")
+TIMELINE_PATH = re.compile(r"/api/v1/timelines/tag/(\w+)")
+
+
+def fake_status(status_id, in_reply_to_id=None, replies_count=0, author="a", minute=0):
+    return {"id": str(status_id), "in_reply_to_id": None if in_reply_to_id is None else str(in_reply_to_id),
+            "replies_count": replies_count, "url": "https://fake.social/@{}/{}".format(author, status_id),
+            "account": {"id": str(abs(hash(author)) % 1000), "username": author, "acct": author,
+                        "display_name": author},
+            "content": "<p>status {}</p>".format(status_id), "language": "en",
+            "created_at": "2023-01-01T00:{:02d}:00.000Z".format(minute)}
+
+
+def fake_thread(edges):
+    """
+    :param edges: list of (status_id, parent_id) in the order the statuses were posted, parent_id None for the root
+    :return: dict of id to status with the replies_count the instance knows
+    """
+    statuses = {}
+    for minute, (status_id, parent_id) in enumerate(edges):
+        statuses[str(status_id)] = fake_status(status_id, parent_id, minute=minute)
+        if parent_id is not None:
+            statuses[str(parent_id)]["replies_count"] += 1
+    return statuses
+
+
+class FakeInstance:
+    """
+    serves /api/v1/statuses/<id>, a hashtag timeline with the roots and, after a delay,
+    /api/v1/statuses/<id>/context of the statuses (dicts as returned by fake_status),
+    counts the context requests and the ones in flight at the same time
+    """
+
+    def __init__(self, statuses, delay_seconds=0.0):
+        self.statuses = statuses
+        self.delay_seconds = delay_seconds
+        self.slow_ids = set()
+        self.context_requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.url = "http://127.0.0.1:{}/".format(self.server.server_port)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def context(self, status_id):
+        ancestors = []
+        parent_id = self.statuses[status_id]["in_reply_to_id"]
+        while parent_id is not None:
+            ancestors.insert(0, self.statuses[parent_id])
+            parent_id = self.statuses[parent_id]["in_reply_to_id"]
+        descendants = []
+        queue = [status_id]
+        while queue:
+            parent_id = queue.pop(0)
+            replies = [status for status in self.statuses.values() if status["in_reply_to_id"] == parent_id]
+            descendants.extend(replies)
+            queue.extend(status["id"] for status in replies)
+        return {"ancestors": ancestors, "descendants": sorted(descendants, key=lambda status: status["created_at"])}
+
+    def respond(self, path):
+        match = STATUS_PATH.match(path)
+        if match is not None:
+            return self.statuses[match.group(1)]
+        if TIMELINE_PATH.match(path) is not None:
+            return [status for status in self.statuses.values() if status["in_reply_to_id"] is None]
+        match = CONTEXT_PATH.match(path)
+        if match is None:
+            return {"version": "4.2.0", "uri": "fake.social"}
+        status_id = match.group(1)
+        with self.lock:
+            self.context_requests.append(status_id)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay_seconds * (10 if status_id in self.slow_ids else 1))
+            return self.context(status_id)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def handler(self):
+        instance = self
+
+        class ContextHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                body = json.dumps(instance.respond(self.path.split("?")[0])).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return ContextHandler
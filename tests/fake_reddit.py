@@ -0,0 +1,129 @@
+"""
+offline stand-ins for the praw objects the reddit downloads read, shared by the tests
+"""
+from types import SimpleNamespace
+
+from praw.models import MoreComments
+
+from id_interning import IdInterner, set_id_interner
+
+# the trees of the tests get their ids from an interner without a file instead of the one at ID_INTERNER_PATH
+set_id_interner(IdInterner(path=None))
+
+
+class FakeComment:
+
+    def __init__(self, comment_id, parent_fullname, author="a", body="ok", created_utc=1700000000):
+        self.id = comment_id
+        self.fullname = "t1_" + comment_id
+        self.name = self.fullname
+        self.parent_id = parent_fullname
+        self.author = SimpleNamespace(name=author)
+        self.body = body
+        self.created_utc = created_utc
+        self.created = created_utc
+        self.permalink = "/r/test/comments/{}".format(comment_id)
+        self.replies = []
+
+
+class FakeMoreComments(MoreComments):
+    """
+    a stub whose comments are only returned by comments(), every call is one request
+    """
+
+    def __init__(self, comments, parent_fullname):
+        super().__init__(None, {"count": len(comments), "children": [comment.id for comment in comments],
+                                "parent_id": parent_fullname, "name": "t1__"})
+        self.loaded = comments
+        self.n_requests = 0
+
+    def comments(self, update=True):
+        self.n_requests += 1
+        return self.loaded
+
+
+class FakeForest(list):
+
+    def replace_more(self, limit=None):
+        stubs = [item for item in self.list_all() if isinstance(item, MoreComments)]
+        while stubs:
+            stub = stubs.pop()
+            self.remove_stub(stub)
+            for comment in stub.comments():
+                self.attach(comment)
+            stubs = [item for item in self.list_all() if isinstance(item, MoreComments)]
+        return []
+
+    def list_all(self):
+        result = []
+        queue = list(self)
+        while queue:
+            item = queue.pop(0)
+            result.append(item)
+            if not isinstance(item, MoreComments):
+                queue.extend(item.replies)
+        return result
+
+    def remove_stub(self, stub):
+        for items in [self] + [item.replies for item in self.list_all() if not isinstance(item, MoreComments)]:
+            if stub in items:
+                items.remove(stub)
+                return
+
+    def attach(self, comment):
+        for item in self.list_all():
+            if not isinstance(item, MoreComments) and item.fullname == comment.parent_id:
+                item.replies.append(comment)
+                return
+        self.append(comment)
+
+    def list(self):
+        return self.list_all()
+
+
+class FakeSubmission:
+
+    def __init__(self, submission_id, comments=(), num_comments=None, author="op", created_utc=1700000000):
+        """
+        :param comments: the top level comments and FakeMoreComments stubs, replies are attached to the comments
+        :param num_comments: the number of comments the listing reports, all comments below the submission if None
+        """
+        self.id = submission_id
+        self.fullname = "t3_" + submission_id
+        self.name = self.fullname
+        self.title = "title"
+        self.selftext = "text"
+        self.author = SimpleNamespace(name=author)
+        self.created_utc = created_utc
+        self.created = created_utc
+        self.permalink = "/r/test/comments/{}".format(submission_id)
+        self.comments = FakeForest(comments)
+        self.num_comments = num_comments
+        if num_comments is None:
+            self.num_comments = count_comments(self.comments)
+
+
+def count_comments(items):
+    count = 0
+    for item in items:
+        if isinstance(item, MoreComments):
+            count += count_comments(item.loaded)
+        else:
+            count += 1 + count_comments(item.replies)
+    return count
+
+
+def reply_chain(submission_id, length, authors=("a", "b"), prefix="c"):
+    """
+    :return: the first comment of a chain of length replies below the submission, the authors alternate
+    """
+    comments = []
+    parent_fullname = "t3_" + submission_id
+    for index in range(length):
+        comment = FakeComment("{}{}{}".format(prefix, submission_id, index), parent_fullname,
+                              author=authors[index % len(authors)], created_utc=1700000000 + index + 1)
+        if len(comments) > 0:
+            comments[-1].replies.append(comment)
+        comments.append(comment)
+        parent_fullname = comment.fullname
+    return comments[0]
@@ -0,0 +1,42 @@
+"""
+an offline stand-in for twarc.Twarc2 that returns pages of fixed tweets and counts what was requested
+"""
+
+
+def fake_tweet(tweet_id, parent_id=None, conversation_id=None, minute=0):
+    """
+    :param parent_id: the tweet replied to, None for a root
+    :return: dict with the fields the conversation downloads request
+    """
+    references = [] if parent_id is None else [{"type": "replied_to", "id": str(parent_id)}]
+    return {"id": str(tweet_id), "conversation_id": str(conversation_id or tweet_id), "author_id": str(tweet_id % 3),
+            "text": "tweet {}".format(tweet_id), "created_at": "2023-01-01T00:{:02d}:00.000Z".format(minute),
+            "referenced_tweets": references}
+
+
+class FakeTwarc:
+
+    def __init__(self, tweets=(), page_size=2):
+        """
+        :param tweets: the tweets the searches and lookups can find
+        :param page_size: tweets per page of search_all
+        """
+        self.tweets = {tweet["id"]: tweet for tweet in tweets}
+        self.page_size = page_size
+        self.lookups = []
+        self.n_search_pages = 0
+
+    def tweet_lookup(self, tweet_ids):
+        # twarc sends one request per call with up to 100 ids
+        self.lookups.append(list(tweet_ids))
+        yield {"data": [self.tweets[tweet_id] for tweet_id in tweet_ids if tweet_id in self.tweets]}
+
+    def search_all(self, query, **kwargs):
+        conversation_id = query.split(":")[1]
+        # the replies arrive newest first, like the api returns them
+        replies = sorted([tweet for tweet in self.tweets.values()
+                          if tweet["conversation_id"] == conversation_id and tweet["id"] != conversation_id],
+                         key=lambda tweet: tweet["created_at"], reverse=True)
+        for start in range(0, len(replies), self.page_size):
+            self.n_search_pages += 1
+            yield {"data": replies[start:start + self.page_size]}
@@ -0,0 +1,56 @@
+import unittest
+
+import pandas as pd
+
+from daily_sampler import prune_to_flow_candidates, meta_list_filter, flow_post_mask, IncrementalFlowSampler
+from datasource.delab_tree_builder import DelabTreeBuilder
+
+
+def create_tree(tree_id, branches):
+    """
+    :param branches: lists of (text, author_id) that each form a reply chain below the root
+    """
+    start = pd.Timestamp("2023-01-01")
+    builder = DelabTreeBuilder(tree_id, "root", {"text": "root", "author_id": "r", "created_at": start})
+    n_posts = 0
+    for branch_index, branch in enumerate(branches):
+        parent_id = "root"
+        for post_index, (text, author_id) in enumerate(branch):
+            n_posts += 1
+            post_id = "{}_{}".format(branch_index, post_index)
+            builder.add_post(post_id, parent_id, {"text": text, "author_id": author_id,
+                                                  "created_at": start + pd.Timedelta(minutes=n_posts)})
+            parent_id = post_id
+    return builder.to_delab_tree()
+
+
+def alternating(n, bad_index=None):
+    return [("[removed]" if i == bad_index else "ok", "a{}".format(i % 2)) for i in range(n)]
+
+
+class FlowSamplingTestCase(unittest.TestCase):
+
+    def test_post_mask(self):
+        tree = create_tree("t", [[("ok", "a"), ("ok", "a"), ("x" * 600, "b"), ("!ban", "c")]])
+        mask = dict(zip(tree.df["post_id"], flow_post_mask(tree.df)))
+        assert mask == {"root": True, "0_0": True, "0_1": False, "0_2": False, "0_3": False}
+
+    def test_failing_branch_is_pruned(self):
+        tree = create_tree("t", [alternating(9, bad_index=4), alternating(7)])
+        pruned = prune_to_flow_candidates(tree)
+        assert set(pruned.df["post_id"]) == {"root"} | {"1_{}".format(i) for i in range(7)}
+        flows = pruned.get_flow_candidates(5)
+        assert len(flows) == 1 and meta_list_filter(flows[0])
+        assert [len(flow) for flow in flows] == \
+               [len(flow) for flow in tree.get_flow_candidates(5, filter_function=meta_list_filter)]
+
+    def test_incremental_sampler(self):
+        sampler = IncrementalFlowSampler()
+        assert len(sampler.add_trees([create_tree("t1", [alternating(8)]), create_tree("t2", [alternating(3)])])) == 1
+        assert len(sampler.add_trees([create_tree("t1", [alternating(8)]), create_tree("t3", [alternating(6)])])) == 1
+        assert len(sampler) == 2
+        assert len(sampler.forest()) == 2
+
+
+if __name__ == '__main__':
+    unittest.main()
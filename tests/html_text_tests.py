@@ -0,0 +1,32 @@
+import unittest
+
+from bs4 import BeautifulSoup
+
+from datasource.mastodon.html_text import HtmlTextConverter, fast_html_to_text, html_to_text
+
+CONTENTS = ['<p><span class="h-card"><a href="https://mastodon.social/@user" class="u-url mention">@<span>user'
+            '</span></a></span> Das &quot;ist&quot; f&#252;r dich &amp; mich &lt;3</p><p>zweiter<br />Absatz</p>',
+            '<p><a href="https://example.org/?a=1&amp;b=2" rel="nofollow noopener" target="_blank">'
+            '<span class="invisible">https://</span><span class="ellipsis">example.org</span></a></p>\n<p> </p>',
+            # handled by BeautifulSoup
+            '<p>a &foo; b</p>', '<p>code</p><pre>  x\n  y</pre>', 'a < b <!-- comment -->']
+
+
+class HtmlTextTestCase(unittest.TestCase):
+
+    def test_same_text_as_beautiful_soup(self):
+        for content in CONTENTS:
+            assert html_to_text(content) == BeautifulSoup(content, 'html.parser').get_text()
+        assert fast_html_to_text(CONTENTS[0]) is not None and fast_html_to_text(CONTENTS[2]) is None
+
+    def test_cache_by_status_id(self):
+        converter = HtmlTextConverter(cache_size=2, processes=None)
+        statuses = [{"id": 1, "content": "<p>a</p>"}, {"id": 2, "content": "<p>b</p>"}]
+        assert converter.convert_many(statuses + statuses) == ["a", "b", "a", "b"]
+        # an edited status keeps its id
+        assert converter.convert({"id": 1, "content": "<p>c</p>", "edited_at": "2023-01-02"}) == "c"
+        assert len(converter.cache) == 2
+
+
+if __name__ == '__main__':
+    unittest.main()
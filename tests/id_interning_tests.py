@@ -0,0 +1,29 @@
+import os
+import tempfile
+import unittest
+
+from id_interning import IdInterner, ID_NAMESPACE
+
+
+class IdInterningTestCase(unittest.TestCase):
+
+    def test_dense_ids(self):
+        interner = IdInterner(path=None)
+        assert interner.intern_many(ID_NAMESPACE.REDDIT_POST, ["t3_a", "t1_b", "t3_a"]) == [1, 2, 1]
+        assert interner.intern(ID_NAMESPACE.REDDIT_POST, "t1_c") == 3
+        # namespaces are counted separately
+        assert interner.intern(ID_NAMESPACE.REDDIT_AUTHOR, "t3_a") == 1
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "ids.sqlite")
+            first = IdInterner(path=path)
+            assert first.intern_many(ID_NAMESPACE.REDDIT_POST, ["t3_a", "t1_b"]) == [1, 2]
+            first.close()
+            second = IdInterner(path=path)
+            assert second.intern_many(ID_NAMESPACE.REDDIT_POST, ["t1_c", "t1_b", "t3_a"]) == [3, 2, 1]
+            second.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
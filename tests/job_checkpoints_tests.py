@@ -0,0 +1,93 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from daily_sampler import IncrementalFlowSampler, SourceSample, add_source_sample, restore_source_samples
+from datasource.reddit.download_conversations_reddit import compute_reddit_delab_tree
+from job_checkpoints import JobCheckpoint, run_units
+from models.language import LANGUAGE
+from models.platform import PLATFORM
+from sampler_state import SamplerState
+from tests.fake_reddit import FakeSubmission, reply_chain
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def sample_source(directory, source, submission_ids):
+    """
+    samples reddit trees of the submissions into the checkpoint of the daily sample in directory
+    :return: the flows found by a fresh sampler that resumed from the checkpoint
+    """
+    checkpoint = JobCheckpoint("daily_sample", os.path.join(directory, "jobs.sqlite"))
+    state = SamplerState(os.path.join(directory, "state.sqlite"))
+    sampler = IncrementalFlowSampler()
+    restore_source_samples(sampler, checkpoint, PLATFORM.REDDIT)
+    trees = [compute_reddit_delab_tree(FakeSubmission(submission_id, [reply_chain(submission_id, 6)]))
+             for submission_id in submission_ids]
+    add_source_sample(sampler, SourceSample(source, trees, 1), PLATFORM.REDDIT, LANGUAGE.ENGLISH, state,
+                      checkpoint)
+    checkpoint.close()
+    state.close()
+    return sampler.flows
+
+
+class JobCheckpointTestCase(unittest.TestCase):
+
+    def test_restart_skips_finished_units(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "jobs.sqlite")
+            calls = []
+
+            def crashing(unit):
+                if unit == 3:
+                    raise RuntimeError("crash")
+                calls.append(unit)
+                return unit * 10
+
+            with self.assertRaises(RuntimeError):
+                list(run_units(range(5), crashing, JobCheckpoint("job", path)))
+            calls.clear()
+            checkpoint = JobCheckpoint("job", path)
+            results = list(run_units(range(5), lambda unit: calls.append(unit) or unit * 10, checkpoint))
+            assert results == [(unit, unit * 10) for unit in range(5)]
+            assert calls == [3, 4]
+            # other jobs in the same file are kept apart
+            assert len(JobCheckpoint("other job", path)) == 0
+            checkpoint.clear()
+            assert len(checkpoint) == 0
+
+    def test_units_to_retry_are_not_recorded(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = JobCheckpoint("urls", os.path.join(directory, "jobs.sqlite"))
+            failing = {"b"}
+
+            def download(url):
+                if url in failing:
+                    raise ConnectionError(url)
+                return url.upper()
+
+            # the url that failed is left out and downloaded by the next run
+            assert list(run_units(["a", "b", "c"], download, checkpoint, retry_errors=(ConnectionError,))) == \
+                   [("a", "A"), ("c", "C")]
+            assert checkpoint.is_done("a") and not checkpoint.is_done("b")
+            failing.clear()
+            assert list(run_units(["a", "b", "c"], download, checkpoint, retry_errors=(ConnectionError,))) == \
+                   [("a", "A"), ("b", "B"), ("c", "C")]
+            checkpoint.close()
+
+    def test_resumed_daily_sample(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # the first run is another process, the ids of its trees do not depend on the state of this one
+            subprocess.run([sys.executable, "-c", "from tests.job_checkpoints_tests import sample_source; "
+                                                  "sample_source({!r}, 'first', ['s1'])".format(directory)],
+                           cwd=ROOT, check=True)
+            flows = sample_source(directory, "second", ["s2", "s1"])
+            # one flow of the restored tree s1 and one of the new tree s2, s1 is not sampled twice
+            assert len(flows) == 2
+            assert len({flow[0].tree_id for flow in flows}) == 2
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from api_settings import MST_MAX_CONCURRENT_REQUESTS
+from connection_util import create_mastodon
+from datasource.mastodon.async_context_fetcher import AsyncContextFetcher, fetch_contexts
+from datasource.mastodon.context_index import ContextIndex
+from datasource.mastodon.download_conversations_mastodon import iter_conversations_to_search
+from models.platform import PLATFORM
+from socialmedia import iter_conversations
+from tests.fake_mastodon import FakeInstance, fake_thread
+
+
+def roots_with_replies(n_roots):
+    """
+    :return: dict of the statuses of n_roots threads, each with a root r<i> and a reply p<i>
+    """
+    statuses = {}
+    for index in range(n_roots):
+        statuses.update(fake_thread([("r{}".format(index), None), ("p{}".format(index), "r{}".format(index))]))
+    return statuses
+
+
+class MastodonContextTestCase(unittest.TestCase):
+
+    def serve(self, statuses, delay_seconds=0.0):
+        instance = FakeInstance(statuses, delay_seconds)
+        self.addCleanup(instance.stop)
+        return instance, create_mastodon("id", "secret", "token", api_base_url=instance.url)
+
+    def test_concurrent_fetches_are_bounded(self):
+        instance, mastodon = self.serve(roots_with_replies(6), delay_seconds=0.2)
+        roots = [mastodon.status("r{}".format(index)) for index in range(6)]
+        contexts = AsyncContextFetcher(mastodon, max_concurrency=2).fetch_contexts(roots)
+        assert [str(context["root"]["id"]) for context in contexts] == ["r{}".format(index) for index in range(6)]
+        assert all(len(context["descendants"]) == 1 for context in contexts)
+        assert len(instance.context_requests) == 6 and instance.max_in_flight == 2
+
+    def test_slow_contexts_are_skipped(self):
+        statuses = roots_with_replies(3)
+        statuses.update(fake_thread([("lonely", None)]))
+        instance, mastodon = self.serve(statuses, delay_seconds=0.2)
+        roots = [mastodon.status("r{}".format(index)) for index in range(3)]
+        instance.slow_ids.add("r1")
+        fetcher = AsyncContextFetcher(mastodon, timeout_seconds=0.5)
+        start = time.monotonic()
+        contexts = fetcher.fetch_contexts(roots + [mastodon.status("lonely")])
+        # the request for r1 takes 2 seconds, the fetch returns when it times out
+        assert time.monotonic() - start < 1.5
+        # the root without replies is not requested
+        assert [str(context["root"]["id"]) for context in contexts] == ["r0", "r2"]
+        assert sorted(instance.context_requests) == ["r0", "r1", "r2"]
+        # the thread of r1 can be resolved by the next status of it
+        assert not fetcher.index.is_resolved(roots[1])
+
+    def test_fetch_inside_running_loop(self):
+        instance, mastodon = self.serve(roots_with_replies(2))
+        roots = [mastodon.status("r{}".format(index)) for index in range(2)]
+
+        async def notebook_cell():
+            return AsyncContextFetcher(mastodon).fetch_contexts(roots)
+
+        assert len(asyncio.run(notebook_cell())) == 2
+
+    def test_threads_are_fetched_once(self):
+        instance, mastodon = self.serve(fake_thread([("r", None), ("a", "r"), ("b", "a"), ("c", "b")]))
+        index = ContextIndex()
+        # c replies to b of the same batch, only the context of b is requested
+        contexts = fetch_contexts([mastodon.status("c"), mastodon.status("b")], mastodon, index=index)
+        assert instance.context_requests == ["b"] and len(contexts) == 1
+        # the thread is a chain, its root context is derived from the context of b
+        assert [str(status["id"]) for status in contexts[0]["descendants"]] == \
+               [status["id"] for status in instance.context("r")["descendants"]]
+        # a later batch with a status of the thread sends no request
+        assert fetch_contexts([mastodon.status("a")], mastodon, index=index) == []
+        assert instance.context_requests == ["b"]
+        assert index.skipped_statuses == 2 and len(index) == 1
+
+    def test_stale_replies_count(self):
+        statuses = fake_thread([("r", None), ("a", "r"), ("b", "a"), ("c", "a"), ("d", "b")])
+        # the counts of a and b do not know of the replies c and d yet
+        statuses["a"]["replies_count"] = 1
+        statuses["b"]["replies_count"] = 0
+        instance, mastodon = self.serve(statuses)
+        contexts = fetch_contexts([mastodon.status("b")], mastodon)
+        # b has a reply it does not count, so the root context is fetched and holds the other branch
+        assert instance.context_requests == ["b", "r"]
+        assert sorted(str(status["id"]) for status in contexts[0]["descendants"]) == ["a", "b", "c", "d"]
+
+    def test_downloads_advance_with_the_caller(self):
+        statuses = {}
+        for index in range(20):
+            statuses.update(fake_thread([("r{}".format(index), None), ("a{}".format(index), "r{}".format(index)),
+                                         ("b{}".format(index), "a{}".format(index))]))
+        instance, mastodon = self.serve(statuses, delay_seconds=0.01)
+        trees = iter_conversations("politik", PLATFORM.MASTODON, max_conversations=20, connector=mastodon)
+        assert instance.context_requests == []
+        assert next(trees).total_number_of_posts() == 3
+        # the first window of contexts is requested for the first tree
+        assert len(instance.context_requests) == MST_MAX_CONCURRENT_REQUESTS
+        for n_trees in range(2, 6):
+            next(trees)
+            # a status is started for every context completed, never more than the window ahead of the caller
+            assert len(instance.context_requests) <= n_trees + MST_MAX_CONCURRENT_REQUESTS
+        trees.close()
+        with self.assertRaises(StopIteration):
+            next(trees)
+        time.sleep(0.1)
+        assert len(instance.context_requests) <= 5 + MST_MAX_CONCURRENT_REQUESTS
+
+    def test_cancelled_download_stops(self):
+        instance, mastodon = self.serve(roots_with_replies(40), delay_seconds=0.01)
+        cancel_event = threading.Event()
+        trees = iter_conversations_to_search("politik", mastodon, None, max_conversations=40,
+                                             cancel_event=cancel_event)
+        next(trees)
+        cancel_event.set()
+        with self.assertRaises(StopIteration):
+            next(trees)
+        time.sleep(0.1)
+        # the contexts in flight when the event was set are the last ones requested
+        assert len(instance.context_requests) <= 2 + MST_MAX_CONCURRENT_REQUESTS
+
+    def test_slow_context_does_not_hold_back_the_others(self):
+        instance, mastodon = self.serve(roots_with_replies(24), delay_seconds=0.3)
+        roots = mastodon.timeline_hashtag("politik")
+        # the request for r0 takes three seconds, the others 0.3 seconds
+        instance.slow_ids.add("r0")
+        start = time.monotonic()
+        contexts = list(AsyncContextFetcher(mastodon).iter_contexts(roots))
+        # the other roots are fetched in the free slots of the window while r0 is in flight,
+        # in fixed chunks of 8 the chunk of r0 would wait for it and the fetch would take about 5 seconds
+        assert time.monotonic() - start < 4.2
+        assert len(contexts) == 24 and len(instance.context_requests) == 24
+        assert str(contexts[0]["root"]["id"]) != "r0"
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import datetime
+import unittest
+
+import pandas as pd
+
+from datasource.delab_tree_builder import DelabTreeBuilder
+from datasource.normalization import normalize_ids, normalize_timestamps
+from datasource.reddit.download_conversations_reddit import compute_reddit_tree, compute_reddit_delab_tree
+from tests.fake_reddit import FakeSubmission, reply_chain
+
+
+class NormalizationTestCase(unittest.TestCase):
+
+    def test_timestamps(self):
+        expected = pd.Timestamp("2023-01-01 10:00", tz="UTC")
+        # reddit epoch, twitter iso string and mastodon datetime with an offset
+        berlin = datetime.timezone(datetime.timedelta(hours=1))
+        for values in [[expected.timestamp()], ["2023-01-01T10:00:00.000Z"],
+                       [datetime.datetime(2023, 1, 1, 11, 0, tzinfo=berlin)]]:
+            assert normalize_timestamps(values).tolist() == [expected]
+
+    def test_ids(self):
+        assert normalize_ids([None, 1612345678901234567, "x", float("nan"), "None"]).tolist() == \
+               [None, "1612345678901234567", "x", None, None]
+        # numeric ids become int64, or Int64 with a missing parent, also if they are digit strings
+        assert normalize_ids([1, 2, 3]).dtype == "int64"
+        assert normalize_ids([None, "1612345678901234567", 3]).tolist() == [pd.NA, 1612345678901234567, 3]
+        assert normalize_ids([None, 2]).dtype == "Int64"
+        # ids that do not fit into int64 or would lose a leading zero stay str
+        assert normalize_ids(["99999999999999999999", 1]).tolist() == ["99999999999999999999", "1"]
+        assert normalize_ids(["007", 1]).tolist() == ["007", "1"]
+
+    def test_large_int_ids_in_builder(self):
+        # a column of ints with a missing root parent would be converted to float by pandas
+        builder = DelabTreeBuilder("t", 1612345678901234567, {"text": "root", "author_id": 1,
+                                                              "created_at": "2023-01-01T00:00:00Z"})
+        builder.add_post(1612345678901234569, 1612345678901234567, {"text": "a", "author_id": 2,
+                                                                    "created_at": "2023-01-01T00:01:00Z"})
+        builder.add_post(1612345678901234571, 1612345678901234569, {"text": "b", "author_id": 1,
+                                                                    "created_at": "2023-01-01T00:02:00Z"})
+        tree = builder.to_delab_tree()
+        assert tree.df["parent_id"].tolist()[1:] == [1612345678901234567, 1612345678901234569]
+        assert tree.validate(verbose=False) and tree.depth() == 3
+
+    def test_reddit_paths_agree(self):
+        # the recursive tree and the table have the same int ids and utc timestamps
+        tree = compute_reddit_delab_tree(FakeSubmission("s1", [reply_chain("s1", 3)]))
+        node = compute_reddit_tree(FakeSubmission("s1", [reply_chain("s1", 3)]))
+        nodes = []
+        while node is not None:
+            nodes.append((node.node_id, node.parent_id, node.data["created_at"]))
+            node = node.children[0] if len(node.children) > 0 else None
+        rows = list(tree.df[["post_id", "parent_id", "created_at"]].itertuples(index=False, name=None))
+        # the parent of the root is None in the recursive tree and NA in the table
+        assert nodes[0][1] is None and rows[0][1] is pd.NA
+        assert nodes[1:] == rows[1:] and nodes[0][::2] == rows[0][::2]
+        assert str(nodes[0][2].tz) == "UTC" and isinstance(nodes[0][0], int)
+
+
+if __name__ == '__main__':
+    unittest.main()
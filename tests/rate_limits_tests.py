@@ -0,0 +1,76 @@
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+from requests.structures import CaseInsensitiveDict
+
+from models.platform import PLATFORM
+from rate_limits import RateLimitScheduler, TokenBucket, endpoint_of, counting_requests
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+
+
+class RateLimitSchedulerTestCase(unittest.TestCase):
+
+    def test_waits_until_reset(self):
+        scheduler = RateLimitScheduler()
+        endpoint = endpoint_of(PLATFORM.TWITTER, "https://api.twitter.com/2/tweets/search/all")
+        reset_at = time.time() + 0.5
+        scheduler.after_response(PLATFORM.TWITTER, endpoint, FakeResponse(200, {"x-rate-limit-remaining": "1",
+                                                                                "x-rate-limit-reset": str(reset_at)}))
+        scheduler.before_request(PLATFORM.TWITTER, endpoint)
+        assert time.time() < reset_at
+        scheduler.before_request(PLATFORM.TWITTER, endpoint)
+        assert time.time() >= reset_at
+        assert scheduler.request_counts[PLATFORM.TWITTER] == 2
+
+    def test_too_many_requests(self):
+        scheduler = RateLimitScheduler()
+        scheduler.after_response(PLATFORM.REDDIT, "*", FakeResponse(429, {"x-ratelimit-remaining": "3.0",
+                                                                          "x-ratelimit-reset": "60"}))
+        assert 55 < scheduler.seconds_until_reset(PLATFORM.REDDIT) <= 60
+        # other endpoints are not affected
+        assert scheduler.seconds_until_reset(PLATFORM.TWITTER) is None
+
+    def test_token_bucket(self):
+        scheduler = RateLimitScheduler()
+        scheduler.buckets[PLATFORM.REDDIT] = TokenBucket(requests_per_period=2, period_seconds=0.2)
+        start = time.monotonic()
+        for _ in range(4):
+            scheduler.before_request(PLATFORM.REDDIT, "*")
+        # two requests at once, the next ones as the tokens are refilled every 0.1 seconds
+        assert 0.15 < time.monotonic() - start < 1 and scheduler.request_counts[PLATFORM.REDDIT] == 4
+        # the other platforms are not paced
+        for _ in range(4):
+            scheduler.before_request(PLATFORM.MASTODON, "fake.social")
+        assert scheduler.waited_seconds[PLATFORM.MASTODON] == 0
+        scheduler.pause(PLATFORM.REDDIT, "*", 0.3)
+        start = time.monotonic()
+        scheduler.before_request(PLATFORM.REDDIT, "*")
+        assert time.monotonic() - start >= 0.25
+
+    def test_counting_requests(self):
+        scheduler = RateLimitScheduler()
+        scheduler.before_request(PLATFORM.REDDIT, "*")
+        with counting_requests() as counter:
+            scheduler.before_request(PLATFORM.REDDIT, "*")
+            # worker threads count for the context they were started from
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                for _ in range(3):
+                    executor.submit(copy_context().run, scheduler.before_request, PLATFORM.REDDIT, "*")
+        assert counter[PLATFORM.REDDIT] == 4
+        assert scheduler.request_counts[PLATFORM.REDDIT] == 5
+
+    def test_endpoints(self):
+        assert endpoint_of(PLATFORM.TWITTER, "https://api.twitter.com/2/tweets/1612345678901234567/quote_tweets") \
+               == "/2/tweets/:id/quote_tweets"
+        assert endpoint_of(PLATFORM.MASTODON, "https://mastodon.social/api/v1/statuses/1/context") == "mastodon.social"
+
+
+if __name__ == '__main__':
+    unittest.main()
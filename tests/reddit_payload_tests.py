@@ -0,0 +1,54 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+import praw
+
+from connection_util import get_praw
+from datasource.delab_tree_builder import DelabTreeBuilder
+from datasource.reddit.download_conversations_reddit import comment_to_record, submission_to_record
+from id_interning import IdInterner, set_id_interner
+from response_cache import CACHE_MODE, ResponseCache
+
+SCALARS = (str, int, float, bool, type(None))
+
+
+def listing_data(thing_id, kind, parent_name=None):
+    # some of the fields of a reddit listing, the upvote_ratio of the submission is missing
+    return {"id": thing_id, "name": "{}_{}".format(kind, thing_id), "author": "author", "title": "submission",
+            "selftext": "", "body": "comment {}".format(thing_id), "created_utc": 1.6e9, "edited": False,
+            "parent_id": parent_name, "link_id": "t3_root", "subreddit_id": "t5_2cneq", "score": 3,
+            "permalink": "/r/politics/comments/root/{}/".format(thing_id), "all_awardings": [], "gildings": {}}
+
+
+class RedditPayloadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        set_id_interner(IdInterner(path=None))
+
+    def test_compact_records(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResponseCache(os.path.join(directory, "cache.sqlite"))
+            # every request of the offline praw instance raises a CacheMissException
+            reddit = get_praw(cache=cache, cache_mode=CACHE_MODE.REPLAY)
+            submission = praw.models.Submission(reddit, _data=listing_data("root", "t3"))
+            comment = praw.models.Comment(reddit, _data=listing_data("c1", "t1", "t3_root"))
+            tree_id, data = submission_to_record(submission, "en", compact=True)
+            builder = DelabTreeBuilder(tree_id, tree_id, data)
+            node_id, parent_id, comment_data = comment_to_record(comment, tree_id, "en", compact=True)
+            builder.add_post(node_id, parent_id, comment_data)
+            df = builder.to_dataframe()
+            cache.close()
+        records = df["rd_data"].tolist()
+        assert all(isinstance(record, dict) for record in records)
+        assert all(isinstance(value, SCALARS) for record in records for value in record.values())
+        # the missing field is not fetched, the lists and dicts of the listing are not kept
+        assert "upvote_ratio" not in records[0] and records[0]["score"] == 3
+        assert "all_awardings" not in records[1] and records[1]["parent_id"] == "t3_root"
+        assert not submission._fetched
+        assert pickle.loads(pickle.dumps(df))["rd_data"].tolist() == records
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,7 +7,7 @@ import api_settings
 from connection_util import get_praw
 from models.language import LANGUAGE
 from models.platform import PLATFORM
-from socialmedia import download_conversations, download_daily_sample_conversations
+from socialmedia import download_conversations, download_daily_sample_conversations, iter_conversations
 from datasource.reddit.download_user_conversations import get_user_conversations
 
 
@@ -33,6 +33,13 @@ class DelabTreeConstructionTestCase(unittest.TestCase):
         conversations = download_conversations("Trump", platform=PLATFORM.REDDIT)
         assert len(conversations) > 0
 
+    def test_tree_stream(self):
+        assert self.reddit_secret is not None
+        trees = iter_conversations("Trump", platform=PLATFORM.REDDIT)
+        tree = next(trees)
+        trees.close()
+        assert tree.validate(verbose=False)
+
     def test_post_message(self):
         pass
 
@@ -0,0 +1,106 @@
+import os
+import tempfile
+import unittest
+
+from praw.const import API_PATH
+
+from download_exceptions import CacheMissException
+from models.platform import PLATFORM
+from response_cache import CACHE_MODE, ResponseCache, cached_reddit_request, to_object_id
+
+
+class PagedDownload:
+    def __init__(self, n_pages):
+        self.n_pages = n_pages
+        self.n_calls = 0
+
+    def __call__(self):
+        self.n_calls += 1
+        return iter(["page {}".format(index) for index in range(self.n_pages)])
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "cache.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_endpoint_ttls(self):
+        cache = ResponseCache(self.path, ttl_seconds=3600, endpoint_ttls={"timeline_hashtag": 0, "listing": 0})
+        downloads = []
+        for _ in range(2):
+            for endpoint in ["status", "timeline_hashtag"]:
+                cache.fetch(PLATFORM.MASTODON, endpoint, "1", lambda: downloads.append(endpoint) or endpoint)
+        # the timeline is downloaded again, the status is answered from the cache
+        assert downloads == ["status", "timeline_hashtag", "timeline_hashtag"]
+        assert cache.fetch(PLATFORM.MASTODON, "timeline_hashtag", "1", None, CACHE_MODE.REPLAY) == "timeline_hashtag"
+        # the ttl of reddit requests depends on the kind of path
+        assert cache.ttl(PLATFORM.REDDIT, "r/politics/new") == 0
+        assert cache.ttl(PLATFORM.REDDIT, "user/spez/comments") == 0
+        assert cache.ttl(PLATFORM.REDDIT, "comments/abc/") == 3600
+        cache.close()
+
+    def test_least_recently_used_are_evicted(self):
+        cache = ResponseCache(self.path, max_bytes=3500)
+        for object_id in ["a", "b", "c"]:
+            cache.put(PLATFORM.MASTODON, "status", object_id, "x" * 900)
+        assert cache.get(PLATFORM.MASTODON, "status", "a")[0]
+        cache.put(PLATFORM.MASTODON, "status", "d", "x" * 900)
+        # b was used least recently
+        assert [cache.get(PLATFORM.MASTODON, "status", object_id)[0] for object_id in "abcd"] == \
+               [True, False, True, True]
+        assert cache.size() <= 3500
+        cache.close()
+
+    def test_replay_miss(self):
+        cache = ResponseCache(self.path)
+        with self.assertRaises(CacheMissException):
+            cache.fetch(PLATFORM.MASTODON, "status", "1", lambda: self.fail("replay sent a request"),
+                        CACHE_MODE.REPLAY)
+        with self.assertRaises(CacheMissException):
+            list(cache.fetch_pages(PLATFORM.TWITTER, "search_all", "1", lambda: self.fail("replay sent a request"),
+                                   CACHE_MODE.REPLAY))
+        cache.close()
+
+    def test_partial_pages(self):
+        cache = ResponseCache(self.path)
+        download = PagedDownload(3)
+        pages = cache.fetch_pages(PLATFORM.TWITTER, "tweet_lookup", "1", download)
+        assert next(pages) == "page 0"
+        pages.close()
+        # a partial recording is replayed as far as it was read
+        replayed = cache.fetch_pages(PLATFORM.TWITTER, "tweet_lookup", "1", download, CACHE_MODE.REPLAY)
+        assert next(replayed) == "page 0"
+        with self.assertRaises(CacheMissException):
+            next(replayed)
+        # and downloaded again in record mode, after that it is complete
+        assert list(cache.fetch_pages(PLATFORM.TWITTER, "tweet_lookup", "1", download)) == \
+               ["page 0", "page 1", "page 2"]
+        assert list(cache.fetch_pages(PLATFORM.TWITTER, "tweet_lookup", "1", download)) == \
+               ["page 0", "page 1", "page 2"]
+        assert download.n_calls == 2
+        cache.close()
+
+    def test_morechildren_with_params_and_data(self):
+        cache = ResponseCache(self.path)
+        requests = []
+
+        def request(**kwargs):
+            requests.append(kwargs)
+            return {"children": kwargs["data"]["children"]}
+
+        cached_request = cached_reddit_request(request, cache, CACHE_MODE.RECORD)
+        for _ in range(2):
+            response = cached_request(method="POST", path=API_PATH["morechildren"], params={"raw_json": 1},
+                                      data={"children": "a,b", "raw_json": 1})
+        assert response == {"children": "a,b"} and len(requests) == 1
+        hit, _ = cache.get(PLATFORM.REDDIT, API_PATH["morechildren"], to_object_id(children="a,b", raw_json=1))
+        assert hit
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
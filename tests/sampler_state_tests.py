@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+
+from models.language import LANGUAGE
+from models.platform import PLATFORM
+from sampler_state import SamplerState
+
+SOURCES = ["politics", "news", "worldnews"]
+
+
+class SamplerStateTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "state.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_sources_are_picked_once_per_day_across_processes(self):
+        # two states on the same file stand for two worker processes
+        states = [SamplerState(self.path), SamplerState(self.path)]
+        picks = [states[i % 2].pick_source(PLATFORM.REDDIT, LANGUAGE.ENGLISH, SOURCES, "2023-01-01")
+                 for i in range(4)]
+        assert sorted(picks[:3]) == sorted(SOURCES) and picks[3] is None
+        assert states[0].pick_source(PLATFORM.REDDIT, LANGUAGE.GERMAN, SOURCES, "2023-01-01") is not None
+        assert states[1].pick_source(PLATFORM.REDDIT, LANGUAGE.ENGLISH, SOURCES, "2023-01-02") is not None
+        states[1].reset_day(PLATFORM.REDDIT, LANGUAGE.ENGLISH, "2023-01-01")
+        assert states[0].n_available(PLATFORM.REDDIT, LANGUAGE.ENGLISH, SOURCES, "2023-01-01") == 3
+        # the picks of the other languages are kept
+        assert states[0].n_available(PLATFORM.REDDIT, LANGUAGE.GERMAN, SOURCES, "2023-01-01") == 2
+        for state in states:
+            state.close()
+
+    def test_picks_the_best_yield(self):
+        state = SamplerState(self.path, exploration_rate=0)
+        state.record_yield(PLATFORM.MASTODON, LANGUAGE.ENGLISH, "politics", 2, 2, 10)
+        state.record_yield(PLATFORM.MASTODON, LANGUAGE.ENGLISH, "news", 5, 8, 10)
+        # sources without a yield are tried first
+        assert state.pick_source(PLATFORM.MASTODON, LANGUAGE.ENGLISH, SOURCES, "2023-01-01") == "worldnews"
+        state.record_yield(PLATFORM.MASTODON, LANGUAGE.ENGLISH, "worldnews", 0, 0, 10)
+        assert state.pick_source(PLATFORM.MASTODON, LANGUAGE.ENGLISH, SOURCES, "2023-01-02") == "news"
+        yields = state.yields(PLATFORM.MASTODON, LANGUAGE.ENGLISH)
+        assert yields["news"].n_picks == 1 and yields["news"].flows_per_request() == 0.8
+        state.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+
+from delab_trees.recursive_tree.recursive_tree import TreeNode
+
+from datasource.delab_tree_builder import DelabTreeBuilder
+from datasource.tree_assembly import ReplyTreeAssembler, assemble_recursive_tree
+
+
+class ReplyTreeAssemblyTestCase(unittest.TestCase):
+
+    def test_children_before_parents(self):
+        assembler = ReplyTreeAssembler("r")
+        assert not assembler.add("c", "b")
+        assert not assembler.add("b", "a")
+        assert assembler.add("a", "r")
+        assert assembler.flat_size() == 4
+        assert assembler.max_path_length == 3
+        assert len(assembler.orphan_report()) == 0
+
+    def test_orphan_report(self):
+        assembler = ReplyTreeAssembler("r")
+        assembler.add("a", "r")
+        assembler.add("x", "missing")
+        assembler.add("y", "x")
+        report = assembler.orphan_report()
+        assert len(report) == 2
+        assert report.missing_parent_ids == ["missing"]
+        assert "x" not in assembler
+
+    def test_recursive_tree(self):
+        root = TreeNode({"text": "root"}, 1, tree_id=1)
+        nodes = [TreeNode({"text": "b"}, 3, 2, tree_id=1),
+                 TreeNode({"text": "a"}, 2, 1, tree_id=1),
+                 TreeNode({"text": "c"}, 4, 1, tree_id=1)]
+        root, orphans = assemble_recursive_tree(root, nodes)
+        assert len(orphans) == 0
+        assert root.flat_size() == 4
+        assert [child.node_id for child in root.children] == [2, 4]
+        assert root.compute_max_path_length() == 2
+
+    def test_builder(self):
+        def record(text, author_id, minute):
+            return {"text": text, "author_id": author_id, "created_at": minute}
+
+        builder = DelabTreeBuilder("t", "r", record("root", 1, 0))
+        builder.add_post("b", "a", record("b", 1, 2))
+        builder.add_post("a", "r", dict(record("a", 2, 1), lang="en"))
+        builder.add_post("x", "missing", record("x", 3, 3))
+        assert builder.flat_size() == 3
+        assert builder.max_path_length() == 2
+        assert len(builder.orphan_report()) == 1
+        df = builder.to_dataframe()
+        assert list(df["post_id"]) == ["r", "a", "b"]
+        assert list(df["lang"].isna()) == [True, False, True]
+        tree = builder.to_delab_tree()
+        assert tree.validate(verbose=False)
+        assert tree.depth() == 3
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import importlib.util
+import tempfile
+import unittest
+
+import pandas as pd
+
+from datasource.delab_tree_builder import DelabTreeBuilder
+from models.language import LANGUAGE
+from models.platform import PLATFORM
+from tree_store import TreeStore
+
+
+def reply_chain(tree_id, n_posts):
+    start = pd.Timestamp("2023-01-01", tz="UTC")
+    builder = DelabTreeBuilder(tree_id, tree_id, {"text": "root", "author_id": 1, "created_at": start,
+                                                  "rd_data": {"score": 1}})
+    for post_id in range(tree_id + 1, tree_id + n_posts):
+        builder.add_post(post_id, post_id - 1, {"text": "reply", "author_id": post_id % 2,
+                                                "created_at": start + pd.Timedelta(minutes=post_id - tree_id),
+                                                "rd_data": {"score": 1}})
+    return builder.to_delab_tree()
+
+
+@unittest.skipUnless(importlib.util.find_spec("pyarrow"), "the tree store requires pyarrow")
+class TreeStoreTestCase(unittest.TestCase):
+
+    def test_partitioned_trees(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = TreeStore(directory)
+            store.write_trees([reply_chain(1, 3), reply_chain(10, 4)], PLATFORM.REDDIT, LANGUAGE.ENGLISH,
+                              day="2023-01-01")
+            store.write_trees([reply_chain(20, 2)], PLATFORM.REDDIT, LANGUAGE.GERMAN, day="2023-01-02")
+            df = store.read_trees(platform=PLATFORM.REDDIT, language=LANGUAGE.ENGLISH)
+            assert len(df) == 7 and "rd_data" not in df.columns
+            assert df["parent_id"].tolist()[:3] == [pd.NA, 1, 2] and df["post_id"].dtype == "int64"
+            assert len(store.read_trees(since="2023-01-02", columns=["post_id", "text"])) == 2
+            assert len(store.read_forest(language=LANGUAGE.ENGLISH).trees) == 2
+
+    def test_forest_of_several_runs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = TreeStore(directory)
+            # the same tree downloaded on two days and another tree with the same ids on another platform
+            store.write_trees([reply_chain(1, 3)], PLATFORM.REDDIT, day="2023-01-01")
+            store.write_trees([reply_chain(1, 3)], PLATFORM.REDDIT, day="2023-01-02")
+            store.write_trees([reply_chain(1, 4)], PLATFORM.MASTODON, day="2023-01-02")
+            trees = [store.read_forest(platform=platform).trees[1]
+                     for platform in [PLATFORM.REDDIT, PLATFORM.MASTODON]]
+            assert [tree.total_number_of_posts() for tree in trees] == [3, 4]
+            assert all(tree.validate(verbose=False) for tree in trees)
+            # a TreeManager cannot hold both
+            with self.assertRaises(ValueError):
+                store.read_forest()
+            # a post 3 below the root conflicts with the post 3 below post 2 stored before
+            builder = DelabTreeBuilder(1, 1, {"text": "root", "author_id": 1,
+                                              "created_at": pd.Timestamp("2023-01-01", tz="UTC")})
+            builder.add_post(3, 1, {"text": "reply", "author_id": 2,
+                                    "created_at": pd.Timestamp("2023-01-02", tz="UTC")})
+            store.write_trees([builder.to_delab_tree()], PLATFORM.MASTODON, day="2023-01-03")
+            with self.assertRaises(ValueError):
+                store.read_forest(platform=PLATFORM.MASTODON)
+
+    def test_flows(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = TreeStore(directory)
+            flows = reply_chain(1, 5).get_flow_candidates(3) + reply_chain(10, 4).get_flow_candidates(3)
+            store.write_flows(flows, PLATFORM.MASTODON, LANGUAGE.GERMAN)
+            stored = store.read_flows(platform=PLATFORM.MASTODON)
+            assert [[post.post_id for post in flow] for flow in stored] == \
+                   [[post.post_id for post in flow] for flow in flows]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+from datasource.twitter.download_conversations_twitter import create_builder_from_raw_tweet_stream, \
+    lookup_root_tweets, rank_tweet_candidates
+from download_exceptions import ConversationNotInRangeException
+from tests.fake_twarc import FakeTwarc, fake_tweet
+
+
+def branching_conversation():
+    """
+    :return: the root 1 and 6 replies, 2 and 5 reply to the root, the others continue the branches
+    """
+    edges = [(2, 1), (3, 2), (4, 3), (5, 1), (6, 5), (7, 4)]
+    return [fake_tweet(1)] + [fake_tweet(child, parent, 1, minute=child) for child, parent in edges]
+
+
+class TweetDownloadTestCase(unittest.TestCase):
+
+    def test_tree_assembled_while_pages_stream_in(self):
+        tweets = branching_conversation()
+        twarc = FakeTwarc(tweets, page_size=2)
+        builder = create_builder_from_raw_tweet_stream("1", 100, tweets[0], twarc)
+        # the newest replies of the first pages wait in the builder until their parents arrive
+        assert twarc.n_search_pages == 3 and len(builder.orphan_report()) == 0
+        assert builder.flat_size() == 7 and builder.max_path_length() == 4
+        tree = builder.to_delab_tree()
+        assert tree.total_number_of_posts() == 7 and tree.validate(verbose=False)
+
+    def test_stream_stops_when_too_large(self):
+        tweets = branching_conversation()
+        twarc = FakeTwarc(tweets, page_size=2)
+        with self.assertRaises(ConversationNotInRangeException):
+            create_builder_from_raw_tweet_stream("1", 4, tweets[0], twarc)
+        # the third page is never requested
+        assert twarc.n_search_pages == 2
+
+    def test_root_lookup_in_batches(self):
+        # the roots of every tenth conversation were deleted
+        twarc = FakeTwarc([fake_tweet(tweet_id) for tweet_id in range(250) if tweet_id % 10 != 0])
+        # candidates of the same conversation repeat its id, as int or str
+        conversation_ids = list(range(250)) + [str(tweet_id) for tweet_id in range(50)]
+        roots = lookup_root_tweets(twarc, conversation_ids)
+        assert [len(ids) for ids in twarc.lookups] == [100, 100, 50]
+        assert sorted(sum(twarc.lookups, [])) == sorted(str(tweet_id) for tweet_id in range(250))
+        assert len(roots) == 225 and "10" not in roots and roots["11"]["id"] == "11"
+
+    def test_candidate_bounds(self):
+        candidates = [{"id": str(reply_count), "public_metrics": {"reply_count": reply_count}}
+                      for reply_count in range(12)]
+        # the same candidates as the filter min_conversation_length / 2 < reply_count < max_conversation_length
+        for min_length, max_length in [(5, 10), (6, 9)]:
+            expected = [candidate["id"] for candidate in reversed(candidates)
+                        if min_length / 2 < candidate["public_metrics"]["reply_count"] < max_length]
+            assert [candidate["id"] for candidate in rank_tweet_candidates(candidates, min_length, max_length)] == \
+                   expected
+
+
+if __name__ == '__main__':
+    unittest.main()
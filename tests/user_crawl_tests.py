@@ -0,0 +1,107 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from datasource.reddit.download_user_conversations import get_user_conversations, hydrate_submissions, \
+    list_user_submission_ids
+from job_checkpoints import JobCheckpoint
+from tests.fake_reddit import FakeSubmission, reply_chain
+
+
+class CountingListing:
+    def __init__(self, things):
+        self.things = things
+        self.n_read = 0
+
+    def __call__(self, limit=None):
+        for thing in self.things:
+            self.n_read += 1
+            yield thing
+
+
+class FakeReddit:
+    """
+    a user with a pinned old submission and comments on the submissions c0, c0, c1, c2, ... from new to old
+    """
+
+    def __init__(self, n_comments=1000):
+        self.comments = CountingListing([SimpleNamespace(link_id="t3_c{}".format(max(i - 1, 0)),
+                                                         created_utc=2000 - i) for i in range(n_comments)])
+        self.submissions = CountingListing([SimpleNamespace(id="pinned", created_utc=10, stickied=True),
+                                            SimpleNamespace(id="s0", created_utc=1999),
+                                            SimpleNamespace(id="old", created_utc=100)])
+        self.info_requests = []
+
+    def redditor(self, name):
+        return SimpleNamespace(comments=SimpleNamespace(new=self.comments),
+                               submissions=SimpleNamespace(new=self.submissions))
+
+    def info(self, fullnames):
+        self.info_requests.append(fullnames)
+        return [SimpleNamespace(id=fullname[3:]) for fullname in fullnames]
+
+
+class FakeUserReddit(FakeReddit):
+    """
+    a user who commented on the submissions c0, c1, ..., info returns them with their comments
+    """
+
+    def __init__(self, submissions):
+        super().__init__(n_comments=0)
+        self.comments = CountingListing([SimpleNamespace(link_id=submission.fullname, created_utc=2000)
+                                         for submission in submissions])
+        self.submissions = CountingListing([])
+        self.by_fullname = {submission.fullname: submission for submission in submissions}
+
+    def info(self, fullnames):
+        self.info_requests.append(fullnames)
+        return [self.by_fullname[fullname] for fullname in fullnames]
+
+    def copy(self):
+        return self
+
+
+class UserCrawlTestCase(unittest.TestCase):
+
+    def test_crawl_stops_at_cap(self):
+        reddit = FakeReddit()
+        ids = list_user_submission_ids(reddit, "user", start_date=0, max_conversations=5)
+        assert ids == ["c0", "c1", "c2", "c3", "c4"]
+        # no comment after the fifth submission is read, the submissions are not read
+        assert reddit.comments.n_read == 6 and reddit.submissions.n_read == 0
+
+    def test_crawl_stops_at_start_date(self):
+        reddit = FakeReddit()
+        ids = list_user_submission_ids(reddit, "user", start_date=1995, max_conversations=100)
+        assert ids == ["c0", "c1", "c2", "c3", "c4", "s0"]
+        assert reddit.comments.n_read == 7 and reddit.submissions.n_read == 3
+
+    def test_hydration_in_batches(self):
+        reddit = FakeReddit()
+        submissions = list(hydrate_submissions(reddit, ["c{}".format(i) for i in range(250)]))
+        assert [len(fullnames) for fullnames in reddit.info_requests] == [100, 100, 50]
+        assert submissions[0].id == "c0" and len(submissions) == 250
+
+
+    def test_conversations_ranked_before_expansion(self):
+        submissions = [FakeSubmission("c0", [reply_chain("c0", 6)]), FakeSubmission("c1", [reply_chain("c1", 8)]),
+                       FakeSubmission("c2", num_comments=1), FakeSubmission("c3", num_comments=200)]
+        # the comments of the submissions that cannot meet the tree requirements are never loaded
+        for submission in submissions[2:]:
+            submission.comments = None
+        reddit = FakeUserReddit(submissions)
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = JobCheckpoint("user", path=os.path.join(directory, "jobs.sqlite"))
+            trees = get_user_conversations("user", start_date=0, reddit=reddit, checkpoint=checkpoint)
+            assert [tree.total_number_of_posts() for tree in trees] == [7, 9]
+            assert len(reddit.info_requests) == 1
+            # the rejected submissions are done as well, a restart sends no request
+            assert all(checkpoint.is_done(submission.id) for submission in submissions)
+            assert len(get_user_conversations("user", start_date=0, reddit=reddit, checkpoint=checkpoint)) == 2
+            assert len(reddit.info_requests) == 1
+            checkpoint.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
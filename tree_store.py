@@ -0,0 +1,236 @@
+import datetime
+import logging
+import os
+import uuid
+
+import pandas as pd
+
+from api_settings import TREE_STORE_PATH
+from datasource.normalization import normalize_ids
+from delab_trees import TreeManager
+from delab_trees.delab_post import DelabPost
+from delab_trees.delab_tree import DelabTree
+from models.language import LANGUAGE
+
+logger = logging.getLogger(__name__)
+
+TREES = "trees"
+FLOWS = "flows"
+
+# the partitions of a dataset, e.g. trees/platform=reddit/language=en/date=2023-05-01/part-<uuid>.parquet
+PARTITION_COLUMNS = ("platform", "language", "date")
+
+# ids are stored as strings so that the files of all platforms have the same schema, even if the ids of one platform
+# are not numbers, they are read back as the int64 columns of datasource.normalization where they are numeric
+ID_COLUMNS = ("tree_id", "post_id", "parent_id", "author_id")
+STRING_COLUMNS = ("text", "lang", "url", "tw_author__name", "reddit_id")
+# rd_data holds a dict or the praw object of a reddit post, the post can be fetched again by its reddit_id
+DROPPED_COLUMNS = ("rd_data",)
+FLOW_COLUMNS = ("flow_id", "position", "tree_id", "post_id", "parent_id", "author_id", "text", "created_at")
+
+
+class TreeStore:
+    """
+    Appends batches of downloaded trees and sampled flows to Parquet files, partitioned by platform,
+    language and date (in hive style, so the directories can also be read by spark, duckdb or pandas).
+    Every batch is written to a new file, so that several processes can write to the same store.
+    Requires pyarrow.
+    """
+
+    def __init__(self, path=TREE_STORE_PATH):
+        self.path = path
+
+    def __str__(self):
+        return "TreeStore {}".format(self.path)
+
+    def write_trees(self, trees, platform, language=LANGUAGE.UNKNOWN, day=None):
+        """
+        :param trees: list of DelabTree
+        :param platform: PLATFORM
+        :param language: LANGUAGE of the sample
+        :param day: datetime.date or ISO date of the partition, today if None
+        :return: the path of the written file, None if there were no posts
+        """
+        frames = [tree.df for tree in trees]
+        if len(frames) == 0:
+            return None
+        return self.__write(TREES, tree_table(pd.concat(frames, ignore_index=True)), platform, language, day)
+
+    def write_flows(self, flows, platform, language=LANGUAGE.UNKNOWN, day=None):
+        """
+        :param flows: list of list of DelabPost as returned by download_samples
+        :param platform:
+        :param language:
+        :param day: see write_trees
+        :return: the path of the written file, None if there were no flows
+        """
+        if len(flows) == 0:
+            return None
+        return self.__write(FLOWS, flow_table(flows), platform, language, day)
+
+    def read_trees(self, platform=None, language=None, since=None, until=None, columns=None):
+        """
+        reads the posts of the matching partitions, the others are not opened
+        :param platform: None reads all platforms
+        :param language: None reads all languages
+        :param since: first day (datetime.date or ISO date) to read
+        :param until: last day to read
+        :param columns: the columns to read, all if None
+        :return: pd.DataFrame with a row per post and the partition columns
+        """
+        return self.__read(TREES, platform, language, since, until, columns)
+
+    def read_forest(self, platform=None, language=None, since=None, until=None):
+        """
+        :return: TreeManager with the trees of the matching partitions, a tree stored more than once
+        (e.g. on two days) is read once
+        :raises ValueError: if a tree has different posts with the same id (see unique_posts) or if trees of
+        two platforms have the same id, the TreeManager holds one tree per id (read the platforms one by one)
+        """
+        df = self.read_trees(platform, language, since, until)
+        trees = {}
+        for (tree_platform, tree_id), tree_df in df.groupby(["platform", "tree_id"], sort=False, observed=True):
+            if tree_id in trees:
+                raise ValueError("tree {} is stored for several platforms".format(tree_id))
+            trees[tree_id] = DelabTree(unique_posts(tree_df, tree_platform, tree_id))
+        return TreeManager.from_trees(list(trees.values()))
+
+    def read_flows(self, platform=None, language=None, since=None, until=None):
+        """
+        :return: list of list of DelabPost in the order they were written
+        """
+        df = self.__read(FLOWS, platform, language, since, until, list(FLOW_COLUMNS))
+        flows = []
+        for _, flow_df in df.groupby("flow_id", sort=False):
+            flows.append([DelabPost(row.post_id, row.parent_id, row.text, row.tree_id, row.author_id, row.created_at)
+                          for row in flow_df.sort_values("position").itertuples()])
+        return flows
+
+    def __write(self, dataset, table, platform, language, day):
+        import pyarrow.parquet as pq
+
+        directory = os.path.join(self.path, dataset, "platform={}".format(platform),
+                                 "language={}".format(language), "date={}".format(partition_day(day)))
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "part-{}.parquet".format(uuid.uuid4().hex))
+        # written under a temporary name, so that readers never see a partial file
+        pq.write_table(table, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        logger.debug("wrote {} rows to {}".format(table.num_rows, path))
+        return path
+
+    def __read(self, dataset, platform, language, since, until, columns):
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        directory = os.path.join(self.path, dataset)
+        if not os.path.isdir(directory):
+            return pd.DataFrame(columns=columns)
+        partitioning = ds.partitioning(pa.schema([(name, pa.string()) for name in PARTITION_COLUMNS]),
+                                       flavor="hive")
+        expression = None
+        for condition in partition_filters(platform, language, since, until):
+            expression = condition if expression is None else expression & condition
+        data = ds.dataset(directory, format="parquet", partitioning=partitioning)
+        fragments = list(data.get_fragments(filter=expression))
+        if len(fragments) == 0:
+            return pd.DataFrame(columns=columns)
+        # the batches of a dataset can have different extra columns
+        schema = pa.unify_schemas([fragment.physical_schema for fragment in fragments] + [partitioning.schema])
+        data = ds.dataset([fragment.path for fragment in fragments], schema=schema, format="parquet",
+                          partitioning=partitioning, partition_base_dir=directory)
+        df = data.to_table(columns=columns, filter=expression).to_pandas()
+        for name in ID_COLUMNS:
+            if name in df.columns:
+                df[name] = normalize_ids(df[name])
+        return df
+
+
+def unique_posts(tree_df, platform, tree_id):
+    """
+    :param tree_df: the stored posts of one tree
+    :return: the posts of the tree with every post once, the copy stored last is kept
+    :raises ValueError: if two posts with the same id have different parents, the tree would be invalid
+    """
+    posts = tree_df.drop_duplicates(["post_id", "parent_id"], keep="last")
+    if posts["post_id"].duplicated().any():
+        raise ValueError("tree {} of {} has different posts with the same id".format(tree_id, platform))
+    if len(posts) < len(tree_df):
+        logger.debug("tree {} of {} was stored {} times".format(tree_id, platform, len(tree_df) // len(posts)))
+    return posts.reset_index(drop=True)
+
+
+def partition_day(day):
+    if day is None:
+        day = datetime.date.today()
+    if isinstance(day, datetime.date):
+        day = day.isoformat()
+    return day
+
+
+def partition_filters(platform, language, since, until):
+    import pyarrow.dataset as ds
+
+    # ISO dates compare like the days they stand for
+    filters = []
+    if platform is not None:
+        filters.append(ds.field("platform") == platform)
+    if language is not None:
+        filters.append(ds.field("language") == language)
+    if since is not None:
+        filters.append(ds.field("date") >= partition_day(since))
+    if until is not None:
+        filters.append(ds.field("date") <= partition_day(until))
+    return filters
+
+
+def tree_table(df):
+    """
+    :param df: the concatenated tables of DelabTrees
+    :return: pyarrow.Table with string ids and utc timestamps, other columns are kept if arrow can store them
+    """
+    import pyarrow as pa
+
+    arrays = {}
+    for name in df.columns:
+        if name in DROPPED_COLUMNS:
+            continue
+        if name in ID_COLUMNS:
+            arrays[name] = id_array(df[name])
+        elif name == "created_at":
+            arrays[name] = pa.array(pd.to_datetime(df[name], utc=True), type=pa.timestamp("us", tz="UTC"))
+        elif name in STRING_COLUMNS:
+            arrays[name] = pa.array(df[name].astype(object).where(df[name].notna(), None), type=pa.string())
+        else:
+            try:
+                arrays[name] = pa.array(df[name], from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                logger.debug("column {} cannot be stored in parquet".format(name))
+    return pa.table(arrays)
+
+
+def flow_table(flows):
+    import pyarrow as pa
+
+    # the flows of one batch are numbered within the file they are written to
+    batch_id = uuid.uuid4().hex
+    columns = {name: [] for name in FLOW_COLUMNS}
+    for flow_index, flow in enumerate(flows):
+        for position, post in enumerate(flow):
+            columns["flow_id"].append("{}-{}".format(batch_id, flow_index))
+            columns["position"].append(position)
+            for name in FLOW_COLUMNS[2:]:
+                columns[name].append(getattr(post, name))
+    return pa.table({"flow_id": pa.array(columns["flow_id"], type=pa.string()),
+                     "position": pa.array(columns["position"], type=pa.int32()),
+                     **{name: id_array(pd.Series(columns[name], dtype=object)) for name in ID_COLUMNS},
+                     "text": pa.array(columns["text"], type=pa.string()),
+                     "created_at": pa.array(pd.to_datetime(pd.Series(columns["created_at"]), utc=True),
+                                            type=pa.timestamp("us", tz="UTC"))})
+
+
+def id_array(values):
+    import pyarrow as pa
+
+    # ints are converted one by one, as a column of ints with a missing parent would pass through float
+    return pa.array([None if pd.isna(value) else str(value) for value in values], type=pa.string())